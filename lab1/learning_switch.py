@@ -19,12 +19,50 @@ from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
+from ryu.lib import hub
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import ipv4
 from ryu.lib.packet import arp
 from ryu.lib.mac import haddr_to_bin
 from ryu.lib.packet import ether_types
+from ryu.topology import event
+from ryu.topology.api import get_switch, get_link
+from collections import OrderedDict, defaultdict
+import time
+
+# Group of every switch that floods over its host ports and spanning tree ports
+FLOOD_GROUP = 1
+
+# Bytes of a table miss sent to the controller, the switch buffers the packet: enough for the headers
+MISS_SEND_LEN = 128
+
+
+# Spanning tree of the switches 'dpids' over the undirected 'links', given as ((dpid, port), (dpid, port)),
+# as a set of links. The links of the 'previous' tree that still exist are taken first, so a topology
+# change only replaces the tree links it broke, or adds links to switches that joined.
+def spanning_tree(dpids, links, previous=()):
+    root = {dpid: dpid for dpid in dpids}
+
+    def find(dpid):
+        while root[dpid] != dpid:
+            root[dpid] = root[root[dpid]]
+            dpid = root[dpid]
+        return dpid
+
+    kept = links & set(previous)
+    tree = set()
+    for link in sorted(kept) + sorted(links - kept):
+        (a, _), (b, _) = link
+        if a not in root or b not in root:
+            continue
+
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            root[root_a] = root_b
+            tree.add(link)
+
+    return tree
 
 
 class LearningSwitch(app_manager.RyuApp):
@@ -36,6 +74,45 @@ class LearningSwitch(app_manager.RyuApp):
         # Initialize mac address table
         self.mac_to_port = {}
 
+        # Flow entries expire after idle_timeout seconds without traffic and hard_timeout seconds in
+        # total (0 disables a timeout). The switch reports removed entries, and a mac that no entry
+        # refers to any more is forgotten, so a host that moved or left is learned again.
+        self.idle_timeout = 30
+        self.hard_timeout = 300
+
+        # At most flow_budget entries per switch; the oldest entry is evicted to make room
+        self.flow_budget = 1000
+
+        # Installed entries per switch, oldest first: (in_port, src, dst) -> out_port, and the
+        # number of entries that refer to every mac, dpid -> mac -> count
+        self.flows = defaultdict(OrderedDict)
+        self.mac_refs = defaultdict(lambda: defaultdict(int))
+
+        self.packet_ins = 0
+        self.evicted = 0
+        self.expired = 0
+
+        # Flooding follows a spanning tree of the switch links found by topology discovery
+        # (ryu-manager --observe-links), so broadcasts do not loop on topologies with multiple paths.
+        # Every switch floods through an ALL group over its host ports and tree ports, which is only
+        # modified on the switches whose ports changed. Until its group exists, a switch does not flood.
+        # A port that discovery has not found a link on is a host port only once it has been up for
+        # discovery_delay seconds: the switches app sends LLDP out of a new port right away, so by then
+        # a link on it would have been found. Until then the port is left out of the group, otherwise a
+        # switch that just entered would flood over all of its fabric ports. Broadcasts that arrive on
+        # such a port are not flooded (flood_held), hosts send their ARP requests again.
+        # Without --observe-links discovery finds no links and every port ends up a host port, which
+        # floods as OFPP_FLOOD does; with more than one switch that is logged as a warning.
+        self.tree_links = set()
+        self.flood_ports = {}
+        self.discovery_delay = 2.0
+        self.port_seen = {}
+        self.undiscovered = set()
+        self.flood_update = None
+        self.flood_held = 0
+        self.links_found = False
+        self.no_links_warned = False
+
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
 
@@ -46,20 +123,168 @@ class LearningSwitch(app_manager.RyuApp):
         # Initial flow entry for matching misses
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
+                                          MISS_SEND_LEN)]
         self.add_flow(datapath, 0, match, actions)
 
+        # a reconnecting switch gets its flood group again, after its ports have been discovered again
+        datapath.send_msg(parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE, ofproto.OFPGT_ALL, ofproto.OFPG_ALL, []))
+        self.flood_ports.pop(datapath.id, None)
+        for key in [key for key in self.port_seen if key[0] == datapath.id]:
+            del self.port_seen[key]
+
+    # Recompute the spanning tree and update the flood groups whose ports changed
+    @set_ev_cls([event.EventSwitchEnter, event.EventSwitchLeave, event.EventPortAdd, event.EventPortDelete,
+                 event.EventLinkAdd, event.EventLinkDelete])
+    def topology_change_handler(self, ev):
+        self.update_flood_groups()
+
+    # The undiscovered ports of the last update are due
+    def discovery_delay_over(self):
+        self.flood_update = None
+        self.update_flood_groups()
+
+    def update_flood_groups(self):
+        switches = get_switch(self, None)
+        links = get_link(self, None)
+        now = time.monotonic()
+
+        # discovery reports both directions of a link
+        fabric = {tuple(sorted([(link.src.dpid, link.src.port_no), (link.dst.dpid, link.dst.port_no)]))
+                  for link in links}
+        self.tree_links = spanning_tree([switch.dp.id for switch in switches], fabric, self.tree_links)
+
+        fabric_ports = {end for link in fabric for end in link}
+        tree_ports = {end for link in self.tree_links for end in link}
+
+        # ports of all switches, with the time they were first seen
+        ports_up = {(switch.dp.id, port.port_no) for switch in switches for port in switch.ports}
+        self.port_seen = {end: self.port_seen.get(end, now) for end in ports_up}
+        undiscovered = {end for end in ports_up - fabric_ports if now - self.port_seen[end] < self.discovery_delay}
+        self.undiscovered = undiscovered
+
+        self.links_found = self.links_found or bool(fabric)
+        if len(switches) > 1 and not self.links_found and ports_up - undiscovered and not self.no_links_warned:
+            self.logger.warning("no links between the %d switches discovered after %.0f s, flooding over all of "
+                                "their ports; start the app with ryu-manager --observe-links",
+                                len(switches), self.discovery_delay)
+            self.no_links_warned = True
+
+        for switch in switches:
+            dpid = switch.dp.id
+            ports = tuple(sorted(port.port_no for port in switch.ports
+                                 if (dpid, port.port_no) in tree_ports or
+                                 ((dpid, port.port_no) not in fabric_ports and (dpid, port.port_no) not in undiscovered)))
+            if self.flood_ports.get(dpid) != ports:
+                self.set_flood_group(switch.dp, ports, dpid not in self.flood_ports)
+                self.flood_ports[dpid] = ports
+
+        for dpid in set(self.flood_ports) - {switch.dp.id for switch in switches}:
+            del self.flood_ports[dpid]
+
+        # the undiscovered ports join the groups when their delay is over, unless a link turns up first
+        if undiscovered and self.flood_update is None:
+            wait = max(self.discovery_delay - (now - self.port_seen[end]) for end in undiscovered)
+            self.flood_update = hub.spawn_after(wait, self.discovery_delay_over)
+
+    def set_flood_group(self, datapath, ports, new):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        # the switch never sends a packet back out of its ingress port, like OFPP_FLOOD
+        buckets = [parser.OFPBucket(actions=[parser.OFPActionOutput(port)]) for port in ports]
+        command = ofproto.OFPGC_ADD if new else ofproto.OFPGC_MODIFY
+        datapath.send_msg(parser.OFPGroupMod(datapath, command, ofproto.OFPGT_ALL, FLOOD_GROUP, buckets))
+
+    # Flood through the group of the switch; packets that arrive on a port outside the spanning
+    # tree are not flooded, or they would loop
+    def flood_actions(self, datapath, in_port):
+        parser = datapath.ofproto_parser
+
+        if in_port not in self.flood_ports.get(datapath.id, ()):
+            # the switch has no group yet, or discovery has not placed the port yet
+            if datapath.id not in self.flood_ports or (datapath.id, in_port) in self.undiscovered:
+                self.flood_held += 1
+                self.logger.debug("switch %s: not flooding from port %s until discovery has placed it",
+                                  datapath.id, in_port)
+            return []
+        return [parser.OFPActionGroup(FLOOD_GROUP)]
+
     # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+    def add_flow(self, datapath, priority, match, actions, idle_timeout=0, hard_timeout=0, flags=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         # Construct flow_mod message and send it
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout, flags=flags,
                                 match=match, instructions=inst)
         datapath.send_msg(mod)
 
+    # Install the entry in_port, src -> dst out of out_port, within the flow budget of the switch
+    def add_mac_flow(self, datapath, in_port, src, dst, out_port):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        flows = self.flows[datapath.id]
+
+        # a new entry refers to its macs before any eviction, so they are not forgotten meanwhile;
+        # installing an entry again replaces it on the switch and makes it the newest
+        key = (in_port, src, dst)
+        if key not in flows:
+            self.mac_refs[datapath.id][src] += 1
+            self.mac_refs[datapath.id][dst] += 1
+            while len(flows) >= self.flow_budget:
+                self.evict_flow(datapath, next(iter(flows)))
+
+        match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_src=src)
+        actions = [parser.OFPActionOutput(out_port)]
+        self.add_flow(datapath, ofproto.OFP_DEFAULT_PRIORITY, match, actions, self.idle_timeout,
+                      self.hard_timeout, ofproto.OFPFF_SEND_FLOW_REM)
+
+        flows[key] = out_port
+        flows.move_to_end(key)
+
+    # Delete an entry from the switch to make room; its flow-removed message finds it already gone
+    def evict_flow(self, datapath, key):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        in_port, src, dst = key
+        match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_src=src)
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT,
+                                priority=ofproto.OFP_DEFAULT_PRIORITY, out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY, match=match)
+        datapath.send_msg(mod)
+
+        self.forget_flow(datapath.id, key)
+        self.evicted += 1
+
+    # Drop an entry from the tables of a switch, and the macs that no entry refers to any more
+    def forget_flow(self, dpid, key):
+        if self.flows[dpid].pop(key, None) is None:
+            return
+
+        _, src, dst = key
+        refs = self.mac_refs[dpid]
+        for mac in (src, dst):
+            refs[mac] -= 1
+            if refs[mac] <= 0:
+                del refs[mac]
+                self.mac_to_port.get(dpid, {}).pop(mac, None)
+
+    # An entry timed out (or was deleted) on the switch
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+
+        if 'eth_src' not in msg.match or 'eth_dst' not in msg.match:
+            return
+
+        if msg.reason in (ofproto.OFPRR_IDLE_TIMEOUT, ofproto.OFPRR_HARD_TIMEOUT):
+            self.expired += 1
+        self.forget_flow(msg.datapath.id, (msg.match['in_port'], msg.match['eth_src'], msg.match['eth_dst']))
+
     # Handle the packet_in event
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -80,7 +305,12 @@ class LearningSwitch(app_manager.RyuApp):
         dst = eth.dst
         src = eth.src
 
+        # LLDP of the topology discovery
+        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
+
         self.mac_to_port.setdefault(dpid, {})
+        self.packet_ins += 1
 
         self.logger.info("packet in %s %s %s %s", dpid, src, dst, msg.match['in_port'])
 
@@ -90,20 +320,21 @@ class LearningSwitch(app_manager.RyuApp):
 
         if dst in self.mac_to_port[dpid]:
             out_port = self.mac_to_port[dpid][dst]
+            actions = [parser.OFPActionOutput(out_port)]
         else:
             out_port = ofproto.OFPP_FLOOD
+            actions = self.flood_actions(datapath, msg.match['in_port'])
 
-        actions = [parser.OFPActionOutput(out_port)]
-
-        priority = ofproto.OFP_DEFAULT_PRIORITY
-
-        match = parser.OFPMatch(in_port=msg.match['in_port'],
-                                eth_dst=dst,
-                                eth_src=src)
-        # install a flow to avoid packet_in next time
+        # install a flow to avoid packet_in next time, and the reverse flow if both ends are
+        # known, so the replies of the conversation do not come to the controller either
         if out_port != ofproto.OFPP_FLOOD:
-            self.add_flow(datapath, priority, match, actions)
+            in_port = msg.match['in_port']
+            self.add_mac_flow(datapath, in_port, src, dst, out_port)
+            if self.mac_to_port[dpid].get(src) == in_port:
+                self.add_mac_flow(datapath, out_port, dst, src, in_port)
 
+        # a buffered packet is sent by its buffer id; otherwise the switch sent the whole packet,
+        # which goes back as it is
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
@@ -112,8 +343,8 @@ class LearningSwitch(app_manager.RyuApp):
         out = parser.OFPPacketOut(datapath=datapath,
                                   in_port=msg.match['in_port'],
                                   actions=actions,
-                                  buffer_id=datapath.ofproto.OFP_NO_BUFFER,
-                                  data=msg.data)
+                                  buffer_id=msg.buffer_id,
+                                  data=data)
         datapath.send_msg(out)
         # ofproto_v1_2.OXM_OF_IN_PORT
         # in_port = msg.match['in_port']
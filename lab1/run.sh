@@ -16,4 +16,8 @@
 
 #!/bin/sh
 
+# Start the controller first, with topology discovery: the flood groups of learning_switch.py follow a
+# spanning tree of the links it finds, without it every port floods
+#   $ ryu-manager --observe-links learning_switch.py
+
 sudo mn --custom ../lab0/network_bridge.py --topo bridge --link=tc --controller=remote --switch=ovsk --mac
@@ -0,0 +1,57 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+# Build a symmetric sparse adjacency matrix over the live links of a topo graph.
+# Row/column i corresponds to nodes[i], with the servers first and the switches after them.
+# Parallel links are kept as a multiplicity, self loops are dropped.
+def adjacency_matrix(servers, switches):
+    nodes = list(servers) + list(switches)
+    index = {id(node): i for i, node in enumerate(nodes)}
+
+    seen = set()
+    rows = []
+    cols = []
+
+    for node in nodes:
+        for edge in node.edges:
+            if id(edge) in seen:
+                continue
+            seen.add(id(edge))
+
+            lnode, rnode = edge.lnode, edge.rnode
+
+            # both ends must be part of the graph
+            if id(lnode) not in index or id(rnode) not in index or lnode is rnode:
+                continue
+
+            # randomly_disconnet only unlinks an edge at one end, such an edge is not a link anymore
+            if not any(e is edge for e in lnode.edges) or not any(e is edge for e in rnode.edges):
+                continue
+
+            rows.append(index[id(lnode)])
+            cols.append(index[id(rnode)])
+
+    rows, cols = np.array(rows + cols, dtype=np.int32), np.array(cols + rows, dtype=np.int32)
+    data = np.ones(len(rows), dtype=np.int32)
+
+    # duplicate (row, col) entries are summed, so parallel links add up
+    matrix = csr_matrix((data, (rows, cols)), shape=(len(nodes), len(nodes)))
+    matrix.sum_duplicates()
+
+    return nodes, matrix
+
+
+# For every server, the index of the switch (in 'switches') it is attached to, or -1 if unconnected.
+def server_attachment(servers, switches):
+    index = {id(switch): i for i, switch in enumerate(switches)}
+    attachment = np.full(len(servers), -1, dtype=np.int64)
+
+    for i, server in enumerate(servers):
+        for edge in server.edges:
+            other = edge.rnode if edge.lnode is server else edge.lnode
+            if id(other) in index and any(e is edge for e in other.edges):
+                attachment[i] = index[id(other)]
+                break
+
+    return attachment
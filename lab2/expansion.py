@@ -0,0 +1,128 @@
+import sys
+
+import numpy as np
+
+import topo
+from adjacency import adjacency_matrix
+from failures import bfs_paths
+
+
+# Tracks the switch-to-switch distance matrix of a Jellyfish network while it is expanded with
+# Jellyfish.expand. After every step only the BFS rows that can have changed are recomputed:
+#   - rows from the new switches,
+#   - rows in which a node lost all of its shortest-path predecessors because of a broken link.
+# All other rows can only get shorter through the new switches, which is a vectorized min().
+class ExpansionTracker:
+
+    def __init__(self, jellyfish):
+        self.jellyfish = jellyfish
+
+        _, self.adjacency = adjacency_matrix([], jellyfish.switches)
+        self.dist, _ = bfs_paths(self.adjacency, np.arange(len(jellyfish.switches)))
+
+        self.history = []
+        self.record(0, len(jellyfish.switches))
+
+    def step(self, m, servers_per_switch=0):
+        n_old = self.dist.shape[0]
+        new_switches, removed_links = self.jellyfish.expand(m, servers_per_switch)
+
+        _, adjacency = adjacency_matrix([], self.jellyfish.switches)
+        n = adjacency.shape[0]
+        old_dist = self.dist
+
+        # links between two old switches that were broken; links to new switches are not in old_dist
+        removed = np.array([(x.id, y.id) for x, y in removed_links if x.id < n_old and y.id < n_old],
+                           dtype=np.int64).reshape(-1, 2)
+
+        affected = np.zeros(n_old, dtype=bool)
+
+        for x, y in np.concatenate([removed, removed[:, ::-1]]):
+            # sources for which the broken link led from x to y on a shortest path
+            tight = old_dist[:, y] == old_dist[:, x] + 1
+
+            if not tight.any():
+                continue
+
+            # y keeps its distance if another old neighbour is still one hop closer to the source
+            neighbors = adjacency.indices[adjacency.indptr[y]:adjacency.indptr[y + 1]]
+            neighbors = neighbors[neighbors < n_old]
+            has_predecessor = (old_dist[:, neighbors] == old_dist[:, [y]] - 1).any(axis=1)
+
+            affected |= tight & ~has_predecessor
+
+        # exact rows for the new switches and the affected sources
+        new_rows = np.arange(n_old, n)
+        affected_rows = np.flatnonzero(affected)
+        recomputed, _ = bfs_paths(adjacency, np.concatenate([new_rows, affected_rows]))
+        from_new = recomputed[:len(new_rows)]
+
+        dist = np.empty((n, n))
+        dist[:n_old, :n_old] = old_dist
+        dist[n_old:, :] = from_new
+        dist[:, n_old:] = from_new.T
+
+        # every other path that got shorter now passes through one of the new switches
+        if len(new_rows):
+            through_new = (from_new[:, :n_old, None] + from_new[:, None, :n_old]).min(axis=0)
+            np.minimum(dist[:n_old, :n_old], through_new, out=dist[:n_old, :n_old])
+
+        dist[affected_rows, :] = recomputed[len(new_rows):]
+        dist[:, affected_rows] = recomputed[len(new_rows):].T
+
+        self.adjacency = adjacency
+        self.dist = dist
+
+        self.record(len(new_switches), len(affected_rows))
+
+    # Mean switch-to-switch path length and a throughput proxy: the rate every switch can send to
+    # uniformly random destinations, when all (directed) link capacity is shared by the hops of all flows
+    def record(self, added, recomputed):
+        n = self.dist.shape[0]
+        u, v = np.triu_indices(n, k=1)
+
+        path_lengths = self.dist[u, v]
+        path_lengths = path_lengths[np.isfinite(path_lengths)]
+        mean_path_length = path_lengths.mean() if len(path_lengths) else 0.0
+
+        links = self.adjacency.sum() / 2
+        throughput = 2 * links / (n * mean_path_length) if mean_path_length else 0.0
+
+        self.history.append({'switches': n, 'links': int(links), 'added': added, 'recomputed': recomputed,
+                             'path_length': float(mean_path_length), 'throughput': float(throughput)})
+
+
+def report_expansion(history):
+    print()
+    print('-----------------------------------------------------------------------')
+    print('|  Step  | Switches |  Links  | Recomputed rows | Path length | Thrpt. |')
+    print('-----------------------------------------------------------------------')
+
+    for step, entry in enumerate(history):
+        print(f'| {step:6} | {entry["switches"]:8} | {entry["links"]:7} | {entry["recomputed"]:15} |'
+              f' {entry["path_length"]:11.4f} | {entry["throughput"]:6.3f} |')
+
+    print('-----------------------------------------------------------------------')
+    print()
+
+
+# command line usage
+def main(argv):
+    if len(argv) not in (5, 6):
+        raise ValueError('Usage: $ python3 expansion.py num_servers num_switches num_ports m servers_per_switch (steps)')
+
+    num_servers, num_switches, num_ports, m, servers_per_switch = [int(arg) for arg in argv[:5]]
+    steps = int(argv[5]) if len(argv) == 6 else 100
+
+    jellyfish = topo.Jellyfish(num_servers, num_switches, num_ports)
+    tracker = ExpansionTracker(jellyfish)
+
+    for i in range(steps):
+        print(f'Step {i + 1} / {steps}', end='\r')
+        tracker.step(m, servers_per_switch)
+
+    report_expansion(tracker.history)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,190 @@
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import topo
+from adjacency import adjacency_matrix, server_attachment
+
+
+# Breadth-first search from a batch of sources at once, one frontier row per source.
+# Returns the hop distance (inf if unreachable) and the number of shortest paths (the ECMP width).
+def bfs_paths(adjacency, sources):
+    n = adjacency.shape[0]
+    rows = np.arange(len(sources))
+
+    dist = np.full((len(sources), n), np.inf)
+    sigma = np.zeros((len(sources), n))
+
+    frontier = np.zeros((len(sources), n))
+    frontier[rows, sources] = 1
+    dist[rows, sources] = 0
+    sigma[rows, sources] = 1
+
+    # adjacency is symmetric, so (A @ F^T)^T expands every frontier by one hop
+    level = 0
+    while frontier.any():
+        level += 1
+        frontier = np.asarray((adjacency @ frontier.T).T)
+        frontier[np.isfinite(dist)] = 0
+
+        reached = frontier > 0
+        dist[reached] = level
+        sigma[reached] = frontier[reached]
+
+    return dist, sigma
+
+
+# Random link/switch failures on the switch fabric of a topology. The baseline all-pairs BFS is
+# computed once; a trial only re-runs BFS from the sources whose shortest-path DAG contains a failed link.
+class FailureStudy:
+
+    def __init__(self, servers, switches):
+        _, adjacency = adjacency_matrix([], switches)
+        attachment = server_attachment(servers, switches)
+
+        self.n = len(switches)
+
+        # every fabric link once (u < v), with its multiplicity
+        coo = adjacency.tocoo()
+        upper = coo.row < coo.col
+        self.link_u = coo.row[upper]
+        self.link_v = coo.col[upper]
+        self.link_count = coo.data[upper]
+
+        # weight of a switch pair is the number of server pairs behind it
+        servers_per_switch = np.bincount(attachment[attachment >= 0], minlength=self.n).astype(float)
+        self.weights = np.outer(servers_per_switch, servers_per_switch)
+        np.fill_diagonal(self.weights, 0)
+
+        self.dist, self.sigma = bfs_paths(adjacency, np.arange(self.n))
+
+        # server to server path length is the fabric path plus both server links
+        reachable = np.isfinite(self.dist)
+        self.base_length = np.where(reachable, self.dist + 2, 0)
+        self.base_pairs = self.weights[reachable].sum()
+
+    # Adjacency matrix with the failed links left out
+    def degraded(self, failed_links):
+        alive = ~failed_links
+        u, v, count = self.link_u[alive], self.link_v[alive], self.link_count[alive]
+
+        return csr_matrix((np.concatenate([count, count]), (np.concatenate([u, v]), np.concatenate([v, u]))),
+                          shape=(self.n, self.n))
+
+    def trial(self, mode, rate, seed):
+        rng = np.random.default_rng(seed)
+
+        if mode == 'link':
+            failed_switches = np.zeros(self.n, dtype=bool)
+            failed_links = rng.random(len(self.link_u)) < rate
+        elif mode == 'switch':
+            failed_switches = rng.random(self.n) < rate
+            failed_links = failed_switches[self.link_u] | failed_switches[self.link_v]
+        else:
+            raise ValueError(f'Unknown failure mode: {mode}')
+
+        dist = self.dist
+        sigma = self.sigma
+
+        if failed_links.any():
+            # a failed link (u, v) only changes the BFS from s if it lies on a shortest path from s
+            u, v = self.link_u[failed_links], self.link_v[failed_links]
+            with np.errstate(invalid='ignore'):
+                affected = (np.abs(self.dist[:, u] - self.dist[:, v]) == 1).any(axis=1)
+            affected &= ~failed_switches
+
+            if affected.any():
+                sources = np.flatnonzero(affected)
+                new_dist, new_sigma = bfs_paths(self.degraded(failed_links), sources)
+
+                dist = dist.copy()
+                sigma = sigma.copy()
+                dist[sources] = new_dist
+                sigma[sources] = new_sigma
+
+        alive = ~failed_switches
+        connected = np.isfinite(dist) & alive[:, None] & alive[None, :]
+        weights = self.weights[connected]
+
+        connectivity_loss = 1 - weights.sum() / self.base_pairs
+
+        if weights.sum() == 0:
+            return connectivity_loss, np.nan, np.nan
+
+        inflation = (weights * (dist[connected] + 2)).sum() / (weights * self.base_length[connected]).sum()
+        ecmp_width = (weights * sigma[connected]).sum() / weights.sum()
+
+        return connectivity_loss, inflation, ecmp_width
+
+
+# worker processes get the study once, instead of with every trial
+_study = None
+
+
+def _init_worker(study):
+    global _study
+    _study = study
+
+
+def _run_trial(args):
+    return _study.trial(*args)
+
+
+# Run 'trials' random failure sets for every rate in a process pool.
+# Returns {rate: array of shape (trials, 3)} with connectivity loss, path-length inflation and ECMP width.
+def run_study(study, mode, rates, trials, seed=0, processes=None):
+    jobs = [(mode, rate, seed + i * len(rates) + j) for j, rate in enumerate(rates) for i in range(trials)]
+
+    processes = processes or os.cpu_count()
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(study,)) as pool:
+        results = list(pool.map(_run_trial, jobs, chunksize=max(1, len(jobs) // (4 * processes))))
+
+    return {rate: np.array(results[j * trials:(j + 1) * trials]) for j, rate in enumerate(rates)}
+
+
+def report_study(results, mode, percentiles=(50, 90, 99)):
+    # connectivity loss, path-length inflation and ECMP width
+    metrics = ['loss', 'infl', 'ecmp']
+
+    header = f'| {mode + " rate":>11} |' + ''.join(f' {metric} p{p:<3}|' for metric in metrics for p in percentiles)
+    print()
+    print('-' * len(header))
+    print(header)
+    print('-' * len(header))
+
+    for rate, values in results.items():
+        row = f'| {rate:11.4f} |'
+        for m in range(len(metrics)):
+            for p in np.nanpercentile(values[:, m], percentiles):
+                row += f' {p:8.4f} |'
+        print(row)
+
+    print('-' * len(header))
+    print()
+
+
+# command line usage
+def main(argv):
+    usage = 'Usage: $ python3 failures.py (fattree num_ports | jellyfish num_servers num_switches num_ports) (link | switch) rate,rate,... trials'
+
+    if len(argv) == 5 and argv[0] == 'fattree':
+        topology = topo.Fattree(int(argv[1]))
+        mode, rates, trials = argv[2:]
+    elif len(argv) == 7 and argv[0] == 'jellyfish':
+        topology = topo.Jellyfish(int(argv[1]), int(argv[2]), int(argv[3]))
+        mode, rates, trials = argv[4:]
+    else:
+        raise ValueError(usage)
+
+    rates = [float(rate) for rate in rates.split(',')]
+
+    study = FailureStudy(topology.servers, topology.switches)
+    results = run_study(study, mode, rates, int(trials))
+    report_study(results, mode)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
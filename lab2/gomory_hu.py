@@ -0,0 +1,186 @@
+import sys
+from collections import defaultdict
+
+import numpy as np
+from scipy.sparse.csgraph import maximum_flow, breadth_first_order
+
+import topo
+from adjacency import adjacency_matrix, server_attachment
+
+
+# Gomory-Hu tree of the switch fabric, built with Gusfield's algorithm (V - 1 max-flow runs and no
+# graph contractions). Every link has unit capacity, so the min cut between two switches equals the
+# number of edge-disjoint paths between them.
+class GomoryHuTree:
+
+    def __init__(self, servers, switches):
+        self.servers = servers
+        self.switches = switches
+
+        _, self.capacity = adjacency_matrix([], switches)
+        self.attachment = server_attachment(servers, switches)
+
+        n = len(switches)
+
+        # tree edges: (i, parent[i]) with weight[i], switch 0 is the root
+        self.parent = np.zeros(n, dtype=np.int64)
+        self.weight = np.zeros(n, dtype=np.int64)
+
+        self.build()
+
+        # all-pairs min cut matrix, so every query afterwards is a lookup
+        self.cut = self.all_pairs()
+
+    def build(self):
+        n = len(self.switches)
+        parent = self.parent
+        weight = self.weight
+
+        for s in range(1, n):
+            t = parent[s]
+
+            flow, source_side = self.min_cut(s, t)
+            weight[s] = flow
+
+            # re-hang the nodes on the source side of the cut that were attached to t
+            move = source_side & (parent == t)
+            move[s] = False
+            parent[move] = s
+
+            if source_side[parent[t]]:
+                parent[s] = parent[t]
+                parent[t] = s
+                weight[s] = weight[t]
+                weight[t] = flow
+
+    # Max-flow between switches s and t, returns the flow value and a mask of the source side of the cut
+    def min_cut(self, s, t):
+        result = maximum_flow(self.capacity, s, t, method='dinic')
+
+        # nodes reachable from s in the residual graph form the source side
+        residual = self.capacity - result.flow
+        residual.data = (residual.data > 0).astype(np.int32)
+        residual.eliminate_zeros()
+
+        reachable = breadth_first_order(residual, s, directed=True, return_predecessors=False)
+
+        source_side = np.zeros(len(self.switches), dtype=bool)
+        source_side[reachable] = True
+
+        return result.flow_value, source_side
+
+    # The min cut between two switches is the lightest edge on their tree path
+    def all_pairs(self):
+        n = len(self.switches)
+
+        neighbors = defaultdict(list)
+        for i in range(1, n):
+            neighbors[i].append((self.parent[i], self.weight[i]))
+            neighbors[self.parent[i]].append((i, self.weight[i]))
+
+        cut = np.zeros((n, n), dtype=np.int64)
+
+        for root in range(n):
+            row = cut[root]
+            row[root] = np.iinfo(np.int64).max
+            stack = [root]
+            visited = {root}
+
+            while stack:
+                current = stack.pop()
+                for neighbor, weight in neighbors[current]:
+                    if neighbor not in visited:
+                        visited.add(neighbor)
+                        row[neighbor] = min(row[current], weight)
+                        stack.append(neighbor)
+
+            row[root] = 0
+
+        return cut
+
+    # Number of edge-disjoint paths between two switches (indices into 'switches')
+    def disjoint_paths(self, u, v):
+        return self.cut[u, v]
+
+    # Number of edge-disjoint fabric paths between the switches that two servers are attached to.
+    # Servers on the same switch, or without a switch, have no fabric path and get None.
+    def server_disjoint_paths(self, a, b):
+        u = self.attachment[a]
+        v = self.attachment[b]
+
+        if u < 0 or v < 0 or u == v:
+            return None
+
+        return self.cut[u, v]
+
+
+# Fraction of server pairs per number of edge-disjoint fabric paths
+def disjoint_path_distribution(tree):
+    attachment = tree.attachment[tree.attachment >= 0]
+
+    # count servers per switch so server pairs can be weighted per switch pair
+    servers_per_switch = np.bincount(attachment, minlength=len(tree.switches))
+
+    u, v = np.triu_indices(len(tree.switches), k=1)
+    pairs = servers_per_switch[u] * servers_per_switch[v]
+
+    counts = np.bincount(tree.cut[u, v], weights=pairs)
+    total = counts.sum()
+
+    distribution = {}
+    for paths, count in enumerate(counts):
+        if count > 0:
+            distribution[paths] = float(count / total)
+
+    return distribution, int(total)
+
+
+def report_disjoint_paths(distribution, server_pairs, name):
+    print()
+    print('------------------------------------------')
+    print(f'| Edge-disjoint paths ({name})'.ljust(41) + '|')
+    print('------------------------------------------')
+    print('|   Paths   |  Fraction of server pairs  |')
+    print('------------------------------------------')
+
+    for paths, fraction in sorted(distribution.items()):
+        print(f'|   {paths:5}   |          {fraction:8.4f}          |')
+
+    print('------------------------------------------')
+    print(f'Server pairs: {server_pairs}')
+    print()
+
+
+def plot_disjoint_paths(distributions, labels, filename):
+    import matplotlib.pyplot as plt
+
+    width = 0.8 / len(distributions)
+
+    for i, (distribution, label) in enumerate(zip(distributions, labels)):
+        paths = np.array(sorted(distribution.keys()))
+        plt.bar(paths + i * width, [distribution[p] for p in paths], width=width, label=label)
+
+    plt.ylim(0, 1)
+    plt.xlabel('Edge-disjoint paths between server pairs')
+    plt.ylabel('Fraction of server pairs')
+    plt.legend()
+    plt.savefig(filename)
+    plt.close()
+
+
+# command line usage
+def main(argv):
+    if len(argv) == 2 and argv[0] == 'fattree':
+        topology = topo.Fattree(int(argv[1]))
+    elif len(argv) == 4 and argv[0] == 'jellyfish':
+        topology = topo.Jellyfish(int(argv[1]), int(argv[2]), int(argv[3]))
+    else:
+        raise ValueError('Usage: $ python3 gomory_hu.py (fattree num_ports | jellyfish num_servers num_switches num_ports)')
+
+    tree = GomoryHuTree(topology.servers, topology.switches)
+    distribution, server_pairs = disjoint_path_distribution(tree)
+    report_disjoint_paths(distribution, server_pairs, argv[0])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -16,6 +16,7 @@
 # under the License.
 
 import topo
+import gomory_hu
 
 # Setup for Jellyfish
 num_servers = 686
@@ -24,4 +25,18 @@ num_ports = 14
 
 jf_topo = topo.Jellyfish(num_servers, num_switches, num_ports)
 
-# TODO: code for reproducing Figure 9 in the jellyfish paper
\ No newline at end of file
+# TODO: code for reproducing Figure 9 in the jellyfish paper
+
+# Edge-disjoint paths between server pairs, from one Gomory-Hu tree per topology
+ft_topo = topo.Fattree(num_ports)
+
+jf_tree = gomory_hu.GomoryHuTree(jf_topo.servers, jf_topo.switches)
+ft_tree = gomory_hu.GomoryHuTree(ft_topo.servers, ft_topo.switches)
+
+jf_distribution, jf_pairs = gomory_hu.disjoint_path_distribution(jf_tree)
+ft_distribution, ft_pairs = gomory_hu.disjoint_path_distribution(ft_tree)
+
+gomory_hu.report_disjoint_paths(jf_distribution, jf_pairs, 'jellyfish')
+gomory_hu.report_disjoint_paths(ft_distribution, ft_pairs, 'fattree')
+
+gomory_hu.plot_disjoint_paths([jf_distribution, ft_distribution], ['jellyfish', 'fattree'], 'disjoint9.png')
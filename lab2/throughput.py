@@ -0,0 +1,211 @@
+import sys
+import time
+
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import block_diag, coo_matrix, csr_matrix, hstack, identity
+from scipy.sparse.csgraph import dijkstra
+
+import topo
+from adjacency import adjacency_matrix, server_attachment
+
+
+# Random permutation traffic: every connected server sends one unit to another random server
+# and receives one unit. Returns (sources, destinations, demands) over the server index.
+def random_permutation_traffic(servers, switches, seed=None):
+    rng = np.random.default_rng(seed)
+
+    connected = np.flatnonzero(server_attachment(servers, switches) >= 0)
+    destinations = rng.permutation(connected)
+
+    # no server sends to itself
+    keep = connected != destinations
+    return connected[keep], destinations[keep], np.ones(keep.sum())
+
+
+# Maximum concurrent multi-commodity flow between servers: the largest fraction lambda of every
+# demand that can be routed at the same time without exceeding link capacities.
+# The problem is solved at switch level, where commodities with the same source switch are
+# aggregated into one single-source flow, which keeps the LP at (source switches x arcs) variables.
+class ConcurrentFlow:
+
+    def __init__(self, servers, switches, link_capacity=1.0, server_capacity=1.0):
+        _, adjacency = adjacency_matrix([], switches)
+        self.attachment = server_attachment(servers, switches)
+        self.n = len(switches)
+
+        # directed arcs, a parallel link adds to the capacity of its arc
+        coo = adjacency.tocoo()
+        self.arc_u = coo.row
+        self.arc_v = coo.col
+        self.capacity = coo.data * link_capacity
+
+        self.server_capacity = server_capacity
+
+    # Aggregate a server traffic matrix into switch-level demands, returns (sources, demand matrix)
+    # with a demand row for every source switch. Also returns the bound on lambda from the server links.
+    def switch_demands(self, sources, destinations, demands):
+        u = self.attachment[sources]
+        v = self.attachment[destinations]
+
+        if (u < 0).any() or (v < 0).any():
+            raise ValueError('Traffic matrix contains servers that are not connected to a switch')
+
+        # e.g. a permutation of a topology without connected servers
+        if len(demands) == 0:
+            raise ValueError('Traffic matrix is empty, there is no demand to route')
+
+        # every server link carries the demands of its server
+        sent = np.bincount(sources, weights=demands)
+        received = np.bincount(destinations, weights=demands)
+        server_bound = self.server_capacity / max(sent.max(), received.max())
+
+        # traffic between servers on the same switch does not enter the fabric
+        fabric = u != v
+        demand = coo_matrix((demands[fabric], (u[fabric], v[fabric])), shape=(self.n, self.n)).toarray()
+
+        source_switches = np.flatnonzero(demand.sum(axis=1) > 0)
+        return source_switches, demand[source_switches], server_bound
+
+    # Exact maximum concurrent flow with the HiGHS LP solver
+    def solve_lp(self, sources, destinations, demands):
+        source_switches, demand, server_bound = self.switch_demands(sources, destinations, demands)
+
+        k = len(source_switches)
+        n = self.n
+        m = len(self.arc_u)
+
+        if k == 0:
+            return server_bound
+
+        # variables: flow of every commodity on every arc (commodity-major), then lambda
+        arcs = np.arange(m)
+
+        # node-arc incidence: +1 where an arc leaves a node, -1 where it enters
+        incidence = csr_matrix((np.concatenate([np.ones(m), -np.ones(m)]),
+                                (np.concatenate([self.arc_u, self.arc_v]), np.concatenate([arcs, arcs]))),
+                               shape=(n, m))
+
+        # flow conservation per commodity: incidence @ f_k = lambda * b_k
+        supply = -demand.copy()
+        supply[np.arange(k), source_switches] += demand.sum(axis=1)
+
+        conservation = hstack([block_diag([incidence] * k), csr_matrix(-supply.reshape(-1, 1))])
+
+        # link capacity: the sum over all commodities of the flow on an arc
+        capacity = hstack([identity(m)] * k + [csr_matrix((m, 1))])
+
+        cost = np.zeros(k * m + 1)
+        cost[-1] = -1
+
+        result = linprog(cost,
+                         A_ub=capacity.tocsr(), b_ub=self.capacity,
+                         A_eq=conservation.tocsr(), b_eq=np.zeros(k * n),
+                         bounds=(0, None), method='highs')
+
+        if not result.success:
+            raise RuntimeError(f'LP solver failed: {result.message}')
+
+        return min(result.x[-1], server_bound)
+
+    # Garg-Konemann style approximation. Every iteration routes all commodities along the shortest-path
+    # trees of their source switches (one Dijkstra call for all sources) and raises the lengths of the
+    # used arcs multiplicatively. The routed flow divided by its congestion is a feasible lower bound,
+    # the lengths give an upper bound (dual), and the loop stops once they are within epsilon.
+    def solve_approx(self, sources, destinations, demands, epsilon=0.1):
+        source_switches, demand, server_bound = self.switch_demands(sources, destinations, demands)
+
+        k = len(source_switches)
+        m = len(self.arc_u)
+
+        if k == 0:
+            return server_bound
+
+        # arc index for every (u, v) pair, to turn predecessor chains into arcs
+        arc_index = csr_matrix((np.arange(m) + 1, (self.arc_u, self.arc_v)), shape=(self.n, self.n)).toarray() - 1
+
+        delta = (m / (1 - epsilon)) ** (-1 / epsilon)
+        length = delta / self.capacity
+        flow = np.zeros(m)
+        routed = 0.0
+
+        lower = 0.0
+        upper = np.inf
+
+        # length-weighted capacity, the algorithm stops at one at the latest
+        while (self.capacity * length).sum() < 1:
+            weights = csr_matrix((length, (self.arc_u, self.arc_v)), shape=(self.n, self.n))
+            dist, predecessors = dijkstra(weights, indices=source_switches, return_predecessors=True)
+
+            # some demand cannot be routed at all
+            if np.isinf(dist[demand > 0]).any():
+                return 0.0
+
+            upper = min(upper, (self.capacity * length).sum() / (demand * dist).sum())
+
+            path_flow = self.tree_flow(demand, predecessors, arc_index)
+
+            # do not send more on an arc than its capacity in one iteration
+            scale = max(1.0, (path_flow / self.capacity).max())
+            path_flow /= scale
+
+            flow += path_flow
+            routed += 1 / scale
+            length *= 1 + epsilon * path_flow / self.capacity
+
+            lower = routed / (flow / self.capacity).max()
+            if lower >= (1 - epsilon) * upper:
+                break
+
+        return min(lower, server_bound)
+
+    # Flow on every arc when every commodity sends its full demand along its shortest-path tree.
+    # All trees together form one forest; demands are pushed up to the parents one level per step.
+    def tree_flow(self, demand, predecessors, arc_index):
+        k, n = demand.shape
+
+        child = np.flatnonzero(predecessors.ravel() >= 0)
+        parent = (child // n) * n + predecessors.ravel()[child]
+        arc = arc_index[predecessors.ravel()[child], child % n]
+
+        # child -> parent matrix of the forest, with (commodity, node) flattened to one index
+        up = csr_matrix((np.ones(len(child)), (parent, child)), shape=(k * n, k * n))
+
+        level = demand.ravel()
+        subtree = level.copy()
+        while level.any():
+            level = up @ level
+            subtree += level
+
+        return np.bincount(arc, weights=subtree[child], minlength=len(self.arc_u))
+
+
+# command line usage
+def main(argv):
+    usage = 'Usage: $ python3 throughput.py (fattree num_ports | jellyfish num_servers num_switches num_ports) (lp | approx)'
+
+    if len(argv) == 3 and argv[0] == 'fattree':
+        topology = topo.Fattree(int(argv[1]))
+        method = argv[2]
+    elif len(argv) == 5 and argv[0] == 'jellyfish':
+        topology = topo.Jellyfish(int(argv[1]), int(argv[2]), int(argv[3]))
+        method = argv[4]
+    else:
+        raise ValueError(usage)
+
+    solver = ConcurrentFlow(topology.servers, topology.switches)
+    traffic = random_permutation_traffic(topology.servers, topology.switches)
+
+    start = time.time()
+    if method == 'lp':
+        throughput = solver.solve_lp(*traffic)
+    elif method == 'approx':
+        throughput = solver.solve_approx(*traffic)
+    else:
+        raise ValueError(usage)
+
+    print(f'Throughput per server ({argv[0]}, {method}): {throughput:.4f} ({time.time() - start:.2f} s)')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -69,6 +69,7 @@ class Jellyfish:
     def __init__(self, num_servers, num_switches, num_ports, network_report=False):
         self.servers = []
         self.switches = []
+        self.num_ports = num_ports
 
         # optional report of the network configuration
         self.network_report = network_report
@@ -225,6 +226,65 @@ class Jellyfish:
             # return the switches from which edges are disconnected
             return S1, S2
 
+    # Incremental expansion: add m switches to the running network. Every new switch breaks random
+    # existing links (x, y) and connects to both x and y, until less than two of its ports are free.
+    # Returns the new switches and the links (x, y) that were broken.
+    def expand(self, m, servers_per_switch=0):
+        new_switches = []
+        removed_links = []
+
+        for _ in range(m):
+            S = Node(len(self.switches), 'switch')
+            self.switches.append(S)
+            new_switches.append(S)
+
+            # attach new servers to the new switch
+            for _ in range(servers_per_switch):
+                server = Node(len(self.servers), 'server')
+                self.servers.append(server)
+                server.add_edge(S)
+
+            while self.num_ports - len(S.edges) >= 2:
+                edge = self.random_link(S)
+
+                # no link can be broken for this switch anymore
+                if edge is None:
+                    break
+
+                x, y = edge.lnode, edge.rnode
+                edge.remove()
+
+                S.add_edge(x)
+                S.add_edge(y)
+
+                removed_links.append((x, y))
+
+        return new_switches, removed_links
+
+    # Select a random switch-to-switch link that S can be put in the middle of
+    def random_link(self, S, attempts=1000):
+        for _ in range(attempts):
+            # select a switch random uniformly and one of its edges
+            S1 = self.switches[int(random.uniform(0, len(self.switches)))]
+
+            if S1 == S or len(S1.edges) == 0:
+                continue
+
+            edge = S1.edges[int(random.uniform(0, len(S1.edges)))]
+            S2 = edge.rnode if edge.lnode == S1 else edge.lnode
+
+            # only switch links that are still connected at both ends
+            if S2.type != 'switch' or S2 == S or S2 == S1 or edge not in S2.edges:
+                continue
+
+            # redo if S is already a neighbour of either switch
+            if S.is_neighbor(S1) or S.is_neighbor(S2):
+                continue
+
+            return edge
+
+        return None
+
 
 def dijkstra_shortest_path(servers, switches, report=False):
     # only use the connected servers and switches in the network
@@ -0,0 +1,81 @@
+import socket
+
+import topo
+import packet_decoder
+
+
+# Controller ARP proxy seeded from the topology: the IP and MAC of every host follow from its
+# fat-tree location (10.pod.switch.host, location_to_mac), so every ARP request can be answered
+# at the first edge switch, and no ARP broadcast has to be flooded through the fabric.
+class ArpProxy:
+
+    def __init__(self, topo_net, priority=1000):
+        self.table = {topo.mac_to_ip(host_mac): host_mac for host_mac in topo_net.mac_to_id}
+        self.priority = priority
+
+        self.replies = 0
+        self.dropped = 0
+
+    # Send ARP from the host ports of a switch to the controller and drop ARP arriving from every
+    # other port. 'host_ports' is empty for aggregate and core switches. With a FlowModQueue
+    # (flow_queue.py) the entries are queued instead of sent.
+    def install_rules(self, datapath, host_ports, queue=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        # ARP is answered or dropped by the controller, never forwarded, so the switch keeps no buffer for it
+        for port in host_ports:
+            match = parser.OFPMatch(in_port=port, eth_type=packet_decoder.ETH_TYPE_ARP)
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
+            self.add_flow(datapath, self.priority + 1, match, actions, queue)
+
+        match = parser.OFPMatch(eth_type=packet_decoder.ETH_TYPE_ARP)
+        self.add_flow(datapath, self.priority, match, [], queue)
+
+    def add_flow(self, datapath, priority, match, actions, queue=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
+                                match=match, instructions=inst)
+        if queue is not None:
+            queue.add(mod)
+        else:
+            datapath.send_msg(mod)
+
+    # Handle an ARP packet-in ('headers' from packet_decoder.decode). Requests for a known IP are
+    # answered out of the ingress port; replies are dropped, since no host receives a request.
+    # Returns False if the packet is left to the caller (unknown target IP).
+    def handle(self, datapath, in_port, headers):
+        if headers.arp_opcode == packet_decoder.ARP_REPLY:
+            self.dropped += 1
+            return True
+
+        if headers.arp_opcode != packet_decoder.ARP_REQUEST or headers.arp_dst_ip not in self.table:
+            return False
+
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        data = arp_reply(self.table[headers.arp_dst_ip], headers.arp_dst_ip, headers.arp_src_mac, headers.arp_src_ip)
+
+        out = parser.OFPPacketOut(datapath=datapath,
+                                  buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(in_port)],
+                                  data=data)
+        datapath.send_msg(out)
+
+        self.replies += 1
+        return True
+
+
+# Ethernet frame of an ARP reply 'src_ip is at src_mac', sent to dst_mac / dst_ip
+def arp_reply(src_mac, src_ip, dst_mac, dst_ip):
+    src_mac = bytes.fromhex(src_mac.replace(':', ''))
+    dst_mac = bytes.fromhex(dst_mac.replace(':', ''))
+
+    return (packet_decoder.ETHERNET_HEADER.pack(dst_mac, src_mac, packet_decoder.ETH_TYPE_ARP) +
+            packet_decoder.ARP_HEADER.pack(1, packet_decoder.ETH_TYPE_IP, 6, 4, packet_decoder.ARP_REPLY,
+                                           src_mac, socket.inet_aton(src_ip), dst_mac, socket.inet_aton(dst_ip)))
@@ -18,6 +18,7 @@
 # A dirty workaround to import topo.py from lab2
 
 import os
+import sys
 import subprocess
 import time
 
@@ -33,6 +34,8 @@ from mininet.util import waitListening, custom
 import math
 import topo
 import re
+from traffic import TrafficGenerator
+from shard import BASE_PORT, shard_index, start_sharded, switch_locations
 
 
 def location_to_dpid(core=None, pod=None, switch=None):
@@ -135,21 +138,27 @@ class FattreeNet(Topo):
                     self.addLink(Switches[i + j], Switches[int(ft_topo.agg_switch_ending_id + 1 + (j * end + k))], bw=15, delay='5ms')
 
 
-def make_mininet_instance(graph_topo):
+def make_mininet_instance(graph_topo, controllers=1):
     net_topo = FattreeNet(graph_topo)
     net = Mininet(topo=net_topo, controller=None, autoSetMacs=True)
-    net.addController('c0', controller=RemoteController, ip="127.0.0.1", port=6653)
+    for i in range(controllers):
+        net.addController('c%d' % i, controller=RemoteController, ip="127.0.0.1", port=BASE_PORT + i)
     return net
 
 
-def run(graph_topo):
+def run(graph_topo, controllers=1):
     # Run the Mininet CLI with a given topology
     lg.setLogLevel('info')
     mininet.clean.cleanup()
-    net = make_mininet_instance(graph_topo)
+    net = make_mininet_instance(graph_topo, controllers)
 
     info('*** Starting network ***\n')
-    net.start()
+    if controllers > 1:
+        # switches are named es_<id>, as_<id> and cs_<id> after their topo id
+        locations = switch_locations(graph_topo)
+        start_sharded(net, lambda switch: shard_index(controllers, *locations[int(switch.name.split('_')[1])]))
+    else:
+        net.start()
     
     ping = input('Benchmark ping? (y/n): ')
     # iperf = input('Benchmark iperf? (y/n): ')
@@ -160,36 +169,34 @@ def run(graph_topo):
         ping_maxs = []
         ping_mdevs = []
 
-        for i in range(len(net.hosts)):
-            for j in range(len(net.hosts[i:])):
-                if i == i + j:
-                    continue
-                else:
-                    # results = net.hosts[i].cmd('ping -c 20 %s' % net.hosts[j].IP())
-                    results = net.hosts[i].cmd('ping -c 20 %s' % net.hosts[i+j].IP())
+        # every pair of hosts once, in the server order of the topo instance
+        sources, destinations = TrafficGenerator(graph_topo).all_pairs()
+
+        for i, j in zip(sources.tolist(), destinations.tolist()):
+            results = net.hosts[i].cmd('ping -c 20 %s' % net.hosts[j].IP())
                     
-                    # find index in result string where 'min' and 'ms' are first named
-                    avg_index = results.index('min')
-                    ms_index = results[avg_index:].index('ms')
+            # find index in result string where 'min' and 'ms' are first named
+            avg_index = results.index('min')
+            ms_index = results[avg_index:].index('ms')
 
-                    # cut result string to only contain info between these words
-                    result_string = results[avg_index: avg_index + ms_index]
+            # cut result string to only contain info between these words
+            result_string = results[avg_index: avg_index + ms_index]
 
-                    # numbers we are interested in come after the '=' 
-                    numbers = result_string[result_string.index('=') + 2:]
+            # numbers we are interested in come after the '=' 
+            numbers = result_string[result_string.index('=') + 2:]
 
-                    # extract MIN, AVG, MAX, MDEV as floats from string
-                    MIN, AVG, MAX, MDEV = numbers.split('/')
-                    MIN, AVG, MAX, MDEV = float(MIN), float(AVG), float(MAX), float(MDEV)
+            # extract MIN, AVG, MAX, MDEV as floats from string
+            MIN, AVG, MAX, MDEV = numbers.split('/')
+            MIN, AVG, MAX, MDEV = float(MIN), float(AVG), float(MAX), float(MDEV)
 
                     
-                    print(f'h{i} ping -c 20 h{j}')
-                    print(f'MIN, AVG, MAX, MDEV = ', MIN, AVG, MAX, MDEV)
+            print(f'h{i} ping -c 20 h{j}')
+            print(f'MIN, AVG, MAX, MDEV = ', MIN, AVG, MAX, MDEV)
 
-                    ping_mins.append(MIN)
-                    ping_averages.append(AVG)
-                    ping_maxs.append(MAX)
-                    ping_mdevs.append(MDEV)
+            ping_mins.append(MIN)
+            ping_averages.append(AVG)
+            ping_maxs.append(MAX)
+            ping_mdevs.append(MDEV)
 
         # save results to a .txt file in the 'benchmarks' folder
         with open('benchmarks/ping_results.txt', 'w') as fout:
@@ -217,5 +224,7 @@ def run(graph_topo):
     net.stop()
 
 
-ft_topo = topo.Fattree(4)
-run(ft_topo)
+# command line usage: $ python3 benchmark.py (controllers) (k)
+# with N controllers, start N instances of the app with the same k first (shards.sh)
+ft_topo = topo.Fattree(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+run(ft_topo, controllers=int(sys.argv[1]) if len(sys.argv) > 1 else 1)
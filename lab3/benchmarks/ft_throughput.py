@@ -0,0 +1,155 @@
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+LAB3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, LAB3)
+
+import topo
+from flow_sim import max_min_fair
+from placement import estimate_demands, global_first_fit, path_links, simulated_annealing
+from traffic import TrafficGenerator
+
+# Aggregate throughput of the FTRouter forwarding modes on the iperf permutation workload of
+# 'python3 fattree_with_ip.py k iperf', at flow level, for when Mininet is not at hand. Every host
+# sends one long TCP flow to another host; flows get their max-min fair rate (flow_sim.py) on the
+# paths that the tables of FTRouter send them on:
+#   two-level: the suffix entries, the uplink follows from the host id of the destination and the
+#              position of the switch (ecmp = False)
+#   ecmp:      the select groups of the edge and aggregation switches, every switch hashes the flow
+#              onto one of its uplinks (ecmp = True)
+#   hedera:    two-level, and the ElephantScheduler of hedera.py with global first fit
+#              (FT_ROUTING_HEDERA=first_fit): every flow between edge switches is an elephant at its
+#              natural demand, placed on the least loaded of its paths under two-level (the load the
+#              scheduler measures); elephants that fit nowhere keep their two-level path
+#   annealing: hedera with simulated annealing after the first fit (FT_ROUTING_HEDERA=annealing)
+# Links are full duplex at BW Mbit/s, like the TCLinks of fattree_with_ip.py.
+
+BW = 15
+
+MODES = ['two-level', 'ecmp', 'hedera', 'annealing']
+
+
+# Location (pod, edge switch, host id) of every server of topo.Fattree(k), from its MAC address
+def server_locations(topology):
+    locations = [None] * len(topology.servers)
+    for mac, server_id in topology.mac_to_id.items():
+        locations[int(server_id)] = tuple(int(part, 16) for part in re.match('00:00:00:(..):(..):(..)', mac).groups())
+    return locations
+
+
+# Uplink choice (aggregation position, core uplink) of the two-level tables for a flow to 'dst'
+def two_level_choice(src, dst, half):
+    a = (dst[2] - 2 + src[1]) % half
+    return a, (dst[2] - 2 + a) % half
+
+
+# Directed links of a flow between hosts 'src' and 'dst' that goes up through aggregation position a
+# and core uplink u. Core switch a * k/2 + u is connected to aggregation position a of every pod.
+def flow_links(src, dst, choice):
+    a, u = choice
+    links = [('host-edge',) + src, ('edge-host',) + dst]
+
+    if src[:2] == dst[:2]:
+        return links
+    if src[0] == dst[0]:
+        return links + [('edge-agg', src[0], src[1], a), ('agg-edge', dst[0], a, dst[1])]
+    return links + [('edge-agg', src[0], src[1], a), ('agg-core', src[0], a, u),
+                    ('core-agg', dst[0], a, u), ('agg-edge', dst[0], a, dst[1])]
+
+
+# Max-min fair rate (Mbit/s) of every flow, 'links' holds the links of every flow
+def fair_rates(links):
+    index = {}
+    columns = [[index.setdefault(link, len(index)) for link in flow] for flow in links]
+
+    lengths = [len(flow) for flow in columns]
+    routing = csr_matrix((np.ones(sum(lengths)), (np.repeat(np.arange(len(columns)), lengths), np.concatenate(columns))),
+                         shape=(len(columns), len(index)))
+    return max_min_fair(routing, np.full(len(index), float(BW)))
+
+
+# Rates of the flows of one permutation in 'mode'; 'rng' draws the hashes of the select groups
+def permutation_rates(mode, flows, half, rng):
+    if mode in ('two-level', 'hedera', 'annealing'):
+        choices = [two_level_choice(src, dst, half) for src, dst in flows]
+    elif mode == 'ecmp':
+        choices = [tuple(choice) for choice in rng.integers(half, size=(len(flows), 2))]
+    else:
+        raise ValueError(f'Unknown mode: {mode}')
+
+    if mode in ('hedera', 'annealing'):
+        choices = elephant_choices(mode, flows, choices, half)
+
+    return fair_rates([flow_links(src, dst, choice) for (src, dst), choice in zip(flows, choices)])
+
+
+# Paths of the flows after the scheduler placed the elephants, starting from their two-level 'choices'
+def elephant_choices(mode, flows, choices, half):
+    # measured load of every link before the placement, in Mbit/s
+    links = [flow_links(src, dst, choice) for (src, dst), choice in zip(flows, choices)]
+    link_rates = defaultdict(float)
+    for flow, rate in zip(links, fair_rates(links)):
+        for link in flow:
+            link_rates[link] += rate
+
+    def by_load(src, dst, paths):
+        return sorted(paths, key=lambda choice: sum(link_rates[link] for link in path_links(src, dst, choice)))
+
+    keys = [(src, dst) for src, dst in flows if src[:2] != dst[:2]]
+    demands = estimate_demands(keys)
+    elephants = [(key, key[0][:2], key[1][:2], demands[key] * BW) for key in keys]
+
+    placement = global_first_fit(elephants, half, BW, by_load)
+    if mode == 'annealing':
+        placement = simulated_annealing(elephants, half, BW, initial=placement)
+
+    return [placement.get(flow, choice) for flow, choice in zip(flows, choices)]
+
+
+# command line usage
+def main(argv):
+    if len(argv) > 2:
+        raise ValueError('Usage: $ python3 ft_throughput.py (k) (permutations)')
+
+    k = int(argv[0]) if argv else 4
+    permutations = int(argv[1]) if len(argv) > 1 else 20
+
+    topology = topo.Fattree(k)
+    locations = server_locations(topology)
+    traffic = TrafficGenerator(topology, seed=0)
+
+    # the same permutations for every mode, the first one is the workload of fattree_with_ip.py
+    workloads = []
+    for _ in range(permutations):
+        sources, destinations = traffic.random_permutation()
+        workloads.append([(locations[src], locations[dst]) for src, dst in zip(sources, destinations)])
+
+    results = []
+    for mode in MODES:
+        rng = np.random.default_rng(0)
+        start = time.time()
+        rates = [permutation_rates(mode, flows, k // 2, rng) for flows in workloads]
+        results.append((mode, np.array([r.sum() for r in rates]), np.concatenate(rates), time.time() - start))
+
+    print()
+    print(f'k = {k}, {len(workloads[0])} flows, {permutations} permutations, {BW} Mbit/s links')
+    print('-----------------------------------------------------------------------------')
+    print('|    Mode     | Aggregate (Mbit/s) | Line rate |  Min flow  |  p10 flow  |  s  |')
+    print('-----------------------------------------------------------------------------')
+
+    for mode, aggregate, rates, elapsed in results:
+        print(f'| {mode:11} | {aggregate.mean():9.1f} +- {aggregate.std():5.1f} | {aggregate.mean() / (len(rates) / permutations * BW):9.1%} '
+              f'| {rates.min():10.2f} | {np.percentile(rates, 10):10.2f} | {elapsed:3.0f} |')
+
+    print('-----------------------------------------------------------------------------')
+    print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,188 @@
+import os
+import stat
+import pickle
+import tempfile
+from collections import defaultdict
+
+
+# Controller restart without relearning: the routing app checkpoints what it computed (paths, host
+# map, topology) and what it installed, and a restarted instance loads the checkpoint, asks every
+# switch for its flow entries and groups, and sends only the differences.
+#
+# The installed state is an inventory built from the messages sent to the switches (like
+# metrics.watch, by wrapping datapath.send_msg), so every flow-mod and group-mod of the app and of
+# its helpers (ARP proxy, select groups) is in it:
+#   flows:  dpid -> {(priority, match key): actions key}
+#   groups: dpid -> {group id: (type, ((weight, watch port, actions key), ...))}
+# Keys are tuples of plain values, the same whether they come from a sent message or a stats reply.
+#
+# Checkpoints are pickles, and loading a pickle runs code from it: they are only written to and read
+# from a directory that belongs to the user of the controller and that no one else can write to
+# (0700), and a checkpoint file that is not owned by that user is never loaded.
+
+
+# Match fields as a sorted tuple of (name, value); masked values are (value, mask) tuples
+def match_key(match):
+    return tuple(sorted(match.items()))
+
+
+# Output and group actions of a list of instructions, in order
+def actions_key(instructions):
+    key = []
+    for instruction in instructions:
+        for action in getattr(instruction, 'actions', []):
+            if hasattr(action, 'group_id'):
+                key.append(('group', action.group_id))
+            elif hasattr(action, 'port'):
+                key.append(('output', action.port, action.max_len))
+    return tuple(key)
+
+
+def bucket_key(bucket):
+    return bucket.weight, bucket.watch_port, actions_key([bucket])
+
+
+def make_actions(parser, key):
+    return [parser.OFPActionGroup(action[1]) if action[0] == 'group' else parser.OFPActionOutput(action[1], action[2])
+            for action in key]
+
+
+class FlowInventory:
+
+    def __init__(self, flows=None, groups=None):
+        self.flows = defaultdict(dict, flows or {})
+        self.groups = defaultdict(dict, groups or {})
+
+        # incremented on every change, to know when a checkpoint is out of date
+        self.version = 0
+
+    # Record every flow-mod and group-mod sent to the datapath
+    def watch(self, datapath):
+        send_msg = datapath.send_msg
+
+        def recorded_send_msg(msg, *args, **kwargs):
+            self.record(datapath, msg)
+            return send_msg(msg, *args, **kwargs)
+
+        datapath.send_msg = recorded_send_msg
+
+    def record(self, datapath, msg):
+        ofproto = datapath.ofproto
+        name = type(msg).__name__
+
+        # flow-mods and group-mods in a bundle (flow_queue.py)
+        if name in ('OFPBundleAddMsg', 'ONFBundleAddMsg'):
+            self.record(datapath, msg.message)
+
+        elif name == 'OFPFlowMod':
+            flows = self.flows[datapath.id]
+            key = (msg.priority, match_key(msg.match))
+
+            if msg.command in (ofproto.OFPFC_ADD, ofproto.OFPFC_MODIFY, ofproto.OFPFC_MODIFY_STRICT):
+                flows[key] = actions_key(msg.instructions)
+            elif msg.command == ofproto.OFPFC_DELETE_STRICT:
+                flows.pop(key, None)
+            elif msg.command == ofproto.OFPFC_DELETE:
+                # every entry whose match contains all the given fields
+                fields = set(key[1])
+                for entry in [entry for entry in flows if fields <= set(entry[1])]:
+                    del flows[entry]
+            self.version += 1
+
+        elif name == 'OFPGroupMod':
+            groups = self.groups[datapath.id]
+            if msg.command == ofproto.OFPGC_DELETE:
+                groups.pop(msg.group_id, None)
+            else:
+                groups[msg.group_id] = (msg.type, tuple(bucket_key(bucket) for bucket in msg.buckets))
+            self.version += 1
+
+    # Group-mods that turn the groups of a switch (from a group desc stats reply) into the recorded ones
+    def group_fixes(self, datapath, stats):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        expected = self.groups.get(datapath.id, {})
+        actual = {stat.group_id: (stat.type, tuple(bucket_key(bucket) for bucket in stat.buckets)) for stat in stats}
+
+        mods = []
+        for group_id, (group_type, buckets) in expected.items():
+            if actual.get(group_id) != (group_type, buckets):
+                command = ofproto.OFPGC_MODIFY if group_id in actual else ofproto.OFPGC_ADD
+                mods.append(parser.OFPGroupMod(datapath, command, group_type, group_id,
+                                               [parser.OFPBucket(weight=weight, watch_port=watch_port,
+                                                                 watch_group=ofproto.OFPG_ANY,
+                                                                 actions=make_actions(parser, actions))
+                                                for weight, watch_port, actions in buckets]))
+
+        for group_id, (group_type, _) in actual.items():
+            if group_id not in expected:
+                mods.append(parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE, group_type, group_id, []))
+
+        return mods
+
+    # Flow-mods that turn the flow table of a switch (from flow stats replies) into the recorded one
+    def flow_fixes(self, datapath, stats):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        expected = self.flows.get(datapath.id, {})
+        actual = {(stat.priority, match_key(stat.match)): actions_key(stat.instructions) for stat in stats}
+
+        mods = []
+        for (priority, match), actions in actual.items():
+            if (priority, match) not in expected:
+                mods.append(parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT, priority=priority,
+                                              out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                              match=parser.OFPMatch(**dict(match))))
+
+        for (priority, match), actions in expected.items():
+            if actual.get((priority, match)) != actions:
+                inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, make_actions(parser, actions))]
+                mods.append(parser.OFPFlowMod(datapath=datapath, priority=priority,
+                                              match=parser.OFPMatch(**dict(match)), instructions=inst))
+
+        return mods
+
+
+# Default directory of the checkpoints, private to the user, in the temporary directory
+def private_directory(name='sp_routing'):
+    return os.path.join(tempfile.gettempdir(), f'{name}-{os.getuid()}')
+
+
+# Raise PermissionError unless 'path' (not a symlink) is of the given type, owned by this user and not
+# open to others: no access at all for a directory, no write access for a file
+def check_private(path, is_type, others):
+    st = os.lstat(path)
+    if not is_type(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & others:
+        raise PermissionError(f'{path} is not private to this user')
+
+
+# The state as bytes; called on the hub, so the state cannot change while it is serialized
+def dumps(state):
+    return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Write a serialized checkpoint to a temporary file and rename it, a crash never leaves half a checkpoint
+def save(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    check_private(directory, stat.S_ISDIR, 0o077)
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+    with os.fdopen(fd, 'wb') as fout:
+        fout.write(data)
+    os.replace(temporary, path)
+
+
+# The checkpoint at 'path', or None if there is none; PermissionError if it is not private to this user
+def load(path):
+    if not os.path.lexists(path):
+        return None
+
+    check_private(os.path.dirname(os.path.abspath(path)), stat.S_ISDIR, 0o077)
+    check_private(path, stat.S_ISREG, 0o022)
+    fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    with os.fdopen(fd, 'rb') as fin:
+        return pickle.load(fin)
@@ -0,0 +1,118 @@
+import sys
+import time
+import socket
+import struct
+
+from ryu.lib.packet import packet, ethernet, arp, ipv4, ipv6, ether_types
+
+import topo
+import packet_decoder
+
+
+# Packet-in frames as the controllers see them in the fat-tree: ARP requests and replies,
+# IPv4 (UDP) traffic, IPv6 neighbour discovery and LLDP from the topology discovery
+def sample_frames():
+    src_mac = topo.location_to_mac(0, 0, 2)
+    dst_mac = topo.location_to_mac(1, 1, 3)
+    src_ip = socket.inet_aton(topo.mac_to_ip(src_mac))
+    dst_ip = socket.inet_aton(topo.mac_to_ip(dst_mac))
+
+    def mac_bytes(address):
+        return bytes.fromhex(address.replace(':', ''))
+
+    def eth(dst, src, ethertype):
+        return struct.pack('!6s6sH', mac_bytes(dst), mac_bytes(src), ethertype)
+
+    def arp_frame(opcode, dst):
+        return eth(dst, src_mac, packet_decoder.ETH_TYPE_ARP) + struct.pack(
+            '!HHBBH6s4s6s4s', 1, packet_decoder.ETH_TYPE_IP, 6, 4, opcode,
+            mac_bytes(src_mac), src_ip, mac_bytes(dst), dst_ip)
+
+    ipv4_header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 28, 0, 0, 64, 17, 0, src_ip, dst_ip)
+    udp = struct.pack('!HHHH', 5001, 5001, 8, 0)
+
+    ipv6_header = struct.pack('!IHBB16s16s', 6 << 28, 8, 58, 255,
+                              socket.inet_pton(socket.AF_INET6, 'fe80::1'), socket.inet_pton(socket.AF_INET6, 'ff02::2'))
+    icmpv6 = struct.pack('!BBHI', 133, 0, 0, 0)
+
+    lldp = bytes([0x02, 0x07, 0x04]) + mac_bytes(src_mac) + bytes([0x04, 0x02, 0x02, 0x01, 0x06, 0x02, 0x00, 0x78, 0x00, 0x00])
+
+    return [
+        arp_frame(packet_decoder.ARP_REQUEST, 'ff:ff:ff:ff:ff:ff'),
+        arp_frame(packet_decoder.ARP_REPLY, dst_mac),
+        eth(dst_mac, src_mac, packet_decoder.ETH_TYPE_IP) + ipv4_header + udp + bytes(64),
+        eth('33:33:00:00:00:02', src_mac, packet_decoder.ETH_TYPE_IPV6) + ipv6_header + icmpv6,
+        eth('01:80:c2:00:00:0e', src_mac, packet_decoder.ETH_TYPE_LLDP) + lldp,
+    ]
+
+
+# What the packet-in handlers did before: parse with ryu, call get_protocol per layer,
+# and parse ARP packets a second time in arp_handler
+def ryu_fields(data):
+    pkt = packet.Packet(data)
+    eth = pkt.get_protocol(ethernet.ethernet)
+
+    if eth.ethertype == ether_types.ETH_TYPE_LLDP or pkt.get_protocol(ipv6.ipv6):
+        return None
+
+    if pkt.get_protocol(arp.arp):
+        pkt = packet.Packet(data)
+        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        arp_pkt = pkt.get_protocol(arp.arp)
+        return eth.dst, eth.src, arp_pkt.opcode, arp_pkt.src_ip, arp_pkt.dst_ip
+
+    ip_pkt = pkt.get_protocol(ipv4.ipv4)
+    return eth.dst, eth.src, ip_pkt.src, ip_pkt.dst
+
+
+def decoder_fields(data):
+    headers = packet_decoder.decode(data)
+
+    if headers.is_lldp or headers.is_ipv6:
+        return None
+
+    if headers.is_arp:
+        return headers.eth_dst, headers.eth_src, headers.arp_opcode, headers.arp_src_ip, headers.arp_dst_ip
+
+    return headers.eth_dst, headers.eth_src, headers.ip_src, headers.ip_dst
+
+
+# Packet-ins per second for a decoder over 'rounds' rounds of the frame mix
+def measure(fields, frames, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for frame in frames:
+            fields(frame)
+    return rounds * len(frames) / (time.perf_counter() - start)
+
+
+# command line usage
+def main(argv):
+    if len(argv) > 1:
+        raise ValueError('Usage: $ python3 decoder_benchmark.py (rounds)')
+
+    rounds = int(argv[0]) if argv else 20000
+    frames = sample_frames()
+
+    # both decoders have to agree on every field before their speed is compared
+    for frame in frames:
+        if ryu_fields(frame) != decoder_fields(frame):
+            raise RuntimeError(f'Decoders disagree: {ryu_fields(frame)} != {decoder_fields(frame)}')
+
+    results = [('ryu Packet', measure(ryu_fields, frames, rounds)),
+               ('packet_decoder', measure(decoder_fields, frames, rounds))]
+
+    print()
+    print('----------------------------------------------')
+    print('|     Decoder     | Packet-ins/s |  Speedup  |')
+    print('----------------------------------------------')
+
+    for name, rate in results:
+        print(f'| {name:15} | {rate:12.0f} | {rate / results[0][1]:8.2f}x |')
+
+    print('----------------------------------------------')
+    print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
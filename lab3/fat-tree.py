@@ -18,6 +18,7 @@
 # A dirty workaround to import topo.py from lab2
 
 import os
+import sys
 import subprocess
 import time
 
@@ -156,5 +157,7 @@ def run(graph_topo):
     net.stop()
 
 
-ft_topo = topo.Fattree(4)
+# command line usage: $ python3 fat-tree.py (k)
+# start the app with the same k first (FATTREE_K=k ryu-manager ...)
+ft_topo = topo.Fattree(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
 run(ft_topo)
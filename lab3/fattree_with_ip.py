@@ -18,6 +18,7 @@
 # A dirty workaround to import topo.py from lab2
 
 import os
+import sys
 import subprocess
 import time
 
@@ -31,8 +32,10 @@ from mininet.node import Node, OVSKernelSwitch, RemoteController, CPULimitedHost
 from mininet.topo import Topo
 from mininet.util import waitListening, custom
 import math
-#import topo
+import topo
 import re
+from traffic import TrafficGenerator
+from shard import BASE_PORT, shard_index, start_sharded
 
 
 def location_to_dpid(core=None, pod=None, switch=None):
@@ -91,12 +94,10 @@ class FattreeNet(Topo):
         for i in range(1, (end ** 2)+1):
             # Add an item in the list | Creating a switch with name CrSw# | having DPID | K | j coordinate | i
             # coordinate | Openflow Protocol specified as 1.3
-            Core.append(self.addSwitch('CrSw%s' % (i - 1), dpid="00:00:00:00:00:0" + str(end ** 2) + ":0" + str(
-                (i - 1) // end + 1) + ":0" + str((i - 1) % end + 1)))
+            Core.append(self.addSwitch('CrSw%s' % (i - 1), dpid=location_to_dpid(core=i - 1)))
 
             # Printing the generated data of core switch
-            print('CrSw%s' % (i - 1) + " DPID: 00:00:00:00:00:0" + str(end ** 2) + ":0" + str(
-                (i - 1) // end + 1) + ":0" + str((i - 1) % end + 1))
+            print('CrSw%s' % (i - 1) + " DPID: " + location_to_dpid(core=i - 1))
 
         # Running loop for Number of pods, loop runs 4 times.
 
@@ -105,22 +106,21 @@ class FattreeNet(Topo):
             for j in range(1, end+1):
                 # Creating Aggregation Switches
                 # Add an item in the list | Creating a switch with name ArSw# | having DPID |K No of pod | i-1 switch |Openflow Protocol specified as 1.3
+                # aggregation switches are switches k/2 to k - 1 of their pod
                 Aggregation.append(self.addSwitch('AgSw' + str(i - 1) + '_' + str(j - 1),
-                                                  dpid="00:00:00:00:00:0" + str(i - 1) + ":0" + str(
-                                                      (j - 1) % end + 2) + ":01"))
+                                                  dpid=location_to_dpid(pod=i - 1, switch=end + j - 1)))
 
                 # Printing the generated data of Aggregation switch
-                print('AgSw' + str(i - 1) + '_' + str(j - 1) + " DPID: 00:00:00:00:00:0" + str(i - 1) + ":0" + str(
-                    (j - 1) % end + 2) + ":01")
+                print('AgSw' + str(i - 1) + '_' + str(j - 1) + " DPID: " + location_to_dpid(pod=i - 1, switch=end + j - 1))
 
                 # Creating Edge Switch
                 # Add an item in the list | Creating a switch with name EgSw# | having DPID | K No of pod | i-1 switch | |Openflow Protocol specified as 1.3
+                # edge switches are switches 0 to k/2 - 1 of their pod
                 Edge.append(self.addSwitch('EdSw' + str(i - 1) + '_' + str(j - 1),
-                                           dpid="00:00:00:00:00:0" + str(i - 1) + ":0" + str((j - 1) % end) + ":01"))
+                                           dpid=location_to_dpid(pod=i - 1, switch=j - 1)))
 
                 # Printing the generated data of Edge switch
-                print('EdSw' + str(i - 1) + '_' + str(j - 1) + " DPID: 00:00:00:00:00:0" + str(i - 1) + ":0" + str(
-                    (j - 1) % end) + ":01")
+                print('EdSw' + str(i - 1) + '_' + str(j - 1) + " DPID: " + location_to_dpid(pod=i - 1, switch=j - 1))
 
         # Adding links between core and aggregation switches,There are (k/2)^2 core switches so,
         for i in range(1, (end ** 2)+1):
@@ -168,7 +168,8 @@ class FattreeNet(Topo):
                 # Creating a host |name switch no_host no|ip10 | .pod | switch | ID is the host positon from [2,
                 # (k/2)+1] |
                 Host = self.addHost('h' + str(i) + '_' + str(j),
-                                    ip='10.' + str(i // end) + '.' + str(i % end) + '.' + str(2 + j))
+                                    ip='10.' + str(i // end) + '.' + str(i % end) + '.' + str(2 + j),
+                                    mac=location_to_mac(i // end, i % end, 2 + j))
 
                 # The ith host in a subnet should be connected to the ith port of edge switch which manages the subnet.
 
@@ -176,26 +177,74 @@ class FattreeNet(Topo):
                 self.addLink(EdgeSwitch, Host, port1=(j + 1), port2=1, bw=15, delay='5ms')
 
 
-def make_mininet_instance(graph_topo):
+def make_mininet_instance(graph_topo, controllers=1):
     net_topo = FattreeNet(graph_topo)
     net = Mininet(topo=net_topo, controller=None, autoSetMacs=True, autoStaticArp=True, host=CPULimitedHost, link=TCLink)
-    net.addController('c0', controller=RemoteController, ip="127.0.0.1", port=6653)
+    for i in range(controllers):
+        net.addController('c%d' % i, controller=RemoteController, ip="127.0.0.1", port=BASE_PORT + i)
     return net
 
 
-def run(graph_topo):
+# Controller of a switch when the pods are sharded over 'controllers' instances (see shard.py)
+def switch_shard(switch, controllers):
+    dpid = int(switch.dpid, 16)
+    if (dpid >> 24) == 0x10:
+        return shard_index(controllers, core=(dpid >> 16) & 0xFF)
+    return shard_index(controllers, pod=(dpid >> 8) & 0xFF)
+
+
+# Aggregate TCP throughput (Mbit/s) of a random permutation between all hosts, with all iperf
+# flows running at the same time. Host h<i>_<j> is server i * k/2 + j of topo.Fattree(k).
+def iperf_permutation(net, k, duration=10, seed=0):
+    end = k // 2
+    hosts = [net.get('h%d_%d' % (i // end, i % end)) for i in range(len(net.hosts))]
+    sources, destinations = TrafficGenerator(topo.Fattree(k), seed=seed).random_permutation()
+
+    for dst in destinations:
+        hosts[dst].cmd('iperf -s &')
+    time.sleep(1)
+
+    for src, dst in zip(sources, destinations):
+        hosts[src].cmd('iperf -c %s -t %d -f m > /tmp/iperf_%d.txt &' % (hosts[dst].IP(), duration, src))
+    time.sleep(duration + 2)
+
+    rates = []
+    for src in sources:
+        match = re.search(r'([\d.]+) Mbits/sec', hosts[src].cmd('cat /tmp/iperf_%d.txt' % src))
+        rates.append(float(match.group(1)) if match else 0.0)
+
+    for host in hosts:
+        host.cmd('kill %iperf')
+
+    return rates
+
+
+def run(graph_topo, iperf=False, controllers=1):
     # Run the Mininet CLI with a given topology
     lg.setLogLevel('info')
     mininet.clean.cleanup()
-    net = make_mininet_instance(graph_topo)
+    net = make_mininet_instance(graph_topo, controllers)
 
     info('*** Starting network ***\n')
-    net.start()
-    info('*** Running CLI ***\n')
-    CLI(net)
+    if controllers > 1:
+        start_sharded(net, lambda switch: switch_shard(switch, controllers))
+    else:
+        net.start()
+
+    if iperf:
+        rates = iperf_permutation(net, graph_topo)
+        info('*** Permutation throughput: %.1f Mbit/s aggregate, %.2f Mbit/s min per flow ***\n'
+             % (sum(rates), min(rates)))
+    else:
+        info('*** Running CLI ***\n')
+        CLI(net)
+
     info('*** Stopping network ***\n')
     net.stop()
 
 
-#ft_topo = topo.Fattree(4)
-run(4)
+# command line usage: $ python3 fattree_with_ip.py (k) (iperf) (controllers)
+# start the app with the same k first (FATTREE_K=k ryu-manager ..., or shards.sh for N controllers)
+k = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+controllers = int(next((arg for arg in sys.argv[2:] if arg.isdigit()), 1))
+run(k, iperf='iperf' in sys.argv[2:], controllers=controllers)
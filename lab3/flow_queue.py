@@ -0,0 +1,180 @@
+import time
+from collections import deque
+
+from metrics import LatencyHistogram
+
+
+# Per-datapath queue for the bulk flow-mods and group-mods of the routing apps (tables pushed at switch
+# connect, proactive routes, reconciliation). Queued messages are sent on flush(), either
+#   - as one bundle (OF1.4 bundles, or the ONF bundle extension of OF1.3): the switch applies the
+#     whole table in one ordered, atomic commit; or
+#   - pipelined in batches of 'batch_size', each batch followed by a barrier, with at most 'window'
+#     batches not yet acknowledged by their barrier reply, so the switch is never flooded.
+# The flush callback is called when the switch has processed all messages of the flush (the reply to
+# the barrier after the last batch, or after the bundle commit). A switch that rejects bundles (error
+# reply) gets the messages of the bundle again as a pipeline, and no bundles after that.
+# The app forwards barrier replies and error messages to barrier_reply() and error().
+class FlowModQueue:
+
+    def __init__(self, datapath, batch_size=100, window=4, bundles=False, latency=None):
+        self.datapath = datapath
+        self.batch_size = batch_size
+        self.window = window
+        self.bundles = bundles and bundle_messages(datapath) is not None
+        self.latency = latency if latency is not None else LatencyHistogram()
+
+        self.queued = []
+
+        # batches waiting for the window as (messages, callback, flush time); the callback is only set
+        # on the last batch of a flush
+        self.backlog = deque()
+
+        # barrier xid -> (callback, flush time) of the batches and bundles in flight
+        self.in_flight = {}
+
+        # xid of every message of a bundle in flight -> the bundle, as a dict with its messages, callback,
+        # flush time, the xids of its messages and the xid of the barrier after its commit
+        self.bundle_xids = {}
+        self.open_bundles = {}
+        self.bundle_id = 0
+
+        self.messages = 0
+        self.barriers = 0
+        self.bundles_committed = 0
+        self.fallbacks = 0
+
+    def add(self, msg):
+        self.queued.append(msg)
+
+    # Messages added after a fence are processed after the ones before it (a group before the entries
+    # that point to it): a bundle is ordered anyway, the pipeline ends the batch with a barrier
+    def fence(self):
+        if not self.bundles and self.queued:
+            self.flush()
+
+    # Send everything queued; callback() is called once the switch has processed it
+    def flush(self, callback=None):
+        messages, self.queued = self.queued, []
+        started = time.perf_counter()
+
+        if self.bundles and messages:
+            self.send_bundle(messages, callback, started)
+            return
+
+        batches = [messages[start:start + self.batch_size] for start in range(0, len(messages), self.batch_size)] or [[]]
+        for i, batch in enumerate(batches):
+            self.backlog.append((batch, callback if i == len(batches) - 1 else None, started))
+        self.pump()
+
+    # Send batches from the backlog while the window has room
+    def pump(self):
+        while self.backlog and len(self.in_flight) < self.window:
+            batch, callback, started = self.backlog.popleft()
+            for msg in batch:
+                self.datapath.send_msg(msg)
+            self.messages += len(batch)
+            self.send_barrier(callback, started)
+
+    def send_barrier(self, callback, started):
+        barrier = self.datapath.ofproto_parser.OFPBarrierRequest(self.datapath)
+        self.datapath.send_msg(barrier)
+        self.barriers += 1
+        self.in_flight[barrier.xid] = (callback, started)
+        return barrier.xid
+
+    # Open a bundle, add every message to it, commit it (ordered and atomic), and close it with a barrier
+    def send_bundle(self, messages, callback, started):
+        ctrl_msg, add_msg, open_request, commit_request, flags = bundle_messages(self.datapath)
+        self.bundle_id += 1
+
+        sent = [ctrl_msg(self.datapath, self.bundle_id, open_request, flags, [])]
+        for msg in messages:
+            add = add_msg(self.datapath, self.bundle_id, flags, msg, [])
+            # the message in the bundle carries the xid of the message that adds it
+            self.datapath.set_xid(add)
+            msg.set_xid(add.xid)
+            sent.append(add)
+        sent.append(ctrl_msg(self.datapath, self.bundle_id, commit_request, flags, []))
+
+        for msg in sent:
+            self.datapath.send_msg(msg)
+        self.messages += len(messages)
+        self.bundles_committed += 1
+
+        bundle = {'messages': messages, 'callback': callback, 'started': started,
+                  'xids': [msg.xid for msg in sent], 'barrier': self.send_barrier(callback, started)}
+        self.open_bundles[bundle['barrier']] = bundle
+        for xid in bundle['xids']:
+            self.bundle_xids[xid] = bundle
+
+    def close_bundle(self, bundle):
+        self.open_bundles.pop(bundle['barrier'], None)
+        for xid in bundle['xids']:
+            self.bundle_xids.pop(xid, None)
+
+    def barrier_reply(self, msg):
+        entry = self.in_flight.pop(msg.xid, None)
+        if entry is None:
+            return
+
+        bundle = self.open_bundles.get(msg.xid)
+        if bundle is not None:
+            self.close_bundle(bundle)
+
+        callback, started = entry
+        if callback is not None:
+            self.latency.observe(time.perf_counter() - started)
+            callback()
+        self.pump()
+
+    # An error reply to a message of a bundle: no more bundles for this switch, the messages of the
+    # bundle (and of every other rejected one) are sent again as a pipeline, which takes its callback
+    def error(self, msg):
+        bundle = self.bundle_xids.get(msg.xid)
+        if bundle is None:
+            return
+
+        if self.bundles:
+            self.bundles = False
+            self.fallbacks += 1
+
+        self.close_bundle(bundle)
+        self.in_flight.pop(bundle['barrier'], None)
+
+        for message in bundle['messages']:
+            message.xid = None
+        self.queued = bundle['messages'] + self.queued
+        self.flush(bundle['callback'])
+
+    def stats(self):
+        return {'messages': self.messages, 'barriers': self.barriers, 'bundles': self.bundles_committed,
+                'fallbacks': self.fallbacks, 'queued': len(self.queued),
+                'backlog': sum(len(batch) for batch, _, _ in self.backlog), 'in_flight': len(self.in_flight)}
+
+
+# Counters of all queues of an app, summed, and the flush-to-completion latency histogram
+def total_stats(queues, latency):
+    totals = {}
+    for queue in queues:
+        for name, value in queue.stats().items():
+            totals[name] = totals.get(name, 0) + value
+    totals['switches'] = len(queues)
+    totals['latency'] = latency.snapshot()
+    return totals
+
+
+# Bundle messages of the OpenFlow version of a datapath as (control message class, add message class,
+# open request type, commit request type, flags), or None if the parser has no bundles
+def bundle_messages(datapath):
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+
+    if hasattr(parser, 'OFPBundleCtrlMsg'):
+        return (parser.OFPBundleCtrlMsg, parser.OFPBundleAddMsg, ofproto.OFPBCT_OPEN_REQUEST,
+                ofproto.OFPBCT_COMMIT_REQUEST, ofproto.OFPBF_ATOMIC | ofproto.OFPBF_ORDERED)
+
+    if hasattr(parser, 'ONFBundleCtrlMsg'):
+        return (parser.ONFBundleCtrlMsg, parser.ONFBundleAddMsg, ofproto.ONF_BCT_OPEN_REQUEST,
+                ofproto.ONF_BCT_COMMIT_REQUEST, ofproto.ONF_BF_ATOMIC | ofproto.ONF_BF_ORDERED)
+
+    return None
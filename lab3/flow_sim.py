@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
+import topo
+
+# adjacency.py is shared with lab2 (appended, the topo.py of lab3 comes first)
+LAB2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lab2')
+if LAB2 not in sys.path:
+    sys.path.append(LAB2)
+
+from adjacency import adjacency_matrix
+from traffic import TrafficGenerator
+
+
+# Flow-level simulator: routes a traffic matrix over a topo graph and computes the max-min fair
+# rate of every flow, to screen routing/traffic configurations before running iperf in Mininet.
+# Every link is full duplex with capacity 'bw' in each direction (Mbit/s, like the TCLinks).
+class FlowSimulator:
+
+    def __init__(self, servers, switches, bw=15):
+        self.nodes, adjacency = adjacency_matrix(servers, switches)
+        self.n_servers = len(servers)
+
+        self.adjacency = adjacency
+        self.neighbors = [adjacency.indices[adjacency.indptr[i]:adjacency.indptr[i + 1]] for i in range(len(self.nodes))]
+
+        # directed arcs, a parallel link adds to the capacity of its arc
+        coo = adjacency.tocoo()
+        self.arc_index = {(u, v): a for a, (u, v) in enumerate(zip(coo.row, coo.col))}
+        self.capacity = coo.data * float(bw)
+        self.bw = float(bw)
+
+        # hop distances between all nodes, used to find the next hops of shortest paths
+        self.dist = shortest_path(adjacency, unweighted=True)
+
+        # routed paths per (scheme, source, destination), as arc index arrays
+        self.path_cache = {}
+
+    # Next hops of u on the shortest paths towards dst
+    def next_hops(self, u, dst):
+        neighbors = self.neighbors[u]
+        return neighbors[self.dist[neighbors, dst] == self.dist[u, dst] - 1]
+
+    # Single shortest path: always take the first next hop, like the predecessor chain of Dijkstra
+    def shortest_path(self, src, dst):
+        path = [src]
+        while path[-1] != dst:
+            path.append(self.next_hops(path[-1], dst)[0])
+        return [path]
+
+    # ECMP: every switch hashes the flow onto one of its equal-cost next hops
+    def ecmp_path(self, src, dst, flow_hash):
+        path = [src]
+        while path[-1] != dst:
+            hops = self.next_hops(path[-1], dst)
+            path.append(hops[hash((flow_hash, int(path[-1]))) % len(hops)])
+        return [path]
+
+    # The k shortest simple paths, found with a depth-first search that only extends a path while
+    # it can still reach dst within the current length bound; the bound grows until k paths are found
+    def k_shortest_paths(self, src, dst, k):
+        shortest = int(self.dist[src, dst])
+        paths = []
+
+        for bound in range(shortest, shortest + 3):
+            stack = [[src]]
+            while stack and len(paths) < k:
+                path = stack.pop()
+                u = path[-1]
+
+                if u == dst:
+                    if len(path) - 1 == bound:
+                        paths.append(path)
+                    continue
+
+                for v in self.neighbors[u][::-1]:
+                    if v not in path and len(path) + self.dist[v, dst] <= bound:
+                        stack.append(path + [v])
+
+            if len(paths) >= k:
+                break
+
+        return paths
+
+    # Paths of a flow as arrays of arc indices. ECMP paths depend on the flow hash and are not cached.
+    def route(self, scheme, src, dst, flow_hash=0, k=8):
+        if np.isinf(self.dist[src, dst]):
+            raise ValueError(f'No path between node {src} and node {dst}')
+
+        if scheme == 'ecmp':
+            return self.to_arcs(self.ecmp_path(src, dst, flow_hash))
+
+        key = (scheme, src, dst, k)
+        if key not in self.path_cache:
+            if scheme == 'sp':
+                paths = self.shortest_path(src, dst)
+            elif scheme == 'ksp':
+                paths = self.k_shortest_paths(src, dst, k)
+            else:
+                raise ValueError(f'Unknown routing scheme: {scheme}')
+
+            self.path_cache[key] = self.to_arcs(paths)
+
+        return self.path_cache[key]
+
+    def to_arcs(self, paths):
+        return [np.array([self.arc_index[(u, v)] for u, v in zip(path[:-1], path[1:])], dtype=np.int64) for path in paths]
+
+    # Max-min fair rate of every flow between servers sources[i] -> destinations[i].
+    # With 'ksp' a flow is split into one subflow per path (like MPTCP) and gets the sum of their rates.
+    # A server that sends to itself never enters the network, its flow gets the rate of its link.
+    def simulate(self, sources, destinations, scheme='ecmp', k=8, seed=0):
+        flow_of_subflow = []
+        subflow_arcs = []
+        local = np.asarray(sources) == np.asarray(destinations)
+
+        for flow, (src, dst) in enumerate(zip(sources, destinations)):
+            if local[flow]:
+                continue
+            for arcs in self.route(scheme, int(src), int(dst), flow_hash=(seed, flow), k=k):
+                flow_of_subflow.append(flow)
+                subflow_arcs.append(arcs)
+
+        rates = np.where(local, self.bw, 0.0)
+        if not subflow_arcs:
+            return rates
+
+        lengths = [len(arcs) for arcs in subflow_arcs]
+        routing = csr_matrix((np.ones(sum(lengths)),
+                              (np.repeat(np.arange(len(subflow_arcs)), lengths), np.concatenate(subflow_arcs))),
+                             shape=(len(subflow_arcs), len(self.capacity)))
+
+        subflow_rates = max_min_fair(routing, self.capacity)
+        return rates + np.bincount(flow_of_subflow, weights=subflow_rates, minlength=len(sources))
+
+
+# Progressive filling: all unfrozen flows grow at the same rate until a link saturates, then every
+# flow crossing a saturated link is frozen. 'routing' is the (flows x links) incidence matrix.
+def max_min_fair(routing, capacity, tolerance=1e-9):
+    rates = np.zeros(routing.shape[0])
+    remaining = capacity.astype(float).copy()
+    active = np.ones(routing.shape[0], dtype=bool)
+
+    routing_t = routing.T.tocsr()
+
+    while active.any():
+        # number of active flows on every link
+        load = routing_t @ active.astype(float)
+        used = load > 0
+
+        increment = (remaining[used] / load[used]).min()
+
+        rates[active] += increment
+        remaining -= increment * load
+
+        saturated = used & (remaining <= tolerance * capacity)
+        active &= ~(routing @ saturated.astype(float) > 0)
+
+    return rates
+
+
+# command line usage
+def main(argv):
+    usage = 'Usage: $ python3 flow_sim.py (fattree num_ports | jellyfish num_servers num_switches num_ports) (sp | ecmp | ksp) (configs)'
+
+    if len(argv) in (3, 4) and argv[0] == 'fattree':
+        topology = topo.Fattree(int(argv[1]))
+        scheme, configs = argv[2], int(argv[3]) if len(argv) == 4 else 1
+    elif len(argv) in (5, 6) and argv[0] == 'jellyfish':
+        topology = topo.Jellyfish(int(argv[1]), int(argv[2]), int(argv[3]))
+        scheme, configs = argv[4], int(argv[5]) if len(argv) == 6 else 1
+    else:
+        raise ValueError(usage)
+
+    simulator = FlowSimulator(topology.servers, topology.switches)
+
+    # random permutation traffic between the connected servers
+    traffic = TrafficGenerator(topology, seed=0)
+
+    start = time.time()
+    rates = []
+    for config in range(configs):
+        sources, destinations = traffic.random_permutation()
+        rates.append(simulator.simulate(sources, destinations, scheme=scheme, seed=config))
+    elapsed = time.time() - start
+
+    rates = np.concatenate(rates)
+    print(f'{configs} configurations in {elapsed:.2f} s')
+    print(f'Rate per flow (Mbit/s): mean {rates.mean():.2f}, min {rates.min():.2f}, '
+          f'p50 {np.percentile(rates, 50):.2f}, max {rates.max():.2f}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
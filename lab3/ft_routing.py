@@ -25,6 +25,7 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib import mac
+from ryu.lib import hub
 from ryu.lib.packet import packet
 from ryu.lib.packet import ipv4
 from ryu.lib.packet import ipv6
@@ -32,17 +33,42 @@ from ryu.lib.packet import arp
 
 from ryu.topology import event, switches
 from ryu.topology.api import get_switch, get_link
-from ryu.app.wsgi import ControllerBase
+from ryu.app.wsgi import ControllerBase, WSGIApplication
+from ryu import cfg
 from ryu.lib.packet import ether_types
 from ryu.lib.packet import ethernet
+import os
 import re
+import time
+import socket
 
 import topo
+import packet_decoder
+from arp_proxy import ArpProxy, arp_reply
+import packet_out
+from state_table import BoundedTable
+from metrics import ControllerMetrics, HubMonitor, LatencyHistogram, MetricsController, SampledLogger, timed
+from flow_queue import FlowModQueue, total_stats
+from hedera import ElephantScheduler
+from shard import SharedState, k_from_env, select, shard_from_env
 
 ETHERNET = ethernet.ethernet.__name__
 ETHERNET_MULTICAST = "ff:ff:ff:ff:ff:ff"
 ARP = arp.arp.__name__
 
+# two-level table: prefixes (routes down) take precedence over suffixes (routes up)
+PREFIX_PRIORITY = 500
+SUFFIX_PRIORITY = 400
+
+# select group over the uplinks of a pod switch (ECMP mode)
+UPLINK_GROUP = 1
+
+# elephant flow scheduling (hedera.py) is opt-in, this names its placement
+HEDERA_ENV = 'FT_ROUTING_HEDERA'
+
+# the network the two-level tables are made for (dpids and port numbers)
+WIRING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fattree_with_ip.py')
+
 
 def location_to_dpid(core=None, pod=None, switch=None):
     if core is not None:
@@ -51,6 +77,12 @@ def location_to_dpid(core=None, pod=None, switch=None):
         return '000000002000%02x%02x' % (pod, switch)
 
 
+def dpid_to_location(dpid):
+    if is_core(dpid):
+        return None, (dpid & 0xFF0000) >> 16
+    return (dpid & 0xFF00) >> 8, dpid & 0xFF
+
+
 def pod_name_to_location(name):
     match = re.match('p(\d+)_s(\d+)', name)
     pod, switch = match.group(1, 2)
@@ -87,23 +119,80 @@ def location_to_mac(pod, switch, host):
     return '00:00:00:%02x:%02x:%02x' % (pod, switch, host)
 
 
+def ip_to_int(ip):
+    return int.from_bytes(socket.inet_aton(ip), 'big')
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+
 class FTRouter(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'wsgi': WSGIApplication}
 
     def __init__(self, *args, **kwargs):
         super(FTRouter, self).__init__(*args, **kwargs)
-        self.topo_net = topo.Fattree(4)
-        self.k = 4
+        # k of the fat-tree from FATTREE_K (default 4), as passed to fattree_with_ip.py
+        self.k = k_from_env()
+        self.topo_net = topo.Fattree(self.k)
 
-        # Initialize mac address table
-        self.mac_to_port = {}
+        # Initialize mac address table, (dpid, mac) -> port; the controller tables are bounded in size and age
+        self.mac_to_port = BoundedTable(4096, ttl=300)
 
         # Initialize arp table
-        self.arp_table = {}
-        self.sw = {}
+        self.arp_table = BoundedTable(4096, ttl=300)
+        self.sw = BoundedTable(4096, ttl=10)
+
+        # ARP proxy seeded with every host of the topology; with arp_proxy_rules only the host
+        # ports of the edge switches send ARP to the controller, ARP from fabric ports is dropped
+        self.arp_proxy = ArpProxy(self.topo_net)
+        self.arp_proxy_rules = True
+
+        # ECMP: instead of the suffix entries, pod switches hash every flow onto one of their uplinks
+        # with an OpenFlow select group. Off by default: on permutation traffic hash collisions cost
+        # more throughput than the suffix entries lose (benchmarks/ft_throughput.txt)
+        self.ecmp = False
+
+        # Sharding (shard.py): with FATTREE_SHARDS > 1 this instance controls the switches of its pods
+        # only. The two-level tables of all switches are precomputed once and memory-mapped by every
+        # instance, so the routes of all shards agree.
+        self.shard = shard_from_env(cfg.CONF.ofp_tcp_listen_port)
+        self.routing_tables = SharedState().array(f'ft_two_level_k{self.k}', self.two_level_rows,
+                                                  sources=(__file__, topo.__file__, WIRING))
+
+        # Hedera: poll flow and port stats every interval and move elephant flows (host pairs above 10%
+        # of the link rate) to core paths with room for them (sharded: every instance places the
+        # elephants that start in its own pods). Off unless FT_ROUTING_HEDERA names the placement,
+        # 'first_fit' or 'annealing'.
+        placement = os.environ.get(HEDERA_ENV)
+        if placement not in (None, 'first_fit', 'annealing'):
+            raise ValueError(f'{HEDERA_ENV}={placement}: the placement is first_fit or annealing')
+        self.hedera = placement is not None
+        self.scheduler = ElephantScheduler(self, self.arp_proxy.table, interval=2.0, threshold=0.1,
+                                           placement=placement or 'first_fit')
+        if self.hedera:
+            self.monitor_thread = hub.spawn(self.scheduler.run)
+
+        # The tables pushed at switch connect go through a FlowModQueue per switch (flow_queue.py): one
+        # ordered, atomic bundle if flow_bundles (OVS supports the ONF bundle extension of OF1.3), else
+        # batches of flow_batch_size behind barriers
+        self.flow_bundles = False
+        self.flow_batch_size = 100
+        self.flow_queues = {}
+        self.flow_install_latency = LatencyHistogram()
+
+        # metrics served on GET /metrics, per-packet logging is sampled and at debug level
+        self.metrics = ControllerMetrics()
+        self.sampled_log = SampledLogger(self.logger)
+        self.hub_monitor = HubMonitor()
+        self.hub_monitor.start()
+        if 'wsgi' in kwargs:
+            kwargs['wsgi'].register(MetricsController, {'metrics_app': self})
 
     # Topology discovery
     @set_ev_cls(event.EventSwitchEnter)
+    @timed('switch_enter')
     def get_topology_data(self, ev):
         # Switches and links in the network
         switches = get_switch(self, None)
@@ -132,122 +221,172 @@ class FTRouter(app_manager.RyuApp):
 
         # print("Switches:\n", self.switch_dpids)
         # print("Links: \n", self.switch_dpid_links)
-        print()
 
         #################################################################
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    @timed('switch_features')
     def switch_features_handler(self, ev):
-        # k = self.topo_net.k
-        k = 4
         datapath = ev.msg.datapath
+        self.metrics.watch(datapath)
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        dpid = str(hex(datapath.id))[2:].zfill(16)
-
-        # Printing out the DPID of the switch
-        print(
-            "DPID :" + dpid[0:2] + ":" + dpid[2:4] + ":" + dpid[4:6] + ":" + dpid[6:8] + ":" + dpid[8:10] + ":" + dpid[
-                                                                                                                  10:12] + ":" + dpid[
-                                                                                                                                 12:14] + ":" + dpid[
-                                                                                                                                                14:16])
-
-        # If in DPID K is = 4 then it is a core switch
-        if dpid[10:12] == "0" + str(k):
-            # DPID_pod value from 0 to 3 for pods
-            for dpid_pod in range(0, k):
-                # setting IP address (10.dpid_pod.0.0) is the IP address of the core switch
-                ip = "10." + str(dpid_pod) + ".0.0"
-                # setting subnet mask
-                mask = "255.255.0.0"
-                match = parser.OFPMatch(eth_type=0x800, ipv4_dst=(ip, mask))
-                port = dpid_pod + 1
-                actions = [parser.OFPActionOutput(port, 0)]
-                print(ip + "/16 output port : " + str(port))
-                self.add_flow(datapath, 500, match, actions)
-
-
-        # If in DPID k is 2 or 3 then it is a aggregation switch
-        elif int(dpid[12:14]) >= (k / 2):
-            # DPID_pod value from 0 to 3 and the 4th one for the core
-            for dpid_pod in range(0, k):
-                # if DPID_pod = pod then the destination host is in the same pod or core
-                if (dpid_pod == int(dpid[10:12])):
-                    # If the destination host is in the same pod, aggregation switch should transfer the packet to edge switch
-                    for dpid_edge in range(0, int(k / 2)):
-                        # setting IP address (10.pod.edge.0) is the IP address of the edge switch
-                        ip = "10." + str(dpid_pod) + "." + str(dpid_edge) + ".0"
-                        # setting subnet mask
-                        mask = "255.255.255.0"
-                        match = parser.OFPMatch(eth_type=0x800, ipv4_dst=(ip, mask))
-                        port = dpid_edge + 3
-                        actions = [parser.OFPActionOutput(port, 0)]
-                        print(ip + "/24 output port : " + str(port))
-                        self.add_flow(datapath, 500, match, actions)
-
-                # If the destination host is not in the same pod, aggregation switch should forward the packet to the core switch
-                else:
-                    # setting IP address (10.pod.0.0) is the IP address of the core switch
-                    ip = "10." + str(dpid_pod) + ".0.0"
-                    # setting subnet mask
-                    mask = "255.255.0.0"
-                    match = parser.OFPMatch(eth_type=0x800, ipv4_dst=(ip, mask))
-                    port = int(k - 2 - (dpid_pod % (k / 2)))
-                    actions = [parser.OFPActionOutput(port, 0)]
-                    print(ip + "/16 output port : " + str(port))
-                    self.add_flow(datapath, 500, match, actions)
-
-
-
-        # If in DPID k is 0 or 1 then it is a edge switch
-        else:
+        pod, core = dpid_to_location(datapath.id)
+        if not self.fits(datapath.id):
+            self.logger.error("switch %s does not fit a fat-tree with k=%d, set FATTREE_K to the k of the network",
+                              dpid_to_name(datapath.id), self.k)
+        if not self.shard.owns(pod, core):
+            self.logger.warning("switch %s connected to %r, which does not control its pod", dpid_to_name(datapath.id),
+                                self.shard)
+
+        # the complete two-level table of the switch, queued and sent in one flush
+        started = time.perf_counter()
+        queue = self.flow_queue(datapath)
+        table = self.shared_table(datapath.id)
+
+        if self.ecmp and not is_core(datapath.id):
+            table = [entry for entry in table if entry[0] != SUFFIX_PRIORITY]
+            self.add_uplink_group(datapath, queue)
+
+            # the group has to exist before an entry can point to it
+            queue.fence()
+
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP)
+            self.add_flow(datapath, SUFFIX_PRIORITY, match, [parser.OFPActionGroup(UPLINK_GROUP)], queue)
 
-            for dpid_pod in range(0, k):
-                # if DPID_pod = pod then the destination host is in the same pod
-                if (dpid_pod == int(dpid[10:12])):
-                    # If the destination host is in the same pod, then check if the destination host is in the same edge or not
-                    for dpid_edge in range(0, int(k / 2)):
-                        # If dpid_edge == switch then the destination host is in the same edge
-                        if (dpid_edge == int(dpid[12:14])):
-                            # If the destination host is in the same edge, then the Edge switch should transfer the packet to the host
-                            for ip_host in range(0, int(k / 2)):
-                                # setting IP address (10.dpid_pod.dpid_edge.ip_host) is the IP address of the host
-                                ip = "10." + str(dpid_pod) + "." + str(dpid_edge) + "." + str(ip_host + 2)
-                                match = parser.OFPMatch(eth_type=0x800, ipv4_dst=ip)
-                                actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
-                                print(ip + "/24 output port : Forwarding to Controller Packetin")
-                                self.add_flow(datapath, 500, match, actions)
-
-                        # If If dpid_edge not = switch then the destination host is in the same pod but not in the same edge switch
-                        else:
-                            # If the destination host is not in the same edge switch, then the Edge switch should transfer the packet to the Aggregation switch
-                            for ip_host in range(0, int(k / 2)):
-                                # setting IP address (10.dpid_pod.dpid_edge.ip_host) is the IP address of the other edge switch host
-                                ip = "10." + str(dpid_pod) + "." + str(dpid_edge) + "." + str(ip_host + 2)
-                                match = parser.OFPMatch(eth_type=0x800, ipv4_dst=ip)
-                                actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
-                                print(ip + "/24 output port : Forwarding to Controller Packetin")
-                                self.add_flow(datapath, 500, match, actions)
-
-                # If DPID_pod not = pod then the destination host is not in the same pod
-                else:
-                    ip = "10." + str(dpid_pod) + ".0.0"
-                    # setting subnet mask
-                    mask = "255.255.0.0"
-                    match = parser.OFPMatch(eth_type=0x800, ipv4_dst=(ip, mask))
-                    actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
-                    print(ip + "/24 output port : Forwarding to Controller Packetin")
-                    self.add_flow(datapath, 500, match, actions)
-
-        # Install entry-miss flow entry
+        for priority, ipv4_dst, port in table:
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=ipv4_dst)
+            actions = [parser.OFPActionOutput(port, 0)]
+            self.add_flow(datapath, priority, match, actions, queue)
+
+        if self.arp_proxy_rules:
+            self.arp_proxy.install_rules(datapath, self.host_ports(datapath.id), queue)
+
+        # the monitoring entries of an edge switch take its uplink actions (with ECMP the group, behind the fence above)
+        if self.hedera:
+            self.scheduler.add_switch(datapath, *dpid_to_location(datapath.id), queue=queue)
+
+        queue.flush(callback=lambda: self.logger.info("switch %s (%s): installed %d routing entries in %.1f ms",
+                                                      dpid_to_name(datapath.id), self.switch_role(datapath.id),
+                                                      len(table), (time.perf_counter() - started) * 1e3))
+
+        # No table-miss entry: packets without a route are dropped instead of sent to the controller
         # match = parser.OFPMatch()
         # actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
         # self.add_flow(datapath, 0, match, actions)
-        # self.logger.info("switch:%s connected", datapath.id)
 
-    # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+    # Whether a dpid is a switch of the fat-tree with this k (a network started with another k is not)
+    def fits(self, dpid):
+        if is_core(dpid):
+            _, core = dpid_to_location(dpid)
+            return core < (self.k // 2) ** 2
+        pod, switch = dpid_to_location(dpid)
+        return pod < self.k and switch < self.k
+
+    # 'core', 'aggregation' or 'edge'. Within a pod, switches 0 to k/2 - 1 are edge switches and
+    # switches k/2 to k - 1 aggregation switches (see location_to_dpid in fattree_with_ip.py)
+    def switch_role(self, dpid):
+        if is_core(dpid):
+            return 'core'
+        _, switch = dpid_to_location(dpid)
+        return 'edge' if switch < self.k // 2 else 'aggregation'
+
+    # Ports of a pod switch that lead up: to the aggregation switches (edge) or to the core (aggregation)
+    def uplink_ports(self, dpid):
+        half = self.k // 2
+        if self.switch_role(dpid) == 'edge':
+            return list(range(half + 1, self.k + 1))
+        return list(range(1, half + 1))
+
+    # Select group with one equally weighted bucket per uplink; the switch picks the bucket from a
+    # hash of the flow, and skips buckets whose port is down
+    def add_uplink_group(self, datapath, queue=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        buckets = [parser.OFPBucket(weight=1, watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                    actions=[parser.OFPActionOutput(port)])
+                   for port in self.uplink_ports(datapath.id)]
+
+        mod = parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_SELECT, UPLINK_GROUP, buckets)
+        if queue is not None:
+            queue.add(mod)
+        else:
+            datapath.send_msg(mod)
+
+    # Actions that send traffic for 'ipv4_dst' up from a pod switch: the uplink group, or the port of
+    # the suffix entry for its host id
+    def uplink_actions(self, datapath, ipv4_dst):
+        parser = datapath.ofproto_parser
+
+        if self.ecmp:
+            return [parser.OFPActionGroup(UPLINK_GROUP)]
+
+        half = self.k // 2
+        _, switch = dpid_to_location(datapath.id)
+        host = int(ipv4_dst.split('.')[3])
+        return [parser.OFPActionOutput(self.uplink_ports(datapath.id)[(host - 2 + switch % half) % half])]
+
+    # Ports of an edge switch that hosts are connected to
+    def host_ports(self, dpid):
+        if self.switch_role(dpid) != 'edge':
+            return []
+        return list(range(1, self.k // 2 + 1))
+
+    # Two-level routing table (Al-Fares et al.) of a switch as [(priority, ipv4_dst, port)].
+    # Port numbers follow fattree_with_ip.py:
+    #   core:        port x + 1 leads to pod x
+    #   aggregation: ports 1..k/2 go up to the core, port k/2 + 1 + e down to edge switch e
+    #   edge:        port h - 1 leads to host 10.pod.switch.h, ports k/2 + 1 + a up to aggregation switch a
+    # Prefixes route traffic down to its subnet; the suffix entries (on the host id, the last byte of
+    # the address) spread all other traffic over the uplinks, shifted by the position of the switch.
+    def two_level_table(self, dpid):
+        k = self.k
+        half = k // 2
+        table = []
+
+        if is_core(dpid):
+            for pod in range(k):
+                table.append((PREFIX_PRIORITY, ('10.%d.0.0' % pod, '255.255.0.0'), pod + 1))
+            return table
+
+        pod, switch = dpid_to_location(dpid)
+        position = switch % half
+
+        if switch < half:
+            for host in range(2, half + 2):
+                table.append((PREFIX_PRIORITY, '10.%d.%d.%d' % (pod, switch, host), host - 1))
+        else:
+            for edge in range(half):
+                table.append((PREFIX_PRIORITY, ('10.%d.%d.0' % (pod, edge), '255.255.255.0'), half + 1 + edge))
+
+        uplinks = self.uplink_ports(dpid)
+        for host in range(2, half + 2):
+            table.append((SUFFIX_PRIORITY, ('0.0.0.%d' % host, '0.0.0.255'), uplinks[(host - 2 + position) % half]))
+
+        return table
+
+    # Two-level tables of all switches as rows (dpid, priority, address, mask, port), sorted
+    def two_level_rows(self):
+        half = self.k // 2
+        dpids = [int(location_to_dpid(core=core), 16) for core in range(half ** 2)]
+        dpids += [int(location_to_dpid(pod=pod, switch=switch), 16) for pod in range(self.k) for switch in range(self.k)]
+
+        rows = []
+        for dpid in dpids:
+            for priority, ipv4_dst, port in self.two_level_table(dpid):
+                address, mask = ipv4_dst if isinstance(ipv4_dst, tuple) else (ipv4_dst, '255.255.255.255')
+                rows.append((dpid, priority, ip_to_int(address), ip_to_int(mask), port))
+        return sorted(rows)
+
+    # Two-level table of a switch from the shared state, like two_level_table
+    def shared_table(self, dpid):
+        return [(priority, (int_to_ip(address), int_to_ip(mask)), port)
+                for _, priority, address, mask, port in select(self.routing_tables, dpid).tolist()]
+
+    # Add a flow entry to the flow-table, or queue it on 'queue' (a FlowModQueue)
+    def add_flow(self, datapath, priority, match, actions, queue=None):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -255,210 +394,140 @@ class FTRouter(app_manager.RyuApp):
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
                                 match=match, instructions=inst)
-        datapath.send_msg(mod)
-
+        if queue is not None:
+            queue.add(mod)
+        else:
+            datapath.send_msg(mod)
+
+    # Flow-mod queue of a switch, a new one when the switch reconnects
+    def flow_queue(self, datapath):
+        queue = self.flow_queues.get(datapath.id)
+        if queue is None or queue.datapath is not datapath:
+            queue = FlowModQueue(datapath, self.flow_batch_size, bundles=self.flow_bundles,
+                                 latency=self.flow_install_latency)
+            self.flow_queues[datapath.id] = queue
+        return queue
+
+    # Barrier replies and errors complete (or reject the bundles of) the flushes of a flow-mod queue
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    @timed('barrier_reply')
+    def barrier_reply_handler(self, ev):
+        queue = self.flow_queues.get(ev.msg.datapath.id)
+        if queue is not None:
+            queue.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    @timed('error')
+    def error_msg_handler(self, ev):
+        self.logger.warning("switch %s: error type %d code %d for xid %d", dpid_to_name(ev.msg.datapath.id),
+                            ev.msg.type, ev.msg.code, ev.msg.xid)
+        queue = self.flow_queues.get(ev.msg.datapath.id)
+        if queue is not None:
+            queue.error(ev.msg)
+
+    # All IPv4 routes are installed at switch connect, so only ARP reaches the controller
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    @timed('packet_in')
     def _packet_in_handler(self, ev):
-        k = 4
-        datapath = ev.msg.datapath
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
-        buffer_id = ofproto.OFP_NO_BUFFER
-        dpid = str(hex(datapath.id))[2:].zfill(16)
-
-        # Printing out the DPID of the switch
-        print("DPID is :" + dpid[0:2] + ":" + dpid[2:4] + ":" + dpid[4:6] + ":" + dpid[6:8] + ":" + dpid[
-                                                                                                    8:10] + ":" + dpid[
-                                                                                                                  10:12] + ":" + dpid[
-                                                                                                                                 12:14] + ":" + dpid[
-                                                                                                                                                14:16])
-
-        # Extracting the pod No from the DPID
-        pod_no = dpid[10:12]
-
-        # Extracting the switch No from the DPID
-        switch_no = dpid[12:14]
-
-        print('Current Switch No = ' + str(int(switch_no) + 1) + '; Current Pod No = ' + str((int(pod_no) + 1)))
-
-        # Get packet information
         msg = ev.msg
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        data = msg.data
+        datapath = msg.datapath
+        self.metrics.packet_in(datapath.id)
         in_port = msg.match['in_port']
 
+        headers = packet_decoder.decode(msg.data)
+
         # Avoid LLDP:
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if headers is None or headers.is_lldp:
+            packet_out.drop(datapath, msg)
             return
 
-        # Avoid IPV6 packet for now..
-        if pkt.get_protocol(ipv6.ipv6):
-            match = parser.OFPMatch(eth_type=eth.ethertype)
-            actions = []
-            self.add_flow(datapath, 1, match, actions)
-            return None
-
-        self.mac_to_port.setdefault(dpid, {})
-
-        if eth.ethertype == ether_types.ETH_TYPE_ARP:
-
-            arp_packet = pkt.get_protocol(arp.arp)
-
-            ip_dst = arp_packet.dst_ip
-
-            ip_src = arp_packet.src_ip
-
-            print('\nARP Packet:' '\nSource IP = ' + str(ip_src) + '\nDestination IP = ' + str(
-                ip_dst) + '\nData = "' + str(data) + '"')
+        if headers.is_arp:
+            self.sampled_log.debug('ARP packet %s -> %s at switch %s', headers.arp_src_ip, headers.arp_dst_ip,
+                                   dpid_to_name(datapath.id))
 
-            if self.arp_handler(msg):
+            # answered from the topology, the request never leaves the edge switch
+            if self.arp_proxy.handle(datapath, in_port, headers):
+                packet_out.drop(datapath, msg)
                 return None
 
+            self.arp_table[headers.arp_src_ip] = headers.eth_src
+            self.arp_handler(msg, headers)
+            return None
 
-        elif eth.ethertype == ether_types.ETH_TYPE_IP:
-
-            ip_packet = pkt.get_protocol(ipv4.ipv4)
-
-            ip_src = ip_packet.src
-
-            ip_dst = ip_packet.dst
-
-            print('\nIPv4 Packet:' '\nSource IP = ' + str(ip_src) + '\nDestination IP = ' + str(
-                ip_dst) + '\nData = "' + str(data) + '"')
-
-        else:
-
-            return
-
-
-        x, pod_dst, edge_sw_dst, host_ip_dst = ip_dst.split('.')
-        pod_dst = int(pod_dst) + 1
-        edge_sw_dst = int(edge_sw_dst) + 1
-        host_ip_dst = int(host_ip_dst) - 2
-        current_pod = int(pod_no) + 1
-        current_sw = int(switch_no) + 1
-
-        print('\nPacket intended destination was:\nPod = ' + str(pod_dst) + '\nDestination Switch = ' + str(
-            edge_sw_dst) + '\nDestination Host = ' + str(host_ip_dst))
-
-        print('\nPacket Origin was:\nOrigin Pod = ' + str(current_pod) + '\nOrigin Switch = ' + str(current_sw))
-
-        print('\nInstalling Destination Flows:')
-
-        # DPID_pod value from 0 to 3
-
-        for dpid_pod in range(0, k):
-
-            # if DPID_pod = pod then the destination host is in the same pod
-            if dpid_pod == int(dpid[10:12]):
-                # If the destination host is in the same pod, then check if the destination host is in the same edge or not
-                for dpid_edge in range(0, int(k / 2)):
-                    # If dpid_edge == switch then the destination host is in the same edge
-                    if dpid_edge == int(dpid[12:14]):
-                        # If the destination host is in the same edge, then the Edge switch should transfer the packet to the host
-                        for ip_host in range(0, int(k / 2)):
-                            # setting IP address (10.dpid_pod.dpid_edge.ip_host) is the IP address of the host
-                            ip = "10." + str(dpid_pod) + "." + str(dpid_edge) + "." + str(ip_host + 2)
-                            match = parser.OFPMatch(eth_type=0x800, ipv4_dst=ip)
-                            port = ip_host + 1
-                            actions = [parser.OFPActionOutput(port, 0)]
-                            print(ip + "/24 output port : " + str(port))
-                            self.add_flow(datapath, 500, match, actions)
-
-                    # If If dpid_edge not = switch then the destination host is in the same pod but not in the same edge switch
-                    else:
-                        # If the destination host is not in the same edge switch, then the Edge switch should transfer the packet to the Aggregation switch
-                        for ip_host in range(0, int(k / 2)):
-                            # setting IP address (10.dpid_pod.dpid_edge.ip_host) is the IP address of the other edge switch host
-                            ip = "10." + str(dpid_pod) + "." + str(dpid_edge) + "." + str(ip_host + 2)
-                            match = parser.OFPMatch(eth_type=0x800, ipv4_dst=ip)
-                            port = int(k - (ip_host % (k / 2)))
-                            actions = [parser.OFPActionOutput(port, 0)]
-                            print(ip + "/24 output port : " + str(port))
-                            self.add_flow(datapath, 500, match, actions)
-
-
-            # If DPID_pod not = pod then the destination host is not in the same pod
-            else:
-
-                # setting IP address (10.dpid_pod.0.0) is the IP address of the core switch
-                ip = "10." + str(dpid_pod) + ".0.0"
-                # setting subnet mask
-                mask = "255.255.0.0"
-                match = parser.OFPMatch(eth_type=0x800, ipv4_dst=(ip, mask))
-                port = int(k - (dpid_pod % (k / 2)))
-                actions = [parser.OFPActionOutput(port, 0)]
-                print(ip + "/16 output port : " + str(port))
-                self.add_flow(datapath, 500, match, actions)
-
-        # Construct packet_out message and send it
-        # out = parser.OFPPacketOut(datapath=datapath,
-        # in_port=port,
-        # actions=actions,
-        # buffer_id=ev.msg.buffer_id,
-        # data=data)
-        # datapath.send_msg(out)
-
-    def arp_handler(self, msg):
+        self.sampled_log.info('unexpected packet-in (ethertype 0x%04x) at switch %s', headers.ethertype,
+                              dpid_to_name(datapath.id))
+        packet_out.drop(datapath, msg)
+
+    # Statistics replies of the elephant scheduler
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    @timed('flow_stats')
+    def flow_stats_reply_handler(self, ev):
+        self.scheduler.flow_stats_reply(ev.msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    @timed('port_stats')
+    def port_stats_reply_handler(self, ev):
+        self.scheduler.port_stats_reply(ev.msg.datapath.id, ev.msg.body)
+
+    # Everything that GET /metrics reports
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot(self.table_stats())
+        snapshot['arp_proxy'] = {'replies': self.arp_proxy.replies, 'dropped': self.arp_proxy.dropped}
+        snapshot['hub'] = self.hub_monitor.snapshot()
+        snapshot['shard'] = {'index': self.shard.index, 'count': self.shard.count}
+        snapshot['flow_queues'] = total_stats(list(self.flow_queues.values()), self.flow_install_latency)
+        if self.hedera:
+            snapshot['hedera'] = self.scheduler.stats()
+        return snapshot
+
+    # Occupancy and eviction counters of the controller tables
+    def table_stats(self):
+        return {'mac_to_port': self.mac_to_port.stats(), 'arp_table': self.arp_table.stats(), 'sw': self.sw.stats()}
+
+    # 'headers' are the decoded headers of the packet-in (packet_decoder.decode)
+    def arp_handler(self, msg, headers):
         datapath = msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        arp_pkt = pkt.get_protocol(arp.arp)
-
-        if eth:
-            eth_dst = eth.dst
-            eth_src = eth.src
+        eth_dst = headers.eth_dst
+        eth_src = headers.eth_src
 
         # Break the loop for avoiding ARP broadcast storm
         if eth_dst == mac.BROADCAST_STR:  # and arp_pkt:
-            arp_dst_ip = arp_pkt.dst_ip
-            arp_src_ip = arp_pkt.src_ip
+            arp_dst_ip = headers.arp_dst_ip
+            arp_src_ip = headers.arp_src_ip
 
             if (datapath.id, arp_src_ip, arp_dst_ip) in self.sw:
                 # packet come back at different port.
                 if self.sw[(datapath.id, arp_src_ip, arp_dst_ip)] != in_port:
-                    datapath.send_packet_out(in_port=in_port, actions=[])
+                    packet_out.drop(datapath, msg)
                     return True
             else:
                 # self.sw.setdefault((datapath.id, eth_src, arp_dst_ip), None)
                 self.sw[(datapath.id, arp_src_ip, arp_dst_ip)] = in_port
-                print(self.sw)
-                self.mac_to_port.setdefault(datapath.id, {})
-                self.mac_to_port[datapath.id][eth_src] = in_port
+                self.sampled_log.debug('ARP loop table: %d entries', len(self.sw))
+                self.mac_to_port[(datapath.id, eth_src)] = in_port
 
         # Try to reply arp request
-        if arp_pkt:
-            if arp_pkt.opcode == arp.ARP_REQUEST:
-                arp_src_ip = arp_pkt.src_ip
-                arp_dst_ip = arp_pkt.dst_ip
+        if headers.is_arp:
+            if headers.arp_opcode == arp.ARP_REQUEST:
+                arp_src_ip = headers.arp_src_ip
+                arp_dst_ip = headers.arp_dst_ip
                 if arp_dst_ip in self.arp_table:
                     actions = [parser.OFPActionOutput(in_port)]
-                    ARP_Reply = packet.Packet()
-
-                    ARP_Reply.add_protocol(ethernet.ethernet(
-                        ethertype=eth.ethertype,
-                        dst=eth_src,
-                        src=self.arp_table[arp_dst_ip]))
-                    ARP_Reply.add_protocol(arp.arp(
-                        opcode=arp.ARP_REPLY,
-                        src_mac=self.arp_table[arp_dst_ip],
-                        src_ip=arp_dst_ip,
-                        dst_mac=eth_src,
-                        dst_ip=arp_src_ip))
 
-                    ARP_Reply.serialize()
+                    # the reply is packed straight into bytes, the request is released from the switch buffer
+                    data = arp_reply(self.arp_table[arp_dst_ip], arp_dst_ip, eth_src, arp_src_ip)
 
                     out = parser.OFPPacketOut(
                         datapath=datapath,
                         buffer_id=ofproto.OFP_NO_BUFFER,
                         in_port=ofproto.OFPP_CONTROLLER,
-                        actions=actions, data=ARP_Reply.data)
+                        actions=actions, data=data)
                     datapath.send_msg(out)
-                    print("ARP_Reply")
+                    packet_out.drop(datapath, msg)
+                    self.sampled_log.debug('ARP reply for %s', arp_dst_ip)
                     return True
         return False
@@ -0,0 +1,277 @@
+import time
+
+from ryu.lib import hub
+from ryu.lib.packet import ether_types
+
+from placement import estimate_demands, global_first_fit, path_links, simulated_annealing
+
+# Elephant flow scheduling for the fat-tree (Hedera, Al-Fares et al. 2010). Hash-based ECMP places
+# flows without looking at their size, so two large flows can collide on one core link while other
+# core links stay idle. The scheduler polls flow and port statistics of the switches in bulk (one
+# request per switch per interval), detects the host pairs that send faster than a threshold
+# (elephants), estimates their natural demand, and places them on core paths with global first fit
+# or simulated annealing. Placed elephants get exact entries at their source edge and aggregation
+# switches, all other traffic keeps its ECMP (or two-level table) route.
+#
+# Per-flow counters come from monitoring entries: every edge switch gets one entry per
+# (local host, remote host) pair, with the same actions as the uplink route it overrides.
+# A flow is therefore a host pair, as in the iperf permutation workloads.
+
+# entries of the scheduler, between the two-level prefixes (500) and suffixes (400), and above them
+MONITOR_PRIORITY = 450
+REROUTE_PRIORITY = 600
+
+MONITOR_COOKIE = 0x4845
+REROUTE_COOKIE = 0x4846
+
+
+# Location (pod, edge switch) of a host address 10.pod.switch.host
+def ip_to_location(ip):
+    _, pod, switch, _ = ip.split('.')
+    return int(pod), int(switch)
+
+
+class ElephantScheduler:
+
+    def __init__(self, app, host_ips, interval=2.0, threshold=0.1, capacity=15e6 / 8, placement='first_fit'):
+        self.app = app
+        self.half = app.k // 2
+        self.host_ips = sorted(host_ips)
+
+        # poll interval (s), elephant threshold as a fraction of the link capacity (bytes/s)
+        self.interval = interval
+        self.threshold = threshold
+        self.capacity = capacity
+        self.placement = placement
+
+        # (pod, switch) -> datapath of the pod switches, core number -> datapath
+        self.pod_switches = {}
+        self.core_switches = {}
+
+        # (src ip, dst ip) -> (byte count, duration) at the previous poll, and the rate since (bytes/s)
+        self.flow_counters = {}
+        self.flow_rates = {}
+
+        # link -> (tx bytes, time) at the previous poll, and the rate since (bytes/s)
+        self.port_counters = {}
+        self.link_rates = {}
+
+        # (src ip, dst ip) -> path choice of the elephants that are rerouted
+        self.placements = {}
+
+        self.polls = 0
+        self.reroutes = 0
+
+    # Monitoring entries of an edge switch are queued on 'queue' (a FlowModQueue) if one is given
+    def add_switch(self, datapath, pod, switch, queue=None):
+        if pod is None:
+            self.core_switches[switch] = datapath
+            return
+
+        self.pod_switches[(pod, switch)] = datapath
+        if switch < self.half:
+            self.install_monitoring(datapath, pod, switch, queue)
+
+    # One entry per (local host, remote host) pair, with the actions of the uplink route
+    def install_monitoring(self, datapath, pod, switch, queue=None):
+        parser = datapath.ofproto_parser
+
+        for src_ip in self.host_ips:
+            if ip_to_location(src_ip) != (pod, switch):
+                continue
+
+            for dst_ip in self.host_ips:
+                if ip_to_location(dst_ip) == (pod, switch):
+                    continue
+
+                match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=src_ip, ipv4_dst=dst_ip)
+                self.send_flow(datapath, MONITOR_PRIORITY, MONITOR_COOKIE, match,
+                               self.app.uplink_actions(datapath, dst_ip), queue=queue)
+
+    def send_flow(self, datapath, priority, cookie, match, actions, command=None, queue=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie, priority=priority,
+                                command=ofproto.OFPFC_ADD if command is None else command,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                match=match, instructions=inst)
+        if queue is not None:
+            queue.add(mod)
+        else:
+            datapath.send_msg(mod)
+
+    # Poll thread: request the statistics, wait an interval for the replies, then schedule
+    def run(self):
+        while True:
+            self.poll()
+            hub.sleep(self.interval)
+            self.schedule()
+
+    # One flow stats request (monitoring entries only) per edge switch, one port stats request
+    # (all ports) per switch
+    def poll(self):
+        self.polls += 1
+
+        for (pod, switch), datapath in self.pod_switches.items():
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+
+            if switch < self.half:
+                datapath.send_msg(parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                                             ofproto.OFPG_ANY, MONITOR_COOKIE, 0xffffffffffffffff,
+                                                             parser.OFPMatch()))
+            datapath.send_msg(parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY))
+
+        for datapath in self.core_switches.values():
+            datapath.send_msg(datapath.ofproto_parser.OFPPortStatsRequest(datapath, 0, datapath.ofproto.OFPP_ANY))
+
+    def flow_stats_reply(self, body):
+        for stat in body:
+            if stat.cookie != MONITOR_COOKIE:
+                continue
+
+            key = (stat.match['ipv4_src'], stat.match['ipv4_dst'])
+            duration = stat.duration_sec + stat.duration_nsec * 1e-9
+
+            previous = self.flow_counters.get(key)
+            if previous is not None and duration > previous[1]:
+                self.flow_rates[key] = (stat.byte_count - previous[0]) / (duration - previous[1])
+            self.flow_counters[key] = (stat.byte_count, duration)
+
+    def port_stats_reply(self, dpid, body):
+        now = time.monotonic()
+
+        for stat in body:
+            link = self.port_link(dpid, stat.port_no)
+            if link is None:
+                continue
+
+            previous = self.port_counters.get(link)
+            if previous is not None and now > previous[1]:
+                self.link_rates[link] = (stat.tx_bytes - previous[0]) / (now - previous[1])
+            self.port_counters[link] = (stat.tx_bytes, now)
+
+    # The directed fabric link (as in path_links) behind a switch port, None for host ports.
+    # Port numbers follow FTRouter.two_level_table.
+    def port_link(self, dpid, port):
+        half = self.half
+
+        for core, datapath in self.core_switches.items():
+            if datapath.id == dpid:
+                if 1 <= port <= 2 * half:
+                    return 'core-agg', port - 1, core // half, core % half
+                return None
+
+        for (pod, switch), datapath in self.pod_switches.items():
+            if datapath.id != dpid or not half < port <= 2 * half:
+                continue
+            if switch < half:
+                return 'edge-agg', pod, switch, port - half - 1
+            return 'agg-edge', pod, switch - half, port - half - 1
+
+        for (pod, switch), datapath in self.pod_switches.items():
+            if datapath.id == dpid and switch >= half and 1 <= port <= half:
+                return 'agg-core', pod, switch - half, port - 1
+
+        return None
+
+    # Candidate paths ordered by the measured load of their links, least loaded first
+    def by_load(self, src, dst, paths):
+        return sorted(paths, key=lambda choice: sum(self.link_rates.get(link, 0.0)
+                                                    for link in path_links(src, dst, choice)))
+
+    # Elephants as (key, src, dst, demand in bytes/s), the demand is the estimated natural demand
+    def elephants(self):
+        keys = [key for key, rate in self.flow_rates.items() if rate >= self.threshold * self.capacity
+                and ip_to_location(key[0]) != ip_to_location(key[1])]
+        demands = estimate_demands(keys)
+
+        return [(key, ip_to_location(key[0]), ip_to_location(key[1]), demands[key] * self.capacity)
+                for key in keys]
+
+    def schedule(self):
+        elephants = self.elephants()
+
+        placement = global_first_fit(elephants, self.half, self.capacity, self.by_load)
+        if self.placement == 'annealing':
+            placement = simulated_annealing(elephants, self.half, self.capacity, initial=placement)
+
+        # flows that are no longer elephants go back to the uplink route
+        for key in list(self.placements):
+            if key not in placement:
+                self.unroute(key)
+
+        for key, choice in placement.items():
+            if self.placements.get(key) != choice:
+                self.reroute(key, choice)
+
+        if elephants:
+            self.app.logger.info('hedera: %d elephants, %d placed, %d rerouted so far', len(elephants),
+                                 len(placement), self.reroutes)
+
+    # Pin a host pair on a path: the aggregation switch first, so the edge switch never sends the
+    # flow up to an aggregation switch that has no entry for it yet
+    def reroute(self, key, choice):
+        src_ip, dst_ip = key
+        src, dst = ip_to_location(src_ip), ip_to_location(dst_ip)
+        a, u = choice
+
+        edge = self.pod_switches.get(src)
+        if edge is None:
+            return
+        ofproto = edge.ofproto
+        parser = edge.ofproto_parser
+
+        aggregation = self.pod_switches.get((src[0], self.half + a))
+        if src[0] != dst[0] and aggregation is not None:
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=src_ip, ipv4_dst=dst_ip)
+            self.send_flow(aggregation, REROUTE_PRIORITY, REROUTE_COOKIE, match, [parser.OFPActionOutput(u + 1)])
+            aggregation.send_msg(parser.OFPBarrierRequest(aggregation))
+
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=src_ip, ipv4_dst=dst_ip)
+        self.send_flow(edge, MONITOR_PRIORITY, MONITOR_COOKIE, match,
+                       [parser.OFPActionOutput(self.half + 1 + a)], ofproto.OFPFC_MODIFY_STRICT)
+
+        previous = self.placements.get(key)
+        if previous is not None and previous[0] != a:
+            self.delete_reroute(key, src, previous)
+
+        self.placements[key] = choice
+        self.reroutes += 1
+
+    def unroute(self, key):
+        src_ip, dst_ip = key
+        src = ip_to_location(src_ip)
+        choice = self.placements.pop(key)
+
+        edge = self.pod_switches.get(src)
+        if edge is not None:
+            match = edge.ofproto_parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=src_ip, ipv4_dst=dst_ip)
+            self.send_flow(edge, MONITOR_PRIORITY, MONITOR_COOKIE, match,
+                           self.app.uplink_actions(edge, dst_ip), edge.ofproto.OFPFC_MODIFY_STRICT)
+
+        self.delete_reroute(key, src, choice)
+
+    # Only pairs in different pods have an entry at their aggregation switch
+    def delete_reroute(self, key, src, choice):
+        aggregation = self.pod_switches.get((src[0], self.half + choice[0]))
+        if aggregation is None or ip_to_location(key[1])[0] == src[0]:
+            return
+
+        ofproto = aggregation.ofproto
+        parser = aggregation.ofproto_parser
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=key[0], ipv4_dst=key[1])
+        mod = parser.OFPFlowMod(datapath=aggregation, cookie=REROUTE_COOKIE, cookie_mask=0xffffffffffffffff,
+                                command=ofproto.OFPFC_DELETE_STRICT, priority=REROUTE_PRIORITY,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY, match=match)
+        aggregation.send_msg(mod)
+
+    # Counters and the current placement, for GET /metrics
+    def stats(self):
+        return {'polls': self.polls, 'reroutes': self.reroutes, 'placement': self.placement,
+                'elephants': {f'{src}->{dst}': {'rate': self.flow_rates.get((src, dst)), 'path': list(choice)}
+                              for (src, dst), choice in self.placements.items()},
+                'link_utilization': {'/'.join(str(part) for part in link): rate / self.capacity
+                                     for link, rate in sorted(self.link_rates.items())}}
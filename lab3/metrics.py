@@ -0,0 +1,195 @@
+import json
+import time
+import bisect
+import logging
+import functools
+from collections import defaultdict
+
+from ryu.app.wsgi import ControllerBase, route
+from ryu.lib import hub
+from webob import Response
+
+
+# Controller metrics for the routing apps, served as JSON on GET /metrics of the Ryu WSGI app:
+# packet-in counts and rates per switch, handler latency histograms, OpenFlow messages sent per
+# type, and the occupancy and hit rates of the controller tables (route cache included).
+# Recording is a counter increment or a bisect, so it stays cheap on the packet-in path.
+
+
+# Latency histogram with logarithmic buckets from 10 us to 1 s (upper bounds in seconds)
+class LatencyHistogram:
+
+    BOUNDS = [10e-6 * 10 ** (i / 4) for i in range(21)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+
+    # Approximate percentile: the upper bound of the bucket that contains it
+    def percentile(self, p):
+        if self.n == 0:
+            return None
+
+        rank = p / 100 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else float('inf')
+
+    def snapshot(self):
+        return {'count': self.n,
+                'mean_us': self.total / self.n * 1e6 if self.n else None,
+                'p50_us': self.scaled(self.percentile(50)),
+                'p99_us': self.scaled(self.percentile(99)),
+                'buckets_us': {f'{bound * 1e6:.0f}': count for bound, count in zip(self.BOUNDS + [float('inf')], self.counts)
+                               if count}}
+
+    @staticmethod
+    def scaled(seconds):
+        return seconds * 1e6 if seconds is not None else None
+
+
+class ControllerMetrics:
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+        self.packet_ins = defaultdict(int)
+        self.messages = defaultdict(int)
+        self.message_bytes = defaultdict(int)
+        self.handlers = defaultdict(LatencyHistogram)
+
+        # packet-in counts at the previous snapshot, for the rate since then
+        self.last_snapshot = self.started
+        self.last_packet_ins = {}
+
+    def packet_in(self, dpid):
+        self.packet_ins[dpid] += 1
+
+    def observe(self, handler, seconds):
+        self.handlers[handler].observe(seconds)
+
+    # Count every message sent to a datapath by type (OFPFlowMod, OFPPacketOut, ...), including the
+    # ones sent by helpers such as the ARP proxy or datapath.send_packet_out, and their bytes (the
+    # message is serialized by send_msg)
+    def watch(self, datapath):
+        send_msg = datapath.send_msg
+
+        def counted_send_msg(msg, *args, **kwargs):
+            name = type(msg).__name__
+            self.messages[name] += 1
+            try:
+                return send_msg(msg, *args, **kwargs)
+            finally:
+                self.message_bytes[name] += len(getattr(msg, 'buf', None) or b'')
+
+        datapath.send_msg = counted_send_msg
+
+    # 'tables' maps a table name to its BoundedTable.stats()
+    def snapshot(self, tables=None):
+        now = time.monotonic()
+        interval = max(now - self.last_snapshot, 1e-9)
+
+        packet_ins = {}
+        for dpid, count in self.packet_ins.items():
+            packet_ins[f'{dpid:016x}'] = {'count': count,
+                                          'rate': (count - self.last_packet_ins.get(dpid, 0)) / interval}
+
+        self.last_snapshot = now
+        self.last_packet_ins = dict(self.packet_ins)
+
+        return {'uptime': now - self.started,
+                'packet_in': packet_ins,
+                'packet_in_total': sum(self.packet_ins.values()),
+                'messages_sent': dict(self.messages),
+                'bytes_sent': dict(self.message_bytes),
+                'handlers': {name: histogram.snapshot() for name, histogram in self.handlers.items()},
+                'tables': tables or {}}
+
+
+# How long the eventlet hub is blocked: a green thread asks to wake up every 'interval' seconds and
+# records how late it is. No green thread (handler) can run while another one blocks the hub, so the
+# lateness is the time the hub spent in a handler (or other work) that did not yield.
+class HubMonitor:
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lag = LatencyHistogram()
+        self.max_blocked = 0.0
+
+    def start(self):
+        return hub.spawn(self.run)
+
+    def run(self):
+        while True:
+            start = time.perf_counter()
+            hub.sleep(self.interval)
+            blocked = max(time.perf_counter() - start - self.interval, 0.0)
+
+            self.lag.observe(blocked)
+            self.max_blocked = max(self.max_blocked, blocked)
+
+    def snapshot(self):
+        return {'max_blocked_ms': self.max_blocked * 1e3, 'lag': self.lag.snapshot()}
+
+
+# Decorator for event handlers of an app with a 'metrics' attribute: records the handler latency.
+# Apply it below @set_ev_cls, so that the registered handler is the timed one.
+def timed(name):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def timed_handler(self, ev):
+            start = time.perf_counter()
+            try:
+                return handler(self, ev)
+            finally:
+                self.metrics.observe(name, time.perf_counter() - start)
+
+        return timed_handler
+
+    return decorator
+
+
+# Logs one in 'every' calls per message, and nothing at all when the level is disabled.
+# Arguments are only formatted for the calls that are logged.
+class SampledLogger:
+
+    def __init__(self, logger, every=1000):
+        self.logger = logger
+        self.every = every
+        self.calls = defaultdict(int)
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        calls = self.calls[msg]
+        self.calls[msg] = calls + 1
+        if calls % self.every == 0:
+            self.logger.log(level, msg + ' [sampled 1/%d]', *args, self.every)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+
+# REST controller of the WSGI app, 'metrics_app' is the Ryu app that provides metrics_snapshot()
+class MetricsController(ControllerBase):
+
+    def __init__(self, req, link, data, **config):
+        super(MetricsController, self).__init__(req, link, data, **config)
+        self.app = data['metrics_app']
+
+    @route('metrics', '/metrics', methods=['GET'])
+    def get_metrics(self, req, **kwargs):
+        body = json.dumps(self.app.metrics_snapshot(), default=str)
+        return Response(content_type='application/json', charset='utf-8', body=body)
@@ -0,0 +1,106 @@
+import socket
+import struct
+
+# Single-pass decoder for the packet-in fast path of the controllers. The ethernet, ARP, IPv4 and
+# IPv6 header fields that the routing apps use are unpacked once, straight from the message buffer,
+# instead of building ryu.lib.packet.Packet objects (and parsing every protocol layer) per lookup.
+# Addresses are formatted like ryu does: lower-case 'xx:xx:xx:xx:xx:xx' and dotted/colon IPs.
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_IPV6 = 0x86dd
+ETH_TYPE_LLDP = 0x88cc
+
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+ETHERNET_HEADER = struct.Struct('!6s6sH')
+VLAN_HEADER = struct.Struct('!HH')
+ARP_HEADER = struct.Struct('!HHBBH6s4s6s4s')
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+IPV6_HEADER = struct.Struct('!IHBB16s16s')
+
+
+class PacketHeaders:
+    __slots__ = ('eth_dst', 'eth_src', 'ethertype', 'vlan_id',
+                 'arp_opcode', 'arp_src_mac', 'arp_src_ip', 'arp_dst_mac', 'arp_dst_ip',
+                 'ip_proto', 'ip_src', 'ip_dst')
+
+    def __init__(self, eth_dst, eth_src, ethertype, vlan_id=None):
+        self.eth_dst = eth_dst
+        self.eth_src = eth_src
+        self.ethertype = ethertype
+        self.vlan_id = vlan_id
+
+        self.arp_opcode = None
+        self.arp_src_mac = None
+        self.arp_src_ip = None
+        self.arp_dst_mac = None
+        self.arp_dst_ip = None
+
+        # IPv4 or IPv6, depending on the ethertype
+        self.ip_proto = None
+        self.ip_src = None
+        self.ip_dst = None
+
+    @property
+    def is_arp(self):
+        return self.arp_opcode is not None
+
+    @property
+    def is_ipv4(self):
+        return self.ethertype == ETH_TYPE_IP and self.ip_src is not None
+
+    @property
+    def is_ipv6(self):
+        return self.ethertype == ETH_TYPE_IPV6 and self.ip_src is not None
+
+    @property
+    def is_lldp(self):
+        return self.ethertype == ETH_TYPE_LLDP
+
+
+# Decode a frame (bytes, bytearray or memoryview). Returns None if it is shorter than an ethernet
+# header; upper layer fields stay None if their header is truncated.
+def decode(data):
+    view = memoryview(data)
+    if len(view) < ETHERNET_HEADER.size:
+        return None
+
+    eth_dst, eth_src, ethertype = ETHERNET_HEADER.unpack_from(view, 0)
+    offset = ETHERNET_HEADER.size
+
+    # one 802.1Q tag, the ethertype of the headers is the inner one
+    vlan_id = None
+    if ethertype == ETH_TYPE_8021Q and len(view) >= offset + VLAN_HEADER.size:
+        tci, ethertype = VLAN_HEADER.unpack_from(view, offset)
+        vlan_id = tci & 0x0fff
+        offset += VLAN_HEADER.size
+
+    headers = PacketHeaders(eth_dst.hex(':'), eth_src.hex(':'), ethertype, vlan_id)
+
+    if ethertype == ETH_TYPE_ARP:
+        if len(view) >= offset + ARP_HEADER.size:
+            _, _, _, _, opcode, src_mac, src_ip, dst_mac, dst_ip = ARP_HEADER.unpack_from(view, offset)
+            headers.arp_opcode = opcode
+            headers.arp_src_mac = src_mac.hex(':')
+            headers.arp_src_ip = socket.inet_ntoa(src_ip)
+            headers.arp_dst_mac = dst_mac.hex(':')
+            headers.arp_dst_ip = socket.inet_ntoa(dst_ip)
+
+    elif ethertype == ETH_TYPE_IP:
+        if len(view) >= offset + IPV4_HEADER.size:
+            fields = IPV4_HEADER.unpack_from(view, offset)
+            headers.ip_proto = fields[6]
+            headers.ip_src = socket.inet_ntoa(fields[8])
+            headers.ip_dst = socket.inet_ntoa(fields[9])
+
+    elif ethertype == ETH_TYPE_IPV6:
+        if len(view) >= offset + IPV6_HEADER.size:
+            _, _, next_header, _, src, dst = IPV6_HEADER.unpack_from(view, offset)
+            headers.ip_proto = next_header
+            headers.ip_src = socket.inet_ntop(socket.AF_INET6, src)
+            headers.ip_dst = socket.inet_ntop(socket.AF_INET6, dst)
+
+    return headers
@@ -0,0 +1,28 @@
+# Packet-outs for packet-ins. Table-miss entries ask the switch to buffer a packet and send only its
+# first MISS_SEND_LEN bytes, which hold every header the apps decode (Ethernet, ARP, IPv4 or IPv6 and
+# the transport ports). A switch that buffered the packet gets its buffer id back in the packet-out
+# instead of the payload; a switch without buffers (buffer_id OFP_NO_BUFFER, e.g. current OVS) sent
+# the whole packet, and msg.data goes back as it is, without a copy.
+
+MISS_SEND_LEN = 128
+
+
+# Send the packet of a packet-in with 'actions' (in_port defaults to the ingress port)
+def forward(datapath, msg, actions, in_port=None):
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+
+    buffered = msg.buffer_id != ofproto.OFP_NO_BUFFER
+    out = parser.OFPPacketOut(datapath=datapath,
+                              buffer_id=msg.buffer_id,
+                              in_port=msg.match['in_port'] if in_port is None else in_port,
+                              actions=actions,
+                              data=None if buffered else msg.data)
+    datapath.send_msg(out)
+
+
+# Drop the packet of a packet-in: a buffered packet is released from the switch buffer right away,
+# an unbuffered one needs no message at all
+def drop(datapath, msg):
+    if msg.buffer_id != datapath.ofproto.OFP_NO_BUFFER:
+        forward(datapath, msg, [])
@@ -0,0 +1,160 @@
+import sys
+import time
+import heapq
+from array import array
+from collections import deque
+
+import numpy as np
+
+import topo
+from flow_sim import FlowSimulator
+from traffic import TrafficGenerator
+
+
+# Packet-level discrete-event simulator for queueing tails. Every arc (one direction of a link) has a
+# finite drop-tail output queue, a bandwidth and a propagation delay; packets of a flow follow the
+# path that the routing scheme ('sp' or 'ecmp') gives the flow.
+# There is one event per packet per hop: the arrival of the packet at the output queue of its next arc.
+# Output queues are FIFO, so the departure time of a packet is known when it is enqueued.
+class PacketSimulator:
+
+    def __init__(self, servers, switches, bw=15, delay=0.005, queue_size=100, packet_size=1500):
+        self.network = FlowSimulator(servers, switches, bw=bw)
+
+        # transmission time of one packet on every arc, in seconds
+        self.tx_time = packet_size * 8 / (self.network.capacity * 1e6)
+        self.delay = delay
+        self.queue_size = queue_size
+        self.packet_size = packet_size
+
+    # Simulate Poisson packet arrivals with 'rate' Mbit/s per flow for 'duration' seconds.
+    # Returns the latency of every packet (nan if dropped) and the flow every packet belongs to.
+    def simulate(self, sources, destinations, rate, duration, scheme='ecmp', seed=0):
+        rng = np.random.default_rng(seed)
+        n_flows = len(sources)
+
+        paths = [self.network.route(scheme, int(src), int(dst), flow_hash=(seed, flow))[0]
+                 for flow, (src, dst) in enumerate(zip(sources, destinations))]
+
+        # packet records, one array entry per packet
+        packets_per_second = rate * 1e6 / (self.packet_size * 8)
+        counts = rng.poisson(packets_per_second * duration, n_flows)
+
+        flow = np.repeat(np.arange(n_flows), counts)
+        created = rng.uniform(0, duration, len(flow))
+
+        # flat arrays instead of numpy arrays, element access is much cheaper in the event loop
+        flow_of = array('l', flow.tolist())
+        created_at = array('d', created.tolist())
+        hop = array('l', bytes(8 * len(flow)))
+        latency = array('d', [np.nan]) * len(flow)
+
+        # event queue of (time, packet)
+        events = list(zip(created_at, range(len(flow))))
+        heapq.heapify(events)
+
+        tx_time = self.tx_time.tolist()
+        delay = self.delay
+        queue_size = self.queue_size
+
+        # scheduled departure times of the packets in every output queue
+        queues = [deque() for _ in range(len(tx_time))]
+        free_at = [0.0] * len(tx_time)
+
+        path_lists = [path.tolist() for path in paths]
+        pop = heapq.heappop
+        push = heapq.heappush
+
+        while events:
+            now, packet = pop(events)
+            path = path_lists[flow_of[packet]]
+            h = hop[packet]
+
+            # packet reached its destination server
+            if h == len(path):
+                latency[packet] = now - created_at[packet]
+                continue
+
+            arc = path[h]
+            queue = queues[arc]
+
+            # packets that finished their transmission have left the queue
+            while queue and queue[0] <= now:
+                queue.popleft()
+
+            # drop-tail
+            if len(queue) >= queue_size:
+                continue
+
+            departure = max(now, free_at[arc]) + tx_time[arc]
+            free_at[arc] = departure
+            queue.append(departure)
+
+            hop[packet] = h + 1
+            push(events, (departure + delay, packet))
+
+        return np.frombuffer(latency, dtype=np.float64), flow
+
+
+# Per-flow latency percentiles (in ms) and drop rate, as an array of shape (flows, len(percentiles) + 1)
+def flow_latency(latency, flow, n_flows, percentiles=(50, 99, 99.9)):
+    result = np.full((n_flows, len(percentiles) + 1), np.nan)
+
+    order = np.argsort(flow, kind='stable')
+    boundaries = np.searchsorted(flow[order], np.arange(n_flows + 1))
+
+    for f in range(n_flows):
+        values = latency[order[boundaries[f]:boundaries[f + 1]]]
+        delivered = values[~np.isnan(values)]
+
+        if len(values):
+            result[f, -1] = 1 - len(delivered) / len(values)
+        if len(delivered):
+            result[f, :-1] = np.percentile(delivered, percentiles) * 1000
+
+    return result
+
+
+def report_latency(result, percentiles=(50, 99, 99.9)):
+    header = '|  Flows  |' + ''.join(f'  p{p:<5} (ms) |' for p in percentiles) + '  Drops  |'
+
+    print()
+    print('-' * len(header))
+    print(header)
+    print('-' * len(header))
+
+    for name, values in (('median', np.nanmedian(result, axis=0)), ('worst', np.nanmax(result, axis=0))):
+        print(f'| {name:7} |' + ''.join(f' {value:12.3f} |' for value in values[:-1]) + f' {values[-1]:7.4f} |')
+
+    print('-' * len(header))
+    print()
+
+
+# command line usage
+def main(argv):
+    usage = 'Usage: $ python3 packet_sim.py (fattree num_ports | jellyfish num_servers num_switches num_ports) (sp | ecmp) rate duration'
+
+    if len(argv) == 5 and argv[0] == 'fattree':
+        topology = topo.Fattree(int(argv[1]))
+        scheme, rate, duration = argv[2], float(argv[3]), float(argv[4])
+    elif len(argv) == 7 and argv[0] == 'jellyfish':
+        topology = topo.Jellyfish(int(argv[1]), int(argv[2]), int(argv[3]))
+        scheme, rate, duration = argv[4], float(argv[5]), float(argv[6])
+    else:
+        raise ValueError(usage)
+
+    simulator = PacketSimulator(topology.servers, topology.switches)
+
+    # random permutation traffic between the connected servers
+    sources, destinations = TrafficGenerator(topology, seed=0).random_permutation()
+
+    start = time.time()
+    latency, flow = simulator.simulate(sources, destinations, rate, duration, scheme=scheme)
+    elapsed = time.time() - start
+
+    print(f'{len(latency)} packets in {elapsed:.2f} s')
+    report_latency(flow_latency(latency, flow, len(sources)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
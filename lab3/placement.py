@@ -0,0 +1,151 @@
+import math
+import random
+from collections import defaultdict
+
+# Placement of elephant flows on the core paths of a k-ary fat-tree (Hedera, Al-Fares et al. 2010),
+# without any controller: the ElephantScheduler of hedera.py places the elephants it measured with
+# these, and benchmarks/ft_throughput.py the flows of a simulated permutation. An edge switch is
+# (pod, switch), a path is an (aggregation position, core uplink) choice.
+
+
+# Core paths between two edge switches as (aggregation position, core uplink) choices: every core
+# switch for pairs in different pods, every aggregation switch (uplink unused) within a pod
+def candidate_paths(src, dst, half):
+    if src[0] == dst[0]:
+        return [(a, 0) for a in range(half)]
+    return [(a, u) for a in range(half) for u in range(half)]
+
+
+# Directed links of a path. Core switch a * k/2 + u is connected to aggregation position a of
+# every pod, so the choice also fixes the way down.
+def path_links(src, dst, choice):
+    a, u = choice
+    if src[0] == dst[0]:
+        return [('edge-agg', src[0], src[1], a), ('agg-edge', dst[0], a, dst[1])]
+    return [('edge-agg', src[0], src[1], a), ('agg-core', src[0], a, u),
+            ('core-agg', dst[0], a, u), ('agg-edge', dst[0], a, dst[1])]
+
+
+# Natural demand of the flows, as a fraction of the host NIC rate: the rate each flow would get if it
+# was only limited by its sender and receiver NICs (max-min fair), not by the core it crosses.
+# Measured rates of colliding flows underestimate it. 'flows' is a list of (src, dst) hosts.
+def estimate_demands(flows):
+    demand = {flow: 0.0 for flow in flows}
+    converged = {flow: False for flow in flows}
+
+    by_src = defaultdict(list)
+    by_dst = defaultdict(list)
+    for flow in flows:
+        by_src[flow[0]].append(flow)
+        by_dst[flow[1]].append(flow)
+
+    changed = True
+    while changed:
+        changed = False
+
+        # senders split their remaining capacity equally among the flows that have not converged
+        for src_flows in by_src.values():
+            fixed = sum(demand[flow] for flow in src_flows if converged[flow])
+            open_flows = [flow for flow in src_flows if not converged[flow]]
+            if not open_flows:
+                continue
+
+            share = (1.0 - fixed) / len(open_flows)
+            for flow in open_flows:
+                if demand[flow] != share:
+                    demand[flow] = share
+                    changed = True
+
+        # oversubscribed receivers cap the largest flows at their fair share
+        for dst_flows in by_dst.values():
+            if sum(demand[flow] for flow in dst_flows) <= 1.0:
+                continue
+
+            limited = list(dst_flows)
+            small = 0.0
+            share = 1.0 / len(limited)
+            while True:
+                below = [flow for flow in limited if demand[flow] < share]
+                if not below:
+                    break
+                small += sum(demand[flow] for flow in below)
+                limited = [flow for flow in limited if demand[flow] >= share]
+                if not limited:
+                    break
+                share = (1.0 - small) / len(limited)
+
+            for flow in limited:
+                if demand[flow] != share or not converged[flow]:
+                    changed = changed or demand[flow] != share
+                    demand[flow] = share
+                    converged[flow] = True
+
+    return demand
+
+
+# Global first fit: every elephant, largest first, takes the first path with room for its demand on
+# all of its links. 'elephants' is a list of (key, src, dst, demand), 'order' sorts the candidate
+# paths of an elephant (least loaded first). Elephants that fit nowhere are left out.
+def global_first_fit(elephants, half, capacity, order=None):
+    reserved = defaultdict(float)
+    placement = {}
+
+    for key, src, dst, demand in sorted(elephants, key=lambda elephant: -elephant[3]):
+        paths = candidate_paths(src, dst, half)
+        if order is not None:
+            paths = order(src, dst, paths)
+
+        for choice in paths:
+            links = path_links(src, dst, choice)
+            if all(reserved[link] + demand <= capacity for link in links):
+                for link in links:
+                    reserved[link] += demand
+                placement[key] = choice
+                break
+
+    return placement
+
+
+# Traffic above capacity summed over all links, the energy of a placement
+def overload(elephants, placement, capacity):
+    load = defaultdict(float)
+    for key, src, dst, demand in elephants:
+        for link in path_links(src, dst, placement[key]):
+            load[link] += demand
+    return sum(max(0.0, value - capacity) for value in load.values())
+
+
+# Simulated annealing over the paths of all elephants: starting from 'initial' (or the first
+# candidate of each elephant), move one elephant to a random other path per step, and keep moves
+# that reduce the overload, or increase it with a probability that falls with the temperature
+def simulated_annealing(elephants, half, capacity, initial=None, iterations=1000, seed=0):
+    rng = random.Random(seed)
+    candidates = {key: candidate_paths(src, dst, half) for key, src, dst, _ in elephants}
+
+    placement = {key: candidates[key][0] for key in candidates}
+    placement.update({key: choice for key, choice in (initial or {}).items() if key in placement})
+    if not elephants:
+        return placement
+
+    energy = overload(elephants, placement, capacity)
+    best, best_energy = dict(placement), energy
+
+    keys = [elephant[0] for elephant in elephants if len(candidates[elephant[0]]) > 1]
+    for i in range(iterations if keys else 0):
+        if best_energy == 0:
+            break
+
+        temperature = capacity * (1 - i / iterations)
+        key = rng.choice(keys)
+        previous = placement[key]
+        placement[key] = rng.choice([choice for choice in candidates[key] if choice != previous])
+
+        new_energy = overload(elephants, placement, capacity)
+        if new_energy <= energy or rng.random() < math.exp((energy - new_energy) / temperature):
+            energy = new_energy
+            if energy < best_energy:
+                best, best_energy = dict(placement), energy
+        else:
+            placement[key] = previous
+
+    return best
@@ -0,0 +1,274 @@
+# ryu-manager patches the standard library before anything else is imported, and so does the replay
+from ryu.lib import hub
+hub.patch(thread=False)
+
+import os
+import sys
+import time
+import random
+import socket
+import struct
+import tempfile
+from collections import defaultdict
+
+from ryu import cfg
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+import ryu.controller.controller  # registers the ofp-* options that the apps read
+
+import topo
+import packet_decoder
+from metrics import LatencyHistogram
+from shard import k_from_env, switch_dpid
+
+
+# Offline packet-in replay: the apps (LearningSwitch of lab1, SPRouter, FTRouter) run without Mininet
+# or OVS, connected to fake datapaths, and handle a stream of EventOFPPacketIn built from synthetic
+# frames (a mix of ARP, IPv4, IPv6 and LLDP between the hosts of the fat-tree, FATTREE_K) or from a pcap
+# file. Reports events per second, handler latency percentiles and the OpenFlow messages the app sent.
+#
+# The fake switches do not match flow entries, so every frame is a packet-in, as for a switch whose
+# entries are not installed yet. Messages are serialized as a real datapath does before sending them.
+# SPRouter computes routes in its worker while the stream is replayed; the time to drain the parked
+# packet-ins is part of the measurement.
+
+# Share of every kind of frame in the synthetic stream
+MIX = {'arp': 0.2, 'ipv4': 0.6, 'ipv6': 0.1, 'lldp': 0.1}
+
+# The hub runs the green threads of the app (route worker, pollers) every YIELD_EVERY events
+YIELD_EVERY = 64
+
+LAB1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lab1')
+
+
+# Datapath of a switch that is not there: records and serializes what the app sends
+class FakeDatapath:
+
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+
+        self.messages = defaultdict(int)
+        self.bytes = 0
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & self.ofproto.MAX_XID
+        msg.set_xid(self.xid)
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+
+        self.messages[type(msg).__name__] += 1
+        self.bytes += len(msg.buf)
+        return True
+
+
+# Frames of a pcap file (Ethernet link type)
+def pcap_frames(path):
+    with open(path, 'rb') as fin:
+        data = fin.read()
+
+    order = '<' if data[:4] in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1') else '>'
+    if struct.unpack_from(order + 'I', data, 20)[0] != 1:
+        raise ValueError(f'{path} does not hold Ethernet frames')
+
+    frames = []
+    offset = 24
+    while offset + 16 <= len(data):
+        _, _, captured, _ = struct.unpack_from(order + 'IIII', data, offset)
+        offset += 16
+        frames.append(data[offset:offset + captured])
+        offset += captured
+    return frames
+
+
+# 'count' frames between random hosts of 'host_macs', of the kinds in MIX
+def synthetic_frames(host_macs, count, seed=1):
+    rng = random.Random(seed)
+    kinds = list(MIX)
+    weights = [MIX[kind] for kind in kinds]
+
+    def mac_bytes(address):
+        return bytes.fromhex(address.replace(':', ''))
+
+    def ip_bytes(host_mac):
+        return socket.inet_aton(topo.mac_to_ip(host_mac))
+
+    frames = []
+    for kind in rng.choices(kinds, weights, k=count):
+        src, dst = rng.sample(host_macs, 2)
+
+        if kind == 'arp':
+            frame = (packet_decoder.ETHERNET_HEADER.pack(b'\xff' * 6, mac_bytes(src), packet_decoder.ETH_TYPE_ARP) +
+                     packet_decoder.ARP_HEADER.pack(1, packet_decoder.ETH_TYPE_IP, 6, 4, packet_decoder.ARP_REQUEST,
+                                                    mac_bytes(src), ip_bytes(src), bytes(6), ip_bytes(dst)))
+        elif kind == 'ipv4':
+            frame = (packet_decoder.ETHERNET_HEADER.pack(mac_bytes(dst), mac_bytes(src), packet_decoder.ETH_TYPE_IP) +
+                     struct.pack('!BBHHHBBH4s4s', 0x45, 0, 92, 0, 0, 64, 17, 0, ip_bytes(src), ip_bytes(dst)) +
+                     struct.pack('!HHHH', 5001, 5001, 72, 0) + bytes(64))
+        elif kind == 'ipv6':
+            frame = (packet_decoder.ETHERNET_HEADER.pack(mac_bytes('33:33:00:00:00:02'), mac_bytes(src),
+                                                         packet_decoder.ETH_TYPE_IPV6) +
+                     struct.pack('!IHBB16s16s', 6 << 28, 8, 58, 255, socket.inet_pton(socket.AF_INET6, 'fe80::1'),
+                                 socket.inet_pton(socket.AF_INET6, 'ff02::2')) +
+                     struct.pack('!BBHI', 133, 0, 0, 0))
+        else:
+            frame = (packet_decoder.ETHERNET_HEADER.pack(mac_bytes('01:80:c2:00:00:0e'), mac_bytes(src),
+                                                         packet_decoder.ETH_TYPE_LLDP) +
+                     bytes([0x02, 0x07, 0x04]) + mac_bytes(src) + bytes([0x04, 0x02, 0x02, 0x01, 0x06, 0x02, 0x00, 0x78, 0x00, 0x00]))
+        frames.append(frame)
+
+    return frames
+
+
+# The app 'name' connected to its fake datapaths, as (app, datapaths, locate); locate(mac) is the
+# (dpid, port) that a host sends its packets in at, or None for a mac that is no host
+def make_app(name, topo_net):
+    if name == 'ls':
+        sys.path.insert(0, LAB1)
+        from learning_switch import LearningSwitch
+
+        # one switch with every host on its own port
+        app = LearningSwitch()
+        datapaths = {1: FakeDatapath(1)}
+        ports = {host_mac: port for port, host_mac in enumerate(sorted(topo_net.mac_to_id), 1)}
+        # without topology discovery the single switch floods over all of its ports
+        app.flood_ports[1] = tuple(sorted(ports.values()))
+
+        def locate(host_mac):
+            return (1, ports[host_mac]) if host_mac in ports else None
+
+    elif name == 'sp':
+        os.environ.setdefault('SP_ROUTING_CHECKPOINT', os.path.join(tempfile.mkdtemp(), 'sp_routing_%d.ckpt'))
+        from sp_routing import SPRouter
+
+        # the fabric comes from the precomputed state, as in a sharded instance, instead of the discovery
+        app = SPRouter()
+        app.load_shared_state()
+        datapaths = {switch_dpid(switch): FakeDatapath(switch_dpid(switch)) for switch in app.switches}
+        app.datapaths = datapaths
+
+        def locate(host_mac):
+            return app.host_location(host_mac) if host_mac in topo_net.mac_to_id else None
+
+    elif name == 'ft':
+        from ft_routing import FTRouter, location_to_dpid
+
+        app = FTRouter()
+        half = app.k // 2
+        dpids = [int(location_to_dpid(core=core), 16) for core in range(half ** 2)]
+        dpids += [int(location_to_dpid(pod=pod, switch=switch), 16) for pod in range(app.k) for switch in range(app.k)]
+        datapaths = {dpid: FakeDatapath(dpid) for dpid in dpids}
+
+        # host 10.pod.switch.h is on port h - 1 of its edge switch
+        def locate(host_mac):
+            if host_mac not in topo_net.mac_to_id:
+                return None
+            pod, switch, host = [int(part, 16) for part in host_mac.split(':')[3:]]
+            return int(location_to_dpid(pod=pod, switch=switch), 16), host - 1
+
+    else:
+        raise ValueError(f'Unknown app: {name}')
+
+    for datapath in datapaths.values():
+        features = ofproto_v1_3_parser.OFPSwitchFeatures(datapath, datapath_id=datapath.id)
+        app.switch_features_handler(ofp_event.EventOFPSwitchFeatures(features))
+
+    return app, datapaths, locate
+
+
+# Packet-in events of the frames, each at the switch and port of its source host (frames from
+# other macs come in at the first switch)
+def packet_in_events(frames, datapaths, locate):
+    first = min(datapaths)
+
+    events = []
+    for frame in frames:
+        dpid, port = locate(frame[6:12].hex(':')) or (first, 1)
+        datapath = datapaths[dpid]
+        msg = ofproto_v1_3_parser.OFPPacketIn(datapath, buffer_id=ofproto_v1_3.OFP_NO_BUFFER, total_len=len(frame),
+                                              reason=ofproto_v1_3.OFPR_NO_MATCH, table_id=0, cookie=0,
+                                              match=ofproto_v1_3_parser.OFPMatch(in_port=port), data=frame)
+        events.append(ofp_event.EventOFPPacketIn(msg))
+    return events
+
+
+# Wait (on the hub) until the route worker of the app, if any, has nothing left to do
+def drain(app, timeout=30.0):
+    worker = getattr(app, 'route_worker', None)
+    deadline = time.perf_counter() + timeout
+    while worker is not None and (worker.pending or getattr(app, 'parked', None)) and time.perf_counter() < deadline:
+        hub.sleep(0.001)
+
+
+# Replay the events into the packet-in handler of the app, as (events per second, latency histogram,
+# messages by type, bytes) for the replay only
+def replay(app, datapaths, events):
+    drain(app)
+    before = {dpid: (dict(datapath.messages), datapath.bytes) for dpid, datapath in datapaths.items()}
+
+    latency = LatencyHistogram()
+    handler = app._packet_in_handler
+
+    start = time.perf_counter()
+    for i, ev in enumerate(events, 1):
+        handled = time.perf_counter()
+        handler(ev)
+        latency.observe(time.perf_counter() - handled)
+
+        if i % YIELD_EVERY == 0:
+            hub.sleep(0)
+    drain(app)
+    elapsed = time.perf_counter() - start
+
+    messages = defaultdict(int)
+    sent_bytes = 0
+    for dpid, datapath in datapaths.items():
+        sent, sent_before = datapath.messages, before[dpid][0]
+        for name, count in sent.items():
+            if count - sent_before.get(name, 0):
+                messages[name] += count - sent_before.get(name, 0)
+        sent_bytes += datapath.bytes - before[dpid][1]
+
+    return len(events) / elapsed, latency, dict(messages), sent_bytes
+
+
+# command line usage
+def main(argv):
+    if len(argv) > 3:
+        raise ValueError('Usage: $ python3 replay_benchmark.py (ls|sp|ft|all) (packets) (pcap file)')
+
+    names = ['ls', 'sp', 'ft'] if not argv or argv[0] == 'all' else [argv[0]]
+    count = int(argv[1]) if len(argv) > 1 else 20000
+
+    cfg.CONF(args=[], project='ryu')
+    topo_net = topo.Fattree(k_from_env())
+    frames = pcap_frames(argv[2]) if len(argv) > 2 else synthetic_frames(sorted(topo_net.mac_to_id), count)
+
+    results = []
+    for name in names:
+        app, datapaths, locate = make_app(name, topo_net)
+        results.append((name, replay(app, datapaths, packet_in_events(frames, datapaths, locate))))
+
+    print()
+    print(f'{len(frames)} packet-ins' + (f' from {argv[2]}' if len(argv) > 2 else f', mix {MIX}'))
+    print('------------------------------------------------------------------------')
+    print('|  App  |  Events/s  |  p50 (us)  |  p99 (us)  |  Messages  |   Bytes   |')
+    print('------------------------------------------------------------------------')
+
+    for name, (rate, latency, messages, sent_bytes) in results:
+        print(f'| {name:5} | {rate:10.0f} | {latency.percentile(50) * 1e6:10.1f} | {latency.percentile(99) * 1e6:10.1f} '
+              f'| {sum(messages.values()):10} | {sent_bytes:9} |')
+
+    print('------------------------------------------------------------------------')
+    for name, (_, _, messages, _) in results:
+        print(f'{name}: ' + ', '.join(f'{message} {count}' for message, count in sorted(messages.items())))
+    print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
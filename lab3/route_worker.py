@@ -0,0 +1,143 @@
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from ryu.lib import hub
+
+import topo
+import dijkstra
+from metrics import LatencyHistogram
+from shard import select
+
+
+# Route computation off the eventlet hub. Ryu runs every handler of every app in green threads of a
+# single OS thread, so a long computation in a handler stalls the packet-ins of all switches.
+# Jobs run in a pool of OS threads (or processes); a green thread per job waits for the result with
+# hub.sleep and hands it to the callback on the hub, where flows can be sent safely.
+# ryu-manager patches the standard library with thread=False, so the pool threads are real threads.
+# With processes=True, the function and its arguments have to be picklable (module-level functions).
+class RouteWorker:
+
+    def __init__(self, max_workers=1, processes=False, poll_interval=0.002, logger=None):
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.executor = executor(max_workers=max_workers)
+        self.poll_interval = poll_interval
+        self.logger = logger
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.latency = LatencyHistogram()
+
+    # Run fn(*args) in the pool. callback(result) or errback(exception) is called on the hub when
+    # it is done. Returns the future, whose result() must not be waited for on the hub.
+    def submit(self, fn, *args, callback=None, errback=None):
+        future = self.executor.submit(fn, *args)
+        self.submitted += 1
+        hub.spawn(self.wait, future, callback, errback, time.perf_counter())
+        return future
+
+    def wait(self, future, callback, errback, submitted):
+        while not future.done():
+            hub.sleep(self.poll_interval)
+
+        self.latency.observe(time.perf_counter() - submitted)
+
+        error = future.exception()
+        if error is not None:
+            self.failed += 1
+            if self.logger is not None:
+                self.logger.warning('route computation failed: %r', error)
+            if errback is not None:
+                errback(error)
+            return
+
+        self.completed += 1
+        if callback is not None:
+            callback(future.result())
+
+    @property
+    def pending(self):
+        return self.submitted - self.completed - self.failed
+
+    def stats(self):
+        return {'submitted': self.submitted, 'completed': self.completed, 'failed': self.failed,
+                'pending': self.pending, 'latency': self.latency.snapshot()}
+
+
+# Dijkstra table (lab2) of the fat-tree with 'k' ports per switch, as (table, number of servers).
+# The topology is built in the worker, so nothing but 'k' has to cross a process boundary.
+def dijkstra_table(k):
+    topo_net = topo.Fattree(k)
+    return dijkstra.dijkstra_shortest_path(topo_net.servers, topo_net.switches)
+
+
+# The fabric as one route computation sees it: the links ({dpid: {neighbor dpid: port}}), the dpids
+# of the switch names ({name: dpid}) and the equal-cost ports known when the job was submitted. The
+# hub swaps in new link and name maps instead of changing them, so a job never sees two different ones. Ports the job computes go to its own
+# 'computed' cache; the hub adds them to the shared cache when the job is done, if the links are
+# still the same.
+class FabricView:
+
+    def __init__(self, links, shared_next_hops=None, cache=None, names=None):
+        self.links = links
+        self.names = names if names is not None else {}
+        self.shared_next_hops = shared_next_hops
+        self.known = dict(cache or {})
+        self.computed = {}
+
+        # port -> neighbor dpid of every switch
+        self.neighbors = {dpid: {port: neighbor for neighbor, port in switch_links.items()}
+                          for dpid, switch_links in links.items()}
+
+    # Output ports of every switch on all shortest paths towards the edge switch 'root', from a BFS over
+    # the links (or from the shared next hops). The ports are sorted, so the first one always gives
+    # the same tree. Switches that cannot reach 'root' have no entry.
+    def equal_cost_ports(self, root):
+        if root in self.known:
+            return self.known[root]
+        if root in self.computed:
+            return self.computed[root]
+
+        if self.shared_next_hops is not None:
+            out_ports = defaultdict(list)
+            for _, dpid, port in select(self.shared_next_hops, root).tolist():
+                out_ports[dpid].append(port)
+            self.computed[root] = dict(out_ports)
+            return self.computed[root]
+
+        dist = {root: 0}
+        queue = deque([root])
+        while queue:
+            dpid = queue.popleft()
+            for neighbor in self.links.get(dpid, {}):
+                if neighbor not in dist and dpid in self.links.get(neighbor, {}):
+                    dist[neighbor] = dist[dpid] + 1
+                    queue.append(neighbor)
+
+        out_ports = {}
+        for dpid, d in dist.items():
+            if dpid != root:
+                out_ports[dpid] = sorted(port for neighbor, port in self.links[dpid].items()
+                                         if dist.get(neighbor) == d - 1)
+
+        self.computed[root] = out_ports
+        return out_ports
+
+    # All equal-cost shortest paths between two switches, as lists of dpids; none if they are not connected
+    def equal_cost_paths(self, src_dpid, dst_dpid):
+        out_ports = self.equal_cost_ports(dst_dpid)
+        if src_dpid != dst_dpid and src_dpid not in out_ports:
+            return []
+
+        paths = []
+        stack = [[src_dpid]]
+        while stack:
+            path = stack.pop()
+            if path[-1] == dst_dpid:
+                paths.append(path)
+                continue
+            for port in reversed(out_ports[path[-1]]):
+                stack.append(path + [self.neighbors[path[-1]][port]])
+
+        return paths
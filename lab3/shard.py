@@ -0,0 +1,192 @@
+import os
+import hashlib
+from collections import defaultdict, deque
+
+import numpy as np
+
+# Sharded controller deployment: N instances of a routing app (ryu-manager --ofp-tcp-listen-port
+# BASE_PORT + i) each control the switches of some of the pods, so the packet-ins of the fabric are
+# spread over N processes. Pods are dealt round robin, core switches by their index.
+#
+# The routing state every instance needs (fabric links, next hops towards every edge switch, routing
+# tables) follows from the topology alone. The first instance precomputes it into .npy files that
+# all instances memory-map, so they share one copy in the page cache, and they all route by the same
+# tables: a path that crosses shards is the one every shard on it computed for itself.
+
+BASE_PORT = 6653
+
+# Environment of a ryu-manager instance: number of shards and, if it is not given by the listen port,
+# the index of this one; the directory of the shared routing state; the k of the fat-tree
+SHARDS_ENV = 'FATTREE_SHARDS'
+SHARD_ENV = 'FATTREE_SHARD'
+STATE_ENV = 'FATTREE_STATE'
+K_ENV = 'FATTREE_K'
+
+
+class Shard:
+
+    def __init__(self, index=0, count=1):
+        if not 0 <= index < count:
+            raise ValueError(f'Shard {index} out of range for {count} shards')
+        self.index = index
+        self.count = count
+
+    # A pod switch is given by its pod, a core switch by its core number
+    def owns(self, pod=None, core=None):
+        return shard_index(self.count, pod, core) == self.index
+
+    def __repr__(self):
+        return f'Shard({self.index}, {self.count})'
+
+
+# Index of the shard that controls a switch, out of 'count'
+def shard_index(count, pod=None, core=None):
+    return (pod if pod is not None else core) % count
+
+
+# Shard of this instance: FATTREE_SHARDS instances, this one is FATTREE_SHARD or else follows from
+# the OpenFlow port it listens on ('listen_port', None for the default port)
+def shard_from_env(listen_port=None):
+    count = int(os.environ.get(SHARDS_ENV, 1))
+    index = os.environ.get(SHARD_ENV)
+    if index is None:
+        index = (listen_port or BASE_PORT) - BASE_PORT
+    return Shard(int(index), count)
+
+
+# Number of ports per switch (k) of the fat-tree the instance controls, the k that the network was
+# started with (fattree_with_ip.py)
+def k_from_env(default=4):
+    k = int(os.environ.get(K_ENV, default))
+    if k < 2 or k % 2:
+        raise ValueError(f'{K_ENV}={k}: a fat-tree needs an even k of at least 2')
+    return k
+
+
+# Precomputed integer arrays in a directory, memory-mapped read-only
+class SharedState:
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get(STATE_ENV, '/tmp/fattree_state')
+
+    # The array 'name', built with build() and written by the first instance that needs it. It is
+    # written to a temporary file and renamed, so instances that start together never read half of it.
+    # The file name carries a digest of 'sources' (the files of the code and wiring the array follows
+    # from) and of shard.py, so after a change to them a new array is built instead of a stale one loaded.
+    def array(self, name, build, sources=()):
+        path = os.path.join(self.directory, f'{name}_{source_digest(sources)}.npy')
+
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            temporary = f'{path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as fout:
+                np.save(fout, np.asarray(build(), dtype=np.int64))
+            os.replace(temporary, path)
+
+        return np.load(path, mmap_mode='r')
+
+
+# Short digest of the contents of the files 'sources' and of this file
+def source_digest(sources):
+    digest = hashlib.sha1()
+    for source in (__file__,) + tuple(sources):
+        with open(source, 'rb') as fin:
+            digest.update(fin.read())
+    return digest.hexdigest()[:12]
+
+
+# Rows of an array sorted on its first column whose first column is 'key'
+def select(rows, key):
+    start, stop = np.searchsorted(rows[:, 0], [key, key + 1])
+    return rows[start:stop]
+
+
+# Fabric of a topo.Fattree as wired by benchmark.py and fat-tree.py (the routing of SPRouter): the
+# dpid of a switch is its topo id read as hex, its ports are numbered in the order of its edges.
+
+def switch_dpid(switch):
+    return int(str(switch.id), 16)
+
+
+# Directed switch-to-switch links as rows (dpid, neighbor dpid, port), sorted
+def fabric_links(topo_net):
+    rows = []
+    for switch in topo_net.switches:
+        for port, edge in enumerate(switch.edges, 1):
+            neighbor = edge.rnode if edge.lnode is switch else edge.lnode
+            if neighbor.type != 'server':
+                rows.append((switch_dpid(switch), switch_dpid(neighbor), port))
+    return sorted(rows)
+
+
+# Output ports of every switch on all shortest paths towards every edge switch, as rows
+# (edge dpid, dpid, port), sorted; from a BFS per edge switch over the links
+def next_hops(topo_net, links):
+    neighbors = defaultdict(dict)
+    for dpid, neighbor, port in links:
+        neighbors[dpid].setdefault(neighbor, port)
+
+    rows = []
+    for switch in topo_net.switches:
+        if switch.type != 'edge switch':
+            continue
+
+        root = switch_dpid(switch)
+        dist = {root: 0}
+        queue = deque([root])
+        while queue:
+            dpid = queue.popleft()
+            for neighbor in neighbors[dpid]:
+                if neighbor not in dist:
+                    dist[neighbor] = dist[dpid] + 1
+                    queue.append(neighbor)
+
+        for dpid, d in dist.items():
+            if dpid != root:
+                rows.extend((root, dpid, port) for neighbor, port in sorted(neighbors[dpid].items(), key=lambda item: item[1])
+                            if dist.get(neighbor) == d - 1)
+
+    return sorted(rows)
+
+
+# (pod, core number) of every switch of a topo.Fattree, by topo id: edge switches are in the pod of
+# their hosts (10.pod.switch.host), aggregation switches in the pod of their edge switches, core
+# switches are numbered in topo order and have no pod
+def switch_locations(topo_net):
+    server_pods = {int(server_id): int(host_mac.split(':')[3], 16) for host_mac, server_id in topo_net.mac_to_id.items()}
+    servers = {id(server): i for i, server in enumerate(topo_net.servers)}
+
+    locations = {}
+    for switch in topo_net.switches:
+        if switch.type == 'edge switch':
+            for edge in switch.edges:
+                neighbor = edge.rnode if edge.lnode is switch else edge.lnode
+                if neighbor.type == 'server':
+                    locations[switch.id] = (server_pods[servers[id(neighbor)]], None)
+                    break
+
+    cores = 0
+    for switch in topo_net.switches:
+        if switch.type == 'aggregate switch':
+            for edge in switch.edges:
+                neighbor = edge.rnode if edge.lnode is switch else edge.lnode
+                if neighbor.id in locations and neighbor.type == 'edge switch':
+                    locations[switch.id] = locations[neighbor.id]
+                    break
+        elif switch.type == 'core switch':
+            locations[switch.id] = (None, cores)
+            cores += 1
+
+    return locations
+
+
+# Start a Mininet network with every switch connected to one controller of net.controllers only,
+# 'shard_of' gives the index of the controller of a switch
+def start_sharded(net, shard_of):
+    net.build()
+
+    for controller in net.controllers:
+        controller.start()
+
+    for switch in net.switches:
+        switch.start([net.controllers[shard_of(switch)]])
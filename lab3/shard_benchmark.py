@@ -0,0 +1,93 @@
+import os
+import sys
+import multiprocessing
+
+import topo
+from shard import SHARD_ENV, SHARDS_ENV, k_from_env
+
+
+# Packet-in capacity of N sharded controller instances, one process each. Every instance is the real
+# app (SPRouter or FTRouter, with FATTREE_SHARDS=N and its own FATTREE_SHARD) driven by the offline
+# replay of replay_benchmark.py: it handles the packet-ins of the switches of its shard, out of one
+# stream of frames between random hosts that is the same for every N. The aggregate rate is all
+# packet-ins over the time of the slowest instance; it should grow with the number of instances, up
+# to the number of cores.
+
+
+# Whether the app instance controls the switch 'dpid'
+def owns(app, dpid):
+    if hasattr(app, 'owned_switches'):
+        return dpid in app.owned_switches
+
+    from ft_routing import dpid_to_location
+    pod, core = dpid_to_location(dpid)
+    return app.shard.owns(pod, core)
+
+
+# One controller instance: replays the packet-ins of its shard and puts (packet-ins, seconds, p99
+# handler latency) in 'results'. All instances start replaying together, once every one is set up.
+def run_instance(name, index, count, packets, barrier, results):
+    os.environ[SHARDS_ENV] = str(count)
+    os.environ[SHARD_ENV] = str(index)
+
+    # the replay patches the standard library for the hub of this process only
+    import replay_benchmark
+    from ryu import cfg
+
+    cfg.CONF(args=[], project='ryu')
+    topo_net = topo.Fattree(k_from_env())
+    app, datapaths, locate = replay_benchmark.make_app(name, topo_net)
+
+    frames = replay_benchmark.synthetic_frames(sorted(topo_net.mac_to_id), packets)
+    events = [ev for ev in replay_benchmark.packet_in_events(frames, datapaths, locate) if owns(app, ev.msg.datapath.id)]
+
+    barrier.wait()
+    rate, latency, _, _ = replay_benchmark.replay(app, datapaths, events)
+    results.put((len(events), len(events) / rate if events else 0.0, latency.percentile(99)))
+
+
+# Aggregate packet-ins per second and the worst p99 handler latency of 'count' instances running at the
+# same time
+def measure(name, count, packets):
+    barrier = multiprocessing.Barrier(count)
+    results = multiprocessing.Queue()
+
+    processes = [multiprocessing.Process(target=run_instance, args=(name, index, count, packets, barrier, results))
+                 for index in range(count)]
+    for process in processes:
+        process.start()
+
+    shares = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    handled = sum(events for events, _, _ in shares)
+    return handled / max(seconds for _, seconds, _ in shares), max(p99 for _, _, p99 in shares)
+
+
+# command line usage
+def main(argv):
+    if len(argv) > 3 or (argv and argv[0] not in ('sp', 'ft')):
+        raise ValueError('Usage: $ python3 shard_benchmark.py (sp|ft) (max instances) (packets)')
+
+    name = argv[0] if argv else 'ft'
+    max_instances = int(argv[1]) if len(argv) > 1 else os.cpu_count()
+    packets = int(argv[2]) if len(argv) > 2 else 20000
+
+    results = [(count, *measure(name, count, packets)) for count in range(1, max_instances + 1)]
+
+    print()
+    print(f'{name}, k = {k_from_env()}, {packets} packet-ins, {os.cpu_count()} cores')
+    print('--------------------------------------------------------')
+    print('|  Instances  | Packet-ins/s |  Speedup  |  p99 (us)   |')
+    print('--------------------------------------------------------')
+
+    for count, rate, p99 in results:
+        print(f'| {count:11} | {rate:12.0f} | {rate / results[0][1]:8.2f}x | {p99 * 1e6:11.1f} |')
+
+    print('--------------------------------------------------------')
+    print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,38 @@
+#!/bin/bash
+
+# Copyright 2020 Lin Wang
+
+# This code is part of the Advanced Computer Networks (2020) course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Start N instances of a routing app for a fat-tree with K ports per switch, each on its own OpenFlow
+# port (6653 + i) and REST port (8080 + i); then start the network with the same K and number of
+# controllers, e.g.
+#   $ ./shards.sh 4 ft_routing.py 6
+#   $ sudo python3 fattree_with_ip.py 6 4
+# or for sp_routing.py
+#   $ ./shards.sh 4 sp_routing.py 6
+#   $ sudo python3 benchmark.py 4 6
+
+N=${1:-2}
+APP=${2:-ft_routing.py}
+K=${3:-4}
+
+export FATTREE_SHARDS=$N
+export FATTREE_K=$K
+for ((i = 0; i < N; i++)); do
+    ryu-manager --observe-links --ofp-tcp-listen-port $((6653 + i)) --wsapi-port $((8080 + i)) "$APP" &
+done
+wait
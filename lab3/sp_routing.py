@@ -29,82 +29,394 @@ from ryu.lib.packet import ipv4
 from ryu.lib.packet import ipv6
 from ryu.lib.packet import arp
 from ryu.lib import mac
+from ryu.lib import hub
 from ryu.lib.packet import ethernet, ether_types
 from ryu.topology import event, switches
 from ryu.topology.api import get_switch, get_link
-from ryu.app.wsgi import ControllerBase
+from ryu.app.wsgi import ControllerBase, WSGIApplication
+from ryu import cfg
 
 import topo
 import dijkstra
-from collections import defaultdict
+import packet_decoder
+from arp_proxy import ArpProxy, arp_reply
+import packet_out
+from state_table import BoundedTable
+from metrics import ControllerMetrics, HubMonitor, LatencyHistogram, MetricsController, SampledLogger, timed
+from flow_queue import FlowModQueue, total_stats
+from route_worker import FabricView, RouteWorker, dijkstra_table
+from shard import SharedState, fabric_links, k_from_env, next_hops, select, shard_from_env, switch_dpid, switch_locations
+import checkpoint
+from checkpoint import FlowInventory
+import os
+import zlib
+import time
+import functools
+from collections import defaultdict, deque
 
 ETHERNET = ethernet.ethernet.__name__
 ETHERNET_MULTICAST = "ff:ff:ff:ff:ff:ff"
 ARP = arp.arp.__name__
 
-def default_dict():
-	return defaultdict(default_dict)
-
 
 class SPRouter(app_manager.RyuApp):
 
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'wsgi': WSGIApplication}
 
     def __init__(self, *args, **kwargs):
         super(SPRouter, self).__init__(*args, **kwargs)
-        self.topo_net = topo.Fattree(4)
+        # k of the fat-tree from FATTREE_K (default 4), as passed to fat-tree.py
+        self.topo_net = topo.Fattree(k_from_env())
+
+        # Controller state is bounded in size and age. Evicted host ports and paths also remove the
+        # reactive flows that were installed from them.
 
-        # Used for learning switch functioning
-        self.mac_to_port = {}
+        # Used for learning switch functioning, (dpid, mac) -> port
+        self.mac_to_port = BoundedTable(4096, ttl=300, on_evict=self.mac_evicted)
 
         # arp table
-        self.arp_table = {}
-        self.sw = {}
+        self.arp_table = BoundedTable(4096, ttl=300)
+        self.sw = BoundedTable(4096, ttl=10)
 
-        self.shortest_path_dict = default_dict()
+        self.shortest_path_dict = BoundedTable(16384, on_evict=self.path_evicted)
 
-        # calculate shortest paths between all server pairs
         self.servers = self.topo_net.servers
         self.switches = self.topo_net.switches
 
-        self.dijkstra_table, self.n_servers = dijkstra.dijkstra_shortest_path(self.servers, self.switches)
+        # Route computations run in a worker thread, the hub only installs their results. Packet-ins of a
+        # pair whose path is being computed are parked (at most max_parked per pair) and replayed after.
+        self.route_worker = RouteWorker(logger=self.logger)
+        self.parked = {}
+        self.max_parked = 64
+        self.replayed = 0
+        self.parked_dropped = 0
+
+        self.dijkstra_table, self.n_servers = None, None
+
+        # Proactive mode: install the routes between all host pairs as soon as the whole fabric is
+        # discovered, instead of on the first packet of every pair
+        self.proactive = True
+        self.flow_batch_size = 100
+        self.routes_installed = False
+        self.datapaths = {}
+
+        # Bulk flow-mods (proactive routes, reconciliation, entries at switch connect) go through a
+        # FlowModQueue per switch (flow_queue.py): one ordered, atomic bundle per flush if flow_bundles,
+        # else batches of flow_batch_size behind barriers, at most a window of batches unacknowledged
+        self.flow_bundles = False
+        self.flow_queues = {}
+        self.flow_install_latency = LatencyHistogram()
+
+        # Forwarding rules:
+        #   'pair': exact match on (in_port, eth_src, eth_dst), O(hosts^2) rules per switch
+        #   'destination': match on eth_dst only, O(hosts) rules per switch
+        #   'prefix': match on the IPv4 /24 of the destination edge switch (fat-tree addressing),
+        #             with /32 host rules only at the edge switches
+        self.rule_mode = 'destination'
+
+        # Multipath: use all equal-cost shortest paths. Destination and prefix rules point to a select
+        # group over all next hops of the switch; pair routes pick one of the paths by a hash of the pair.
+        self.multipath = True
+
+        # equal-cost output ports towards every edge switch (filled on the hub with what the route
+        # computations found, see FabricView), and the expected number of host pairs on every directed
+        # switch link, (dpid, dpid) -> load
+        self.equal_cost_cache = {}
+        self.link_load = {}
+
+        # ARP proxy seeded with every host of the topology; with arp_proxy_rules only the host
+        # ports of the edge switches send ARP to the controller, ARP from fabric ports is dropped
+        self.arp_proxy = ArpProxy(self.topo_net)
+        self.arp_proxy_rules = True
+
+        # metrics served on GET /metrics, per-packet logging is sampled and at debug level
+        self.metrics = ControllerMetrics()
+        self.sampled_log = SampledLogger(self.logger)
+        self.hub_monitor = HubMonitor()
+        self.hub_monitor.start()
+        if 'wsgi' in kwargs:
+            kwargs['wsgi'].register(MetricsController, {'metrics_app': self})
+
+        # host ports per switch dpid, FattreeNet uses the topo id of a switch as its (hex) dpid
+        self.host_ports = {int(str(switch.id), 16): [i + 1 for i, edge in enumerate(switch.edges)
+                                                     if 'server' in (edge.lnode.type, edge.rnode.type)]
+                           for switch in self.switches}
+
+        # number of (directed) switch-to-switch links that get_link reports for the complete fabric
+        self.n_fabric_links = sum(1 for switch in self.switches for edge in switch.edges
+                                  if edge.lnode.type != 'server' and edge.rnode.type != 'server')
+
+        # Sharding (shard.py): with FATTREE_SHARDS > 1 this instance controls the switches of its pods
+        # only. Its discovery only sees the links between those switches, so links and next hops come
+        # from the shared precomputed state instead, the same for every instance.
+        self.shard = shard_from_env(cfg.CONF.ofp_tcp_listen_port)
+        self.owned_switches = {int(str(switch_id), 16) for switch_id, (pod, core) in switch_locations(self.topo_net).items()
+                               if self.shard.owns(pod, core)}
+        self.shared_next_hops = None
+        if self.shard.count > 1:
+            self.load_shared_state()
+
+        # Checkpoint of the computed and installed state, serialized on the hub and written (by the route
+        # worker) whenever the installed flows changed. A restarted instance restores it, and reconciles
+        # every switch that reconnects against it (flow and group stats) instead of installing its tables
+        # again. The checkpoint lives in a directory private to the user (checkpoint.py);
+        # SP_ROUTING_CHECKPOINT overrides the path (with %d for the shard index).
+        default_path = os.path.join(checkpoint.private_directory(), 'sp_routing_%d.ckpt')
+        self.checkpoint_path = os.environ.get('SP_ROUTING_CHECKPOINT', default_path) % self.shard.index
+        self.checkpoint_interval = 5.0
+        self.inventory = FlowInventory()
+        self.reconciling = {}
+        self.recovery = {'pending': set(), 'switches': 0, 'added': 0, 'deleted': 0,
+                         'started': time.perf_counter(), 'time_ms': None, 'max_switch_ms': 0.0}
+        self.restored = self.restore()
+        self.saved_version = self.inventory.version
+        hub.spawn(self.checkpoint_loop)
+
+        # calculate shortest paths between all server pairs (unless restored); the worker runs jobs in
+        # order, so the table is ready before any path computation that needs it
+        if self.dijkstra_table is None:
+            self.dijkstra_future = self.route_worker.submit(dijkstra_table, self.topo_net.num_ports,
+                                                            callback=self.dijkstra_ready)
 
     # Topology discovery
     @set_ev_cls(event.EventSwitchEnter)
+    @set_ev_cls(event.EventLinkAdd)
+    @timed('topology')
     def get_topology_data(self, ev):
 
         # Switches and links in the network
         switch_list = get_switch(self, None)
         link_list = get_link(self, None)
 
-        # for each src name, calculate its corresponding src dpid
-        self.switch_name_to_dpid = {str(link.src.name).split("-")[0][2:] : link.src.dpid for link in link_list}
+        self.datapaths = {switch.dp.id: switch.dp for switch in switch_list}
+
+        if self.shard.count > 1:
+            # sharded: the fabric is known from the shared state, only the switches of this shard connect
+            complete = self.owned_switches <= set(self.datapaths)
+
+        else:
+            complete = len(switch_list) == len(self.switches) and len(link_list) == self.n_fabric_links
+
+        # restored from a checkpoint: its maps of the fabric are kept until the discovery has caught up
+        if self.shard.count == 1 and (complete or not self.restored):
+            self.equal_cost_cache = {}
+
+            # for each src name, calculate its corresponding src dpid
+            self.switch_name_to_dpid = {str(link.src.name).split("-")[0][2:] : link.src.dpid for link in link_list}
+
+            # for each (src, dst) switch pair, determine port_no (without overwriting dict!!!!)
+            # built aside and then swapped in, the route worker may be reading the previous one
+            switch_dpid_links = {}
+            for link in link_list:
+                if not link.src.dpid in switch_dpid_links:
+                    switch_dpid_links[link.src.dpid] = {link.dst.dpid : link.src.port_no}
+                else:
+                    if not link.dst.dpid in switch_dpid_links[link.src.dpid]:
+                        switch_dpid_links[link.src.dpid][link.dst.dpid] = link.src.port_no
+            self.switch_dpid_links = switch_dpid_links
+
+        # compute all routes in the worker once every switch and link of the topology has been discovered
+        if self.proactive and not self.routes_installed:
+            if complete:
+                self.routes_installed = True
+                view = self.fabric_view()
+                self.route_worker.submit(self.compute_all_routes, list(self.topo_net.mac_to_id), view,
+                                         callback=functools.partial(self.install_all_routes, view),
+                                         errback=self.routes_failed)
+
+    # Links, switch names and next hops of the whole fabric from the shared state (memory-mapped,
+    # computed from the topology by the first instance)
+    def load_shared_state(self):
+        k = self.topo_net.num_ports
+        state = SharedState()
+        links = state.array(f'sp_links_k{k}', lambda: fabric_links(self.topo_net), sources=(topo.__file__,))
+        self.shared_next_hops = state.array(f'sp_next_hops_k{k}', lambda: next_hops(self.topo_net, links),
+                                            sources=(topo.__file__,))
 
-        # for each (src, dst) switch pair, determine port_no (without overwriting dict!!!!)
         self.switch_dpid_links = {}
-        for link in link_list:
-            if not link.src.dpid in self.switch_dpid_links:
-                self.switch_dpid_links[link.src.dpid] = {link.dst.dpid : link.src.port_no}
-            else:
-                if not link.dst.dpid in self.switch_dpid_links[link.src.dpid]:
-                    self.switch_dpid_links[link.src.dpid][link.dst.dpid] = link.src.port_no
-            
+        for dpid, neighbor, port in links.tolist():
+            self.switch_dpid_links.setdefault(dpid, {}).setdefault(neighbor, port)
+
+        prefixes = {'edge switch': 'es_', 'aggregate switch': 'as_', 'core switch': 'cs_'}
+        self.switch_name_to_dpid = {prefixes[switch.type] + str(switch.id): switch_dpid(switch) for switch in self.switches}
+
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    @timed('switch_features')
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
+        self.metrics.watch(datapath)
+        self.inventory.watch(datapath)
+        if datapath.id not in self.owned_switches:
+            self.logger.warning("switch %x connected to %r, which does not control its pod", datapath.id, self.shard)
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        # Install entry-miss flow entry
+        # known from the checkpoint: only the differences to the recorded tables are sent
+        if datapath.id in self.recovery['pending']:
+            self.reconcile(datapath)
+            return
+
+        queue = self.flow_queue(datapath)
+
+        # Install entry-miss flow entry; the switch buffers the packet and sends its headers only
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, match, actions)
+                                          packet_out.MISS_SEND_LEN)]
+        self.add_flow(datapath, 0, match, actions, queue=queue)
+
+        if self.arp_proxy_rules:
+            self.arp_proxy.install_rules(datapath, self.host_ports.get(datapath.id, []), queue)
+
+        queue.flush()
+
+
+    # Checkpointed state: what was computed (Dijkstra table, fabric maps, paths), learned (hosts) and
+    # installed (flow inventory). 'config' has to match for a checkpoint to be restored.
+    def checkpoint_state(self):
+        return {'config': self.checkpoint_config(),
+                'dijkstra': (self.dijkstra_table, self.n_servers) if self.dijkstra_table is not None else None,
+                'switch_dpid_links': getattr(self, 'switch_dpid_links', {}),
+                'switch_name_to_dpid': getattr(self, 'switch_name_to_dpid', {}),
+                'routes_installed': self.routes_installed,
+                'link_load': self.link_load,
+                'paths': self.shortest_path_dict.snapshot(),
+                'arp_table': self.arp_table.snapshot(),
+                'mac_to_port': self.mac_to_port.snapshot(),
+                'flows': {dpid: dict(flows) for dpid, flows in self.inventory.flows.items()},
+                'groups': {dpid: dict(groups) for dpid, groups in self.inventory.groups.items()}}
+
+
+    def checkpoint_config(self):
+        return (self.topo_net.num_ports, self.shard.index, self.shard.count, self.rule_mode, self.multipath, self.proactive)
+
+
+    # Restore the checkpoint of a previous run, returns False if there is none for this configuration
+    def restore(self):
+        try:
+            state = checkpoint.load(self.checkpoint_path)
+        except PermissionError as error:
+            self.logger.warning("not restoring the checkpoint: %s", error)
+            return False
+
+        if state is None or state['config'] != self.checkpoint_config():
+            return False
+
+        if state['dijkstra'] is not None:
+            self.dijkstra_table, self.n_servers = state['dijkstra']
+        if state['switch_dpid_links']:
+            self.switch_dpid_links = state['switch_dpid_links']
+            self.switch_name_to_dpid = state['switch_name_to_dpid']
+        self.routes_installed = state['routes_installed']
+        self.link_load = state['link_load']
+
+        for table, entries in ((self.shortest_path_dict, state['paths']), (self.arp_table, state['arp_table']),
+                               (self.mac_to_port, state['mac_to_port'])):
+            for key, value in entries.items():
+                table[key] = value
+
+        self.inventory = FlowInventory(state['flows'], state['groups'])
+        self.recovery['pending'] = set(state['flows'])
+        self.logger.info("restored checkpoint %s: %d paths, %d hosts, flows of %d switches", self.checkpoint_path,
+                         len(state['paths']), len(state['arp_table']), len(state['flows']))
+        return True
+
+
+    # Write a checkpoint whenever the installed flows changed, but not while switches are reconciled.
+    # The state is serialized here on the hub, the worker only writes the bytes; a failed write is
+    # retried at the next interval.
+    def checkpoint_loop(self):
+        while True:
+            hub.sleep(self.checkpoint_interval)
+            if self.inventory.version != self.saved_version and not self.reconciling:
+                version = self.inventory.version
+                data = checkpoint.dumps(self.checkpoint_state())
+                self.route_worker.submit(checkpoint.save, self.checkpoint_path, data,
+                                         callback=functools.partial(self.checkpoint_saved, version))
+
+
+    def checkpoint_saved(self, version, _):
+        self.saved_version = max(self.saved_version, version)
+
+
+    # Ask a reconnected switch for its groups and flow entries; the fixes are sent when both arrived
+    def reconcile(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        self.reconciling[datapath.id] = {'started': time.perf_counter(), 'groups': [], 'flows': [], 'waiting': 2}
+        datapath.send_msg(parser.OFPGroupDescStatsRequest(datapath, 0))
+        datapath.send_msg(parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                                     ofproto.OFPG_ANY, 0, 0, parser.OFPMatch()))
+
+
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER)
+    @timed('group_desc_stats')
+    def group_desc_stats_reply_handler(self, ev):
+        self.reconcile_reply(ev.msg, 'groups')
+
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    @timed('flow_stats')
+    def flow_stats_reply_handler(self, ev):
+        self.reconcile_reply(ev.msg, 'flows')
+
+
+    # Collect a (multipart) stats reply of a switch that is reconciled
+    def reconcile_reply(self, msg, kind):
+        datapath = msg.datapath
+        state = self.reconciling.get(datapath.id)
+        if state is None:
+            return
+
+        state[kind].extend(msg.body)
+        if msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+
+        state['waiting'] -= 1
+        if state['waiting'] == 0:
+            self.apply_fixes(datapath, state)
+
+
+    # Groups first (flow entries may point to them), then the flow entries; the switch counts as
+    # recovered when it acknowledged them
+    def apply_fixes(self, datapath, state):
+        ofproto = datapath.ofproto
+        queue = self.flow_queue(datapath)
+
+        for mod in self.inventory.group_fixes(datapath, state['groups']):
+            queue.add(mod)
+        queue.fence()
+
+        flow_mods = self.inventory.flow_fixes(datapath, state['flows'])
+        for mod in flow_mods:
+            queue.add(mod)
+
+        deleted = sum(1 for mod in flow_mods if mod.command == ofproto.OFPFC_DELETE_STRICT)
+        queue.flush(callback=functools.partial(self.fixes_applied, datapath.id, state, len(flow_mods) - deleted, deleted))
+
+
+    def fixes_applied(self, dpid, state, added, deleted):
+        elapsed = time.perf_counter() - state['started']
+
+        recovery = self.recovery
+        recovery['switches'] += 1
+        recovery['deleted'] += deleted
+        recovery['added'] += added
+        recovery['max_switch_ms'] = max(recovery['max_switch_ms'], elapsed * 1e3)
 
+        del self.reconciling[dpid]
+        recovery['pending'].discard(dpid)
+        if not recovery['pending']:
+            recovery['time_ms'] = (time.perf_counter() - recovery['started']) * 1e3
+            self.logger.info("recovered %d switches %.1f ms after start (slowest reconciliation %.1f ms): "
+                             "%d flow entries added, %d deleted", recovery['switches'], recovery['time_ms'],
+                             recovery['max_switch_ms'], recovery['added'], recovery['deleted'])
 
-    # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+
+    # Add a flow entry to the flow-table, or queue it on 'queue' (a FlowModQueue)
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, queue=None):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -112,83 +424,126 @@ class SPRouter(app_manager.RyuApp):
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
                                 match=match, instructions=inst)
-        datapath.send_msg(mod)
+        if queue is not None:
+            queue.add(mod)
+        else:
+            datapath.send_msg(mod)
+
+
+    # Flow-mod queue of a switch, a new one when the switch reconnects
+    def flow_queue(self, datapath):
+        queue = self.flow_queues.get(datapath.id)
+        if queue is None or queue.datapath is not datapath:
+            queue = FlowModQueue(datapath, self.flow_batch_size, bundles=self.flow_bundles,
+                                 latency=self.flow_install_latency)
+            self.flow_queues[datapath.id] = queue
+        return queue
+
+
+    # Barrier replies and errors complete (or reject the bundles of) the flushes of a flow-mod queue
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    @timed('barrier_reply')
+    def barrier_reply_handler(self, ev):
+        queue = self.flow_queues.get(ev.msg.datapath.id)
+        if queue is not None:
+            queue.barrier_reply(ev.msg)
+
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    @timed('error')
+    def error_msg_handler(self, ev):
+        self.logger.warning("switch %x: error type %d code %d for xid %d", ev.msg.datapath.id,
+                            ev.msg.type, ev.msg.code, ev.msg.xid)
+        queue = self.flow_queues.get(ev.msg.datapath.id)
+        if queue is not None:
+            queue.error(ev.msg)
 
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    @timed('packet_in')
     def _packet_in_handler(self, ev):
-        msg = ev.msg
+        self.metrics.packet_in(ev.msg.datapath.id)
+        self.handle_packet_in(ev.msg)
+
+
+    # Packet-in processing, also used to replay parked packet-ins
+    def handle_packet_in(self, msg):
         datapath = msg.datapath
         dpid = datapath.id
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        # TODO: handle new packets at the controller
-
         # record in_port
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        pkt_eth = pkt.get_protocol(ethernet.ethernet)
+        # decode the headers once, the handlers below only read the decoded fields
+        headers = packet_decoder.decode(msg.data)
 
         # ignore lldp packet
-        if pkt_eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if headers is None or headers.is_lldp:
+            packet_out.drop(datapath, msg)
             return
 
         # Avoid IPV6 packet for now..
-        if pkt.get_protocol(ipv6.ipv6):
-            match = parser.OFPMatch(eth_type=pkt_eth.ethertype)
+        if headers.is_ipv6:
+            match = parser.OFPMatch(eth_type=headers.ethertype)
             actions = []
             self.add_flow(datapath, 1, match, actions)
+            packet_out.drop(datapath, msg)
             return None
         
-        dst = pkt_eth.dst
-        src = pkt_eth.src
+        dst = headers.eth_dst
+        src = headers.eth_src
 
-        arp_pkt = pkt.get_protocol(arp.arp)
+        if headers.is_arp:
+            # answered from the topology, the request never leaves the edge switch
+            if self.arp_proxy.handle(datapath, in_port, headers):
+                packet_out.drop(datapath, msg)
+                return None
 
-        if arp_pkt:
-            self.arp_table[arp_pkt.src_ip] = src
-            # self.logger.info(" ARP: %s -> %s", arp_pkt.src_ip, arp_pkt.dst_ip)
-            if self.arp_handler(msg):
+            self.arp_table[headers.arp_src_ip] = src
+            self.sampled_log.debug("ARP: %s -> %s", headers.arp_src_ip, headers.arp_dst_ip)
+            if self.arp_handler(msg, headers):
                 return None
 
         # do not calculate shortest path for arp requests
         else:
-            # only calculate shortest path between (src, dst) if it's not yet calculated
-            if not self.shortest_path_dict[(src, dst)]:
-
-                # calculate shortest path as a list
-                shortest_path = self.calculate_shortest_path(src, dst)
+            # only calculate shortest path between (src, dst) if it's not yet calculated; the packet
+            # waits for the worker and comes back through route_ready
+            if not self.shortest_path_dict.get((src, dst)):
+                self.park(msg, src, dst)
+                return None
 
-                # shortest path becomes value of current (src, dst) pair
-                self.shortest_path_dict[(src, dst)] = shortest_path
 
-        
-        self.mac_to_port.setdefault(dpid, {})
+        # update mac_to_port; the first port a host is learned at is kept, and every packet-in from it
+        # sets the entry again, so its ttl only runs out for a host that has gone quiet
+        if self.mac_to_port.get((dpid, src), in_port) == in_port:
+            self.mac_to_port[(dpid, src)] = in_port
 
-        # update mac_to_port
-        if not src in self.mac_to_port[dpid]:
-            self.mac_to_port[dpid][src] = in_port
+        shortest_path = self.shortest_path_dict.get((src, dst))
 
         # direct ARP packets to dst (ff:ff:ff... not in shortest path)
-        if arp_pkt and dst in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst]
+        if headers.is_arp and (dpid, dst) in self.mac_to_port:
+            out_port = self.mac_to_port[(dpid, dst)]
         
         # else if we know the shortest path for the (src, dst) pair
-        elif self.shortest_path_dict[(src, dst)]:
+        elif shortest_path:
 
-            # index of next hop in the shorest path list
-            next_hop_index = self.shortest_path_dict[(src, dst)].index(dpid) + 1
+            # a switch that is not on the path (the last entry is the destination server id) drops the packet
+            if dpid not in shortest_path[:-1]:
+                packet_out.drop(datapath, msg)
+                return None
 
-            # next hop is the destination
-            if next_hop_index == len(self.shortest_path_dict[(src, dst)]) - 1:
-                out_port = self.mac_to_port[dpid][dst]
+            # index of next hop in the shorest path list
+            next_hop_index = shortest_path.index(dpid) + 1
 
-            # else if next hop is in shortest path
-            elif dpid in self.shortest_path_dict[(src, dst)][:-1]:
+            # next hop is the destination: its port comes from the topology, the proxy answers all ARP
+            # so the port is never learned at the last switch
+            if next_hop_index == len(shortest_path) - 1:
+                _, out_port = self.host_location(dst)
 
-                next_dpid = self.shortest_path_dict[(src, dst)][next_hop_index]
+            else:
+                next_dpid = shortest_path[next_hop_index]
                 out_port = self.switch_dpid_links[dpid][next_dpid]
 
         # FLOOD if packet is not ARP and shortest path for (src, dst) is unknown
@@ -201,24 +556,60 @@ class SPRouter(app_manager.RyuApp):
 
         # install a flow to avoid packet_in next time
         if out_port != ofproto.OFPP_FLOOD:
-            # self.logger.info("install flow_mode:%s -> %s", in_port, out_port)
-            match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_src=src)
+            self.sampled_log.debug("install flow_mod: %s -> %s", in_port, out_port)
+            if self.rule_mode == 'pair':
+                match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_src=src)
+            else:
+                # the rest of a shortest path is a shortest path, so every source can share the rule
+                match = parser.OFPMatch(eth_dst=dst)
             self.add_flow(datapath, priority, match, actions)
 
-        data = None
-        if msg.buffer_id == ofproto.OFP_NO_BUFFER:
-            data = msg.data
+        # Construct packet_out message and send it, by buffer id if the switch buffered the packet
+        packet_out.forward(datapath, msg, actions, in_port)
+
+
+    # Park a packet-in until the path of (src, dst) is computed, the first one starts the computation
+    def park(self, msg, src, dst):
+        parked = self.parked.setdefault((src, dst), [])
+        if len(parked) >= self.max_parked:
+            self.parked_dropped += 1
+            packet_out.drop(msg.datapath, msg)
+            return
+
+        parked.append(msg)
+        if len(parked) == 1:
+            view = self.fabric_view()
+            self.route_worker.submit(self.route, src, dst, view,
+                                     callback=functools.partial(self.route_ready, src, dst, view),
+                                     errback=functools.partial(self.route_failed, src, dst))
+
+
+    # The path of (src, dst) is computed: store it, and replay the parked packet-ins
+    def route_ready(self, src, dst, view, shortest_path):
+        self.cache_ports(view)
 
-        # Construct packet_out message and send it
-        out = parser.OFPPacketOut(datapath=datapath,
-                                  in_port=in_port,
-                                  actions=actions,
-                                  buffer_id=msg.buffer_id,
-                                  data=data)
-        datapath.send_msg(out)
+        # shortest path becomes value of current (src, dst) pair
+        self.shortest_path_dict[(src, dst)] = shortest_path
 
+        for msg in self.parked.pop((src, dst), []):
+            self.replayed += 1
+            self.handle_packet_in(msg)
+
+
+    # No path (unknown hosts): the parked packet-ins are dropped
+    def route_failed(self, src, dst, error):
+        self.parked_dropped += len(self.parked.pop((src, dst), []))
+
+
+    def dijkstra_ready(self, table):
+        self.dijkstra_table, self.n_servers = table
+
+
+    # Runs in the route worker (it waits for the Dijkstra table there), the switch names come from 'view'
+    def calculate_shortest_path(self, src_mac, dst_mac, view):
+        if self.dijkstra_table is None:
+            self.dijkstra_table, self.n_servers = self.dijkstra_future.result()
 
-    def calculate_shortest_path(self, src_mac, dst_mac):
 
         # translate src_mac and dst_mac to a server id, by leveraging topo structure
         src_server_id = int(self.topo_net.mac_to_id[src_mac])
@@ -240,7 +631,7 @@ class SPRouter(app_manager.RyuApp):
                 name = 'cs_' + str(id)
                 
             # determine dpid for each switch in shortest path
-            dpid = self.switch_name_to_dpid[name]
+            dpid = view.names[name]
 
             # append destination server to shortest path
             dpid_shortest_path.append(dpid)
@@ -251,72 +642,344 @@ class SPRouter(app_manager.RyuApp):
         return dpid_shortest_path
 
 
-    def arp_handler(self, msg):
+    # Edge switch (dpid) and port that a host (given by its mac) is connected to. Mininet numbers the
+    # ports of a switch in the order its links are added, which follows the edge order of the topo graph.
+    # Route computations pass their 'view', the hub uses the current switch names.
+    def host_location(self, host_mac, view=None):
+        names = view.names if view is not None else self.switch_name_to_dpid
+        server = self.servers[int(self.topo_net.mac_to_id[host_mac])]
+        edge = server.edges[0]
+        switch = edge.rnode if edge.lnode is server else edge.lnode
+        return names['es_' + str(switch.id)], switch.edges.index(edge) + 1
+
+
+    # The fabric for a route computation in the worker: the current links and equal-cost ports
+    def fabric_view(self):
+        return FabricView(getattr(self, 'switch_dpid_links', {}), self.shared_next_hops, self.equal_cost_cache,
+                          getattr(self, 'switch_name_to_dpid', {}))
+
+
+    # A route computation is done: keep the equal-cost ports it computed, unless the links changed since
+    def cache_ports(self, view):
+        if view.links is self.switch_dpid_links:
+            self.equal_cost_cache.update(view.computed)
+
+
+    # Path of a host pair like calculate_shortest_path (dpids, then the destination server id). With
+    # multipath, one of the equal-cost paths of 'view' (a FabricView) is picked by a stable hash of the pair.
+    def route(self, src_mac, dst_mac, view):
+        if not self.multipath:
+            return self.calculate_shortest_path(src_mac, dst_mac, view)
+
+        src_dpid, _ = self.host_location(src_mac, view)
+        dst_dpid, _ = self.host_location(dst_mac, view)
+
+        paths = view.equal_cost_paths(src_dpid, dst_dpid)
+        if not paths:
+            raise ValueError(f'No path from {src_mac} to {dst_mac}')
+        path = paths[zlib.crc32(f'{src_mac}-{dst_mac}'.encode()) % len(paths)]
+        return path + [int(self.topo_net.mac_to_id[dst_mac])]
+
+
+    # Output of a switch towards a destination: a port, or a tuple of ports for a select group
+    def next_hop_output(self, ports):
+        if self.multipath and len(ports) > 1:
+            return tuple(ports)
+        return ports[0]
+
+
+    # Flow entries of all host pairs as {dpid: [(match fields, out_port)]}, per pair of hosts.
+    # The path of every pair is stored in 'paths'.
+    def pair_rules(self, host_macs, paths, view):
+        rules = defaultdict(list)
+
+        for src in host_macs:
+            for dst in host_macs:
+                if src == dst:
+                    continue
+
+                shortest_path = self.route(src, dst, view)
+                paths[(src, dst)] = shortest_path
+
+                # walk the switches of the path, the last entry is the destination server
+                _, in_port = self.host_location(src, view)
+                for i, dpid in enumerate(shortest_path[:-1]):
+                    if i == len(shortest_path) - 2:
+                        _, out_port = self.host_location(dst, view)
+                    else:
+                        next_dpid = shortest_path[i + 1]
+                        out_port = view.links[dpid][next_dpid]
+
+                    rules[dpid].append(({'in_port': in_port, 'eth_dst': dst, 'eth_src': src}, out_port))
+
+                    if i < len(shortest_path) - 2:
+                        in_port = view.links[next_dpid][dpid]
+
+        return rules
+
+
+    # Flow entries per destination host (eth_dst), or per destination edge switch (IPv4 /24 prefix)
+    def destination_rules(self, host_macs, view, prefix=False):
+        rules = defaultdict(list)
+
+        hosts_per_switch = defaultdict(list)
+        for host_mac in host_macs:
+            root, port = self.host_location(host_mac, view)
+            hosts_per_switch[root].append((host_mac, port))
+
+        for root, hosts in hosts_per_switch.items():
+            out_ports = {dpid: self.next_hop_output(ports) for dpid, ports in view.equal_cost_ports(root).items()}
+
+            for host_mac, port in hosts:
+                if prefix:
+                    rules[root].append(({'eth_type': ether_types.ETH_TYPE_IP, 'ipv4_dst': topo.mac_to_ip(host_mac)}, port))
+                    continue
+
+                rules[root].append(({'eth_dst': host_mac}, port))
+                for dpid, out_port in out_ports.items():
+                    rules[dpid].append(({'eth_dst': host_mac}, out_port))
+
+            if prefix:
+                # all hosts of an edge switch share 10.pod.switch.0/24
+                subnet = topo.mac_to_ip(hosts[0][0]).rsplit('.', 1)[0] + '.0'
+                for dpid, out_port in out_ports.items():
+                    rules[dpid].append(({'eth_type': ether_types.ETH_TYPE_IP, 'ipv4_dst': (subnet, '255.255.255.0')}, out_port))
+
+        return rules
+
+
+    # Compute the routes between all host pairs, in the route worker: returns the flow entries per
+    # switch, the path per host pair (pair rules only) and the expected load of every link
+    def compute_all_routes(self, host_macs, view):
+        paths = {}
+
+        if self.rule_mode == 'pair':
+            rules = self.pair_rules(host_macs, paths, view)
+        elif self.rule_mode == 'destination':
+            rules = self.destination_rules(host_macs, view)
+        elif self.rule_mode == 'prefix':
+            rules = self.destination_rules(host_macs, view, prefix=True)
+        else:
+            raise ValueError(f'Unknown rule mode: {self.rule_mode}')
+
+        return rules, paths, self.path_utilization(host_macs, paths, view)
+
+
+    # The computation failed (the topology changed under it), it is retried on the next topology event
+    def routes_failed(self, error):
+        self.routes_installed = False
+
+
+    # Push the flow entries of every switch (from compute_all_routes) through its flow-mod queue. The
+    # hub is yielded after every switch, so packet-ins are handled in between; the queues send their
+    # batches as the barrier replies come in.
+    def install_all_routes(self, view, routes):
+        rules, paths, self.link_load = routes
+        self.cache_ports(view)
+
+        for (src, dst), shortest_path in paths.items():
+            self.shortest_path_dict[(src, dst)] = shortest_path
+
+        # the switches of other shards get their entries from their own instance
+        installing = {dpid for dpid in rules if dpid in self.datapaths}
+        started = time.perf_counter()
+
+        for dpid in sorted(installing):
+            switch_rules = rules[dpid]
+            datapath = self.datapaths[dpid]
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            queue = self.flow_queue(datapath)
+
+            # one select group per distinct set of next hops, installed before the entries using it
+            groups = {}
+            for _, out_port in switch_rules:
+                if isinstance(out_port, tuple) and out_port not in groups:
+                    groups[out_port] = len(groups) + 1
+                    self.add_select_group(datapath, groups[out_port], out_port, queue)
+            queue.fence()
+
+            for fields, out_port in switch_rules:
+                match = parser.OFPMatch(**fields)
+                if isinstance(out_port, tuple):
+                    actions = [parser.OFPActionGroup(groups[out_port])]
+                else:
+                    actions = [parser.OFPActionOutput(out_port)]
+                self.add_flow(datapath, ofproto.OFP_DEFAULT_PRIORITY, match, actions, queue=queue)
+
+            queue.flush(callback=functools.partial(self.routes_acknowledged, dpid, installing, started))
+            hub.sleep(0)
+
+        self.logger.info("proactively installed %d %s flows on %d switches (at most %d per switch)",
+                         sum(len(switch_rules) for switch_rules in rules.values()), self.rule_mode, len(rules),
+                         max(len(switch_rules) for switch_rules in rules.values()))
+
+        loads = list(self.link_load.values())
+        self.logger.info("path utilization: %d of %d links used, %.1f host pairs per link on average, at most %.1f",
+                         len(loads), sum(len(links) for links in self.switch_dpid_links.values()),
+                         sum(loads) / max(len(loads), 1), max(loads, default=0))
+
+
+    # All switches of 'installing' acknowledged their routes: log the installation time
+    def routes_acknowledged(self, dpid, installing, started):
+        installing.discard(dpid)
+        if not installing:
+            self.logger.info("routes acknowledged by all switches %.1f ms after the installation started",
+                             (time.perf_counter() - started) * 1e3)
+
+
+    # Select group that hashes every flow onto one of 'ports'
+    def add_select_group(self, datapath, group_id, ports, queue=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        buckets = [parser.OFPBucket(weight=1, watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                    actions=[parser.OFPActionOutput(port)])
+                   for port in ports]
+
+        mod = parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_SELECT, group_id, buckets)
+        if queue is not None:
+            queue.add(mod)
+        else:
+            datapath.send_msg(mod)
+
+
+    # Expected number of host pairs on every directed switch link: pair routes count on their path,
+    # destination routes split evenly over the ports of a select group at every hop
+    def path_utilization(self, host_macs, paths, view):
+        load = defaultdict(float)
+
+        if self.rule_mode == 'pair':
+            for (src, dst) in [(src, dst) for src in host_macs for dst in host_macs if src != dst]:
+                path = paths.get((src, dst))
+                if path:
+                    for u, v in zip(path[:-2], path[1:-1]):
+                        load[(u, v)] += 1
+            return dict(load)
+
+        for dst in host_macs:
+            root, _ = self.host_location(dst, view)
+            out_ports = view.equal_cost_ports(root)
+
+            for src in host_macs:
+                start, _ = self.host_location(src, view)
+                if src == dst or (start != root and start not in out_ports):
+                    continue
+
+                frontier = {start: 1.0}
+                while frontier:
+                    next_frontier = defaultdict(float)
+                    for dpid, weight in frontier.items():
+                        if dpid == root:
+                            continue
+                        ports = out_ports[dpid] if self.multipath else out_ports[dpid][:1]
+                        for port in ports:
+                            neighbor = view.neighbors[dpid][port]
+                            load[(dpid, neighbor)] += weight / len(ports)
+                            next_frontier[neighbor] += weight / len(ports)
+                    frontier = next_frontier
+
+        return dict(load)
+
+
+    # A learned host port left mac_to_port: remove the reactive flows towards that host from the switch.
+    # Proactive routes do not depend on learned state and stay installed.
+    def mac_evicted(self, key, port, reason):
+        dpid, host_mac = key
+        if not self.routes_installed and dpid in self.datapaths:
+            self.delete_flows(self.datapaths[dpid], eth_dst=host_mac)
+
+
+    # A path left shortest_path_dict: remove its reactive (src, dst) flows from the switches on the path.
+    # Destination rules are shared by all sources and are kept.
+    def path_evicted(self, key, path, reason):
+        src, dst = key
+        if self.routes_installed or self.rule_mode != 'pair':
+            return
+
+        for dpid in path[:-1]:
+            if dpid in self.datapaths:
+                self.delete_flows(self.datapaths[dpid], eth_src=src, eth_dst=dst)
+
+
+    # Delete all flow entries that match the given fields
+    def delete_flows(self, datapath, **fields):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch(**fields))
+        datapath.send_msg(mod)
+
+
+    # Everything that GET /metrics reports
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot(self.table_stats())
+        snapshot['arp_proxy'] = {'replies': self.arp_proxy.replies, 'dropped': self.arp_proxy.dropped}
+        snapshot['link_load'] = {f'{u:x}->{v:x}': load for (u, v), load in self.link_load.items()}
+        snapshot['hub'] = self.hub_monitor.snapshot()
+        snapshot['recovery'] = dict(self.recovery, pending=len(self.recovery['pending']))
+        snapshot['shard'] = {'index': self.shard.index, 'count': self.shard.count, 'switches': len(self.owned_switches)}
+        snapshot['route_worker'] = self.route_worker.stats()
+        snapshot['flow_queues'] = total_stats(list(self.flow_queues.values()), self.flow_install_latency)
+        snapshot['parked'] = {'pairs': len(self.parked), 'packets': sum(len(msgs) for msgs in self.parked.values()),
+                              'replayed': self.replayed, 'dropped': self.parked_dropped}
+        return snapshot
+
+
+    # Occupancy and eviction counters of the controller tables
+    def table_stats(self):
+        return {'mac_to_port': self.mac_to_port.stats(), 'arp_table': self.arp_table.stats(),
+                'sw': self.sw.stats(), 'shortest_path_dict': self.shortest_path_dict.stats()}
+
+
+    # 'headers' are the decoded headers of the packet-in (packet_decoder.decode)
+    def arp_handler(self, msg, headers):
         datapath = msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        arp_pkt = pkt.get_protocol(arp.arp)
-
-        if eth:
-            eth_dst = eth.dst
-            eth_src = eth.src
+        eth_dst = headers.eth_dst
+        eth_src = headers.eth_src
 
         # Break the loop for avoiding ARP broadcast storm
         if eth_dst == mac.BROADCAST_STR:  # and arp_pkt:
-            arp_dst_ip = arp_pkt.dst_ip
-            arp_src_ip = arp_pkt.src_ip
+            arp_dst_ip = headers.arp_dst_ip
+            arp_src_ip = headers.arp_src_ip
 
             if (datapath.id, arp_src_ip, arp_dst_ip) in self.sw:
                 # packet come back at different port.
                 if self.sw[(datapath.id, arp_src_ip, arp_dst_ip)] != in_port:
-                    datapath.send_packet_out(in_port=in_port, actions=[])
+                    packet_out.drop(datapath, msg)
                     return True
             else:
                 # self.sw.setdefault((datapath.id, eth_src, arp_dst_ip), None)
                 self.sw[(datapath.id, arp_src_ip, arp_dst_ip)] = in_port
                 # print(self.sw)
-                self.mac_to_port.setdefault(datapath.id, {})
-                self.mac_to_port[datapath.id][eth_src] = in_port
+                self.mac_to_port[(datapath.id, eth_src)] = in_port
 
         # Try to reply arp request
-        if arp_pkt:
+        if headers.is_arp:
             
-            if arp_pkt.opcode == arp.ARP_REQUEST:
-                arp_src_ip = arp_pkt.src_ip
-                arp_dst_ip = arp_pkt.dst_ip
+            if headers.arp_opcode == arp.ARP_REQUEST:
+                arp_src_ip = headers.arp_src_ip
+                arp_dst_ip = headers.arp_dst_ip
 
                 if arp_dst_ip in self.arp_table:
                     actions = [parser.OFPActionOutput(in_port)]
-                    ARP_Reply = packet.Packet()
 
-                    ARP_Reply.add_protocol(ethernet.ethernet(
-                        ethertype=eth.ethertype,
-                        dst=eth_src,
-                        src=self.arp_table[arp_dst_ip]))
-                    ARP_Reply.add_protocol(arp.arp(
-                        opcode=arp.ARP_REPLY,
-                        src_mac=self.arp_table[arp_dst_ip],
-                        src_ip=arp_dst_ip,
-                        dst_mac=eth_src,
-                        dst_ip=arp_src_ip))
-
-                    ARP_Reply.serialize()
+                    # the reply is packed straight into bytes, the request is released from the switch buffer
+                    data = arp_reply(self.arp_table[arp_dst_ip], arp_dst_ip, eth_src, arp_src_ip)
 
                     out = parser.OFPPacketOut(
                         datapath=datapath,
                         buffer_id=ofproto.OFP_NO_BUFFER,
                         in_port=ofproto.OFPP_CONTROLLER,
-                        actions=actions, data=ARP_Reply.data)
+                        actions=actions, data=data)
                     datapath.send_msg(out)
+                    packet_out.drop(datapath, msg)
                     # print("ARP_Reply")
                     return True
         return False
-
-
-
-print('Running..')
-SPRouter()
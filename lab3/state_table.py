@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+# Size-bounded controller state with optional expiry. Entries are kept in least-recently-used order:
+# inserting into a full table evicts the least recently used entry, and entries older than 'ttl'
+# seconds (since they were last set) are dropped when they are read or when the table is swept.
+# on_evict(key, value, reason) is called for every entry that leaves the table because of the size
+# bound ('evicted') or its age ('expired'), so the owner can remove the flows that depend on it.
+# Reading a missing key never inserts it.
+class BoundedTable(MutableMapping):
+
+    def __init__(self, max_size, ttl=None, on_evict=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.clock = clock
+
+        # key -> (value, expiry time)
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and not self.expire(key, entry)
+
+    def __getitem__(self, key):
+        entry = self.entries.get(key)
+
+        if entry is None or self.expire(key, entry):
+            self.misses += 1
+            raise KeyError(key)
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        expiry = self.clock() + self.ttl if self.ttl is not None else None
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        elif len(self.entries) >= self.max_size:
+            old_key, (old_value, _) = self.entries.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old_key, old_value, 'evicted')
+
+        self.entries[key] = (value, expiry)
+
+    def __delitem__(self, key):
+        del self.entries[key]
+
+    # Drop the entry if it is expired, returns True if it was
+    def expire(self, key, entry):
+        if entry[1] is None or entry[1] > self.clock():
+            return False
+
+        del self.entries[key]
+        self.expirations += 1
+        if self.on_evict is not None:
+            self.on_evict(key, entry[0], 'expired')
+        return True
+
+    # Drop all expired entries
+    def sweep(self):
+        for key, entry in list(self.entries.items()):
+            self.expire(key, entry)
+
+    # Live entries as a dict, without counting hits or changing their order
+    def snapshot(self):
+        self.sweep()
+        return {key: value for key, (value, _) in self.entries.items()}
+
+    # Occupancy and eviction counters
+    def stats(self):
+        self.sweep()
+        return {'size': len(self.entries), 'max_size': self.max_size,
+                'occupancy': len(self.entries) / self.max_size,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses else None,
+                'evictions': self.evictions, 'expirations': self.expirations}
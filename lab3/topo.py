@@ -74,6 +74,11 @@ def location_to_mac(pod, switch, host):
     return '00:00:00:%02x:%02x:%02x' % (pod, switch, host)
 
 
+def mac_to_ip(mac):
+    pod, switch, host = [int(part, 16) for part in mac.split(':')[3:]]
+    return '10.%d.%d.%d' % (pod, switch, host)
+
+
 class Jellyfish:
 
     def __init__(self, num_servers, num_switches, num_ports, network_report=False):
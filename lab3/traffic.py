@@ -0,0 +1,144 @@
+import os
+import re
+import sys
+
+import numpy as np
+
+# adjacency.py is shared with lab2 (appended, the topo.py of lab3 comes first)
+LAB2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lab2')
+if LAB2 not in sys.path:
+    sys.path.append(LAB2)
+
+from adjacency import server_attachment
+
+
+# Seeded traffic patterns over the server index of a topo instance (the position in topology.servers).
+# Every pattern returns two NumPy arrays (sources, destinations) so that benchmark.py, the simulators
+# and the analysis scripts can run on identical workloads. Only servers that are connected to a switch
+# take part.
+class TrafficGenerator:
+
+    def __init__(self, topology, seed=0):
+        self.rng = np.random.default_rng(seed)
+
+        attachment = server_attachment(topology.servers, topology.switches)
+        self.servers = np.flatnonzero(attachment >= 0)
+
+        edge = attachment[self.servers]
+        pod = self.server_pods(topology, self.servers, edge)
+
+        # sort the servers by (pod, edge switch), so that both groups are contiguous blocks
+        order = np.lexsort((edge, pod))
+        self.servers = self.servers[order]
+        self.edge = edge[order]
+        self.pod = pod[order]
+
+        self.positions = np.arange(len(self.servers))
+
+        # first position and size of the edge switch and pod block of every server
+        _, edge_first, edge_inverse, edge_size = np.unique(self.edge, return_index=True, return_inverse=True,
+                                                           return_counts=True)
+        _, pod_first, pod_inverse, pod_size = np.unique(self.pod, return_index=True, return_inverse=True,
+                                                        return_counts=True)
+        self.edge_first = edge_first[edge_inverse]
+        self.edge_size = edge_size[edge_inverse]
+        self.pod_first = pod_first[pod_inverse]
+        self.pod_size = pod_size[pod_inverse]
+
+    # Pod of every server: from the host MAC addresses (00:00:00:pod:switch:host) of a fat-tree,
+    # otherwise every edge switch is a pod of its own
+    @staticmethod
+    def server_pods(topology, servers, edge):
+        mac_to_id = getattr(topology, 'mac_to_id', None)
+
+        if not mac_to_id:
+            return edge.copy()
+
+        pods = np.empty(len(topology.servers), dtype=np.int64)
+        for mac, server_id in mac_to_id.items():
+            pods[int(server_id)] = int(re.match('00:00:00:([0-9a-f]+):', mac).group(1), 16)
+
+        return pods[servers]
+
+    # Every server sends to exactly one other server and receives from exactly one
+    def random_permutation(self):
+        n = len(self.servers)
+        destinations = self.rng.permutation(n)
+
+        # resolve servers that drew themselves by rotating them among each other
+        fixed = np.flatnonzero(destinations == self.positions)
+        if len(fixed) > 1:
+            destinations[fixed] = destinations[np.roll(fixed, 1)]
+        elif len(fixed) == 1 and n > 1:
+            other = (fixed[0] + 1 + self.rng.integers(n - 1)) % n
+            destinations[fixed[0]], destinations[other] = destinations[other], destinations[fixed[0]]
+
+        return self.servers, self.servers[destinations]
+
+    # Server i sends to server (i + stride) mod n
+    def stride(self, stride):
+        destinations = (self.positions + stride) % len(self.servers)
+        return self.servers, self.servers[destinations]
+
+    # With probability p a server sends to one of 'hotspots' random servers, otherwise to a random server
+    def hotspot(self, hotspots=1, p=0.5):
+        n = len(self.servers)
+        spots = self.rng.choice(n, size=hotspots, replace=False)
+
+        destinations = self.random_other(self.positions, 0, n)
+        to_spot = self.rng.random(n) < p
+        destinations[to_spot] = spots[self.rng.integers(hotspots, size=to_spot.sum())]
+
+        # hotspots do not send to themselves
+        keep = destinations != self.positions
+        return self.servers[keep], self.servers[destinations[keep]]
+
+    # Every ordered pair of different servers
+    def all_to_all(self):
+        src, dst = np.meshgrid(self.positions, self.positions, indexing='ij')
+        keep = src != dst
+        return self.servers[src[keep]], self.servers[dst[keep]]
+
+    # Every unordered pair once (i < j), like the ping loop of benchmark.py
+    def all_pairs(self):
+        src, dst = np.triu_indices(len(self.servers), k=1)
+        return self.servers[src], self.servers[dst]
+
+    # Staggered probability traffic from the fat-tree paper: with probability edge_p the destination
+    # is on the same edge switch, with probability pod_p in the same pod, otherwise in another pod
+    def staggered(self, edge_p=0.5, pod_p=0.3):
+        n = len(self.servers)
+        draw = self.rng.random(n)
+
+        same_edge = draw < edge_p
+        same_pod = ~same_edge & (draw < edge_p + pod_p)
+        other_pod = ~same_edge & ~same_pod
+
+        # fall back to a wider group when the narrow one has no other server
+        same_edge &= self.edge_size > 1
+        same_pod &= self.pod_size > self.edge_size
+        other_pod |= ~same_edge & ~same_pod
+        other_pod &= self.pod_size < n
+
+        destinations = self.random_other(self.positions, 0, n)
+
+        i = same_edge
+        destinations[i] = self.random_other(self.positions[i], self.edge_first[i], self.edge_size[i])
+
+        i = same_pod
+        destinations[i] = self.random_outside(self.edge_first[i], self.edge_size[i], self.pod_first[i], self.pod_size[i])
+
+        i = other_pod
+        destinations[i] = self.random_outside(self.pod_first[i], self.pod_size[i], 0, n)
+
+        return self.servers, self.servers[destinations]
+
+    # Random position in the block [first, first + size) other than 'own', the block has at least two servers
+    def random_other(self, own, first, size):
+        pick = first + self.rng.integers(size - 1, size=len(own))
+        return np.where(pick >= own, pick + 1, pick)
+
+    # Random position in the block [first, first + size) outside the inner block [inner_first, inner_first + inner_size)
+    def random_outside(self, inner_first, inner_size, first, size):
+        pick = first + self.rng.integers(size - inner_size, size=len(inner_first))
+        return np.where(pick >= inner_first, pick + inner_size, pick)